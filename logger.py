@@ -1,26 +1,98 @@
 from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import gzip
 import logging
 import os
-from datetime import datetime as dt
+import queue
+import shutil
 from config import config
 
 
 LOG_FILE_PATH = Path(__file__).parent / 'logs' / 'cortex.log'
 
 # Logging
-def rotate_logs() -> None:
-    if os.path.exists(LOG_FILE_PATH):
-        os.rename(LOG_FILE_PATH, f'{LOG_FILE_PATH}.{dt.now().strftime("%Y-%m-%d_%H-%M-%S")}')
+def gzip_namer(name: str) -> str:
+    return f'{name}.gz'
 
-rotate_logs()
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(LOG_FILE_PATH, 'a', 'utf-8')
-handler.setLevel(logging.getLevelNamesMapping()[config['logLevel']])
+def gzip_rotator(source: str, dest: str) -> None:
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+LOG_FILE_PATH.parent.mkdir(exist_ok=True)
+# Appends across runs and only rolls over on size, importing the bot (tests, benchmarks) never rotates away history
+handler = RotatingFileHandler(
+    LOG_FILE_PATH, 'a', maxBytes=config.get('logMaxBytes', 10 * 1024 * 1024), backupCount=config.get('logBackupCount', 10),
+    encoding='utf-8', delay=True,
+)
+handler.namer, handler.rotator = gzip_namer, gzip_rotator
 handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s - %(message)s'))
-logger.addHandler(handler)
+
+# Callers only enqueue records, file writes and rotation happen on the listener's thread
+log_queue = queue.SimpleQueue()
+listener = QueueListener(log_queue, handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+logger = logging.getLogger(__name__)
+# Level on the logger itself so disabled calls return before a record is made, hot paths pass %s args instead of f-strings
+logger.setLevel(logging.getLevelNamesMapping()[config['logLevel']])
+logger.addHandler(QueueHandler(log_queue))
 debug = logger.debug
 info = logger.info
 warning = logger.warning
 error = logger.error
-critical = logger.critical
\ No newline at end of file
+critical = logger.critical
+
+
+def benchmark_logging(n_records: int=5000, stall_every: int=500, stall_seconds: float=0.02):
+    # Caller side latency per record, FileHandler (previous) vs QueueHandler, on a plain file and on one that stalls like a
+    # busy disk every stall_every records. Then a disabled debug call with an f-string vs %s args
+    import statistics
+    import tempfile
+    import time
+
+    class StallingFileHandler(logging.FileHandler):
+        def emit(self, record: logging.LogRecord) -> None:
+            self.emitted = getattr(self, 'emitted', 0) + 1
+            if stall_seconds and self.emitted % stall_every == 0:
+                time.sleep(stall_seconds)
+            super().emit(record)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for disk, file_handler_class in (('plain', logging.FileHandler), ('stalling', StallingFileHandler)):
+            bench_queue = queue.SimpleQueue()
+            bench_listener = QueueListener(bench_queue, file_handler_class(Path(tmp) / f'queue-{disk}.log', 'a', 'utf-8'))
+            bench_listener.start()
+            for name, bench_handler in (('FileHandler', file_handler_class(Path(tmp) / f'file-{disk}.log', 'a', 'utf-8')), ('QueueHandler', QueueHandler(bench_queue))):
+                bench_logger = logging.getLogger(f'{__name__}.benchmark.{disk}.{name}')
+                bench_logger.propagate = False
+                bench_logger.setLevel(logging.INFO)
+                bench_handler.setFormatter(handler.formatter)
+                bench_logger.addHandler(bench_handler)
+                latencies = []
+                for i in range(n_records):
+                    start = time.perf_counter()
+                    bench_logger.info('Guessed %s from %s', 'Fort Sterling', i)
+                    latencies.append(time.perf_counter() - start)
+                print(f'{disk:>8} {name:>12}: p50 {statistics.median(latencies)*1e6:.1f}us, max {max(latencies)*1000:.2f}ms, '
+                      f'total {sum(latencies)*1000:.0f}ms on the caller for {n_records} records')
+                bench_handler.close()
+            bench_listener.stop()
+
+    bench_logger = logging.getLogger(f'{__name__}.benchmark.disabled')
+    bench_logger.setLevel(logging.INFO)
+    guesses = ['Fort Sterling', 'Fort Sterling Portal']
+    start = time.perf_counter()
+    for i in range(n_records):
+        bench_logger.debug(f'Guessed {guesses} from {i}')
+    fstring_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(n_records):
+        bench_logger.debug('Guessed %s from %s', guesses, i)
+    args_seconds = time.perf_counter() - start
+    print(f'Disabled debug: f-string {fstring_seconds/n_records*1e6:.3f}us, %s args {args_seconds/n_records*1e6:.3f}us per call')
+
+if __name__ == "__main__":
+    benchmark_logging()
@@ -1,82 +1,171 @@
+import time
+# Before the heavy imports, time to first interaction is measured from here
+PROCESS_START = time.perf_counter()
+
 import discord
 from discord.commands import Option
 from discord.ext import tasks
 from discord.ui import View, Select
 from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
 from pydantic_mongo import PydanticObjectId
 import datetime as dt
-from itertools import combinations
+import asyncio
+import logging
 
 from models.dbmodels import *
-from utils.context import ctx_info, requires_approved
-from utils.cartography import est_traveling_time_seconds, translated_djikstra, best_guess, best_guesses
+from models.guildregistry import GuildConfig
+from utils.context import ctx_info, requires_approved, GUILDS
+from utils.commandsync import sync_commands_if_changed
+from utils.scheduler import ReminderScheduler
+from utils.dispatch import PingDispatcher
+from utils.dashboard import UpcomingDashboards, load_dashboard_ids, save_dashboard_ids
+from utils.portalgraph import PortalGraphCache
+from utils.bindata import DEFAULT_REGION, get_world
+from utils.cartography import est_traveling_time_seconds, translated_djikstra, translated_djikstra_pairs, best_guess, best_guesses, ROUTE_CACHE, TRAVEL_TIMES, autocomplete_map_names, build_autocomplete, build_travel_times, get_autocomplete
 from logger import debug, info, warning, error, logger
-from config import config
+from metrics import METRICS, COMMAND_SECONDS, PING_LAG_SECONDS, serve_metrics
+from config import config, CONFIG_FILE_PATH
 
 # Discord does not allow >25 choices
 COLOUR_CHOICES = ["Green", "Blue", "Purple", "Gold"]
 DISCORD_OPTIONS_LIMIT = 25
 
-bot = discord.Bot()
+# Commands are synced by on_connect, only when their schema changed
+bot = discord.Bot(auto_sync_commands=False)
+
+# MongoDB setup, the client connects on first use
+db = MongoClient(f"mongodb://{config['mongoDbHostname']}:{config['mongoDbPort']}/", connect=False)["cortex"]
+debug("MongoDB client created")
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=config.get('dbWorkerThreads', 8), thread_name_prefix='mongo')
+REMINDERS = AsyncReminders(Reminders(database=db), DB_EXECUTOR)
+PORTALS = AsyncPortals(Portals(database=db, logger=logger), DB_EXECUTOR)
+SCHEDULER = ReminderScheduler()
+# Player roads are per region, one live portal graph each
+PORTAL_GRAPHS: dict[str, PortalGraphCache] = {}
+
+def prepare_database():
+    # Create the indexes, then make sure no hot query falls back to a collection scan
+    for repository in (REMINDERS.repository, PORTALS.repository):
+        created = repository.ensure_indexes()
+        debug(f"Ensured indexes on {repository.get_collection().name}: {', '.join(created)}")
+        if config.get('checkQueryPlans', True):
+            repository.check_query_plans()
+    info("Indexes ensured and query plans checked")
 
-# MongoDB setup
-db = MongoClient(f"mongodb://{config['mongoDbHostname']}:{config['mongoDbPort']}/")["cortex"]
-debug("Connected to MongoDB")
-REMINDERS = Reminders(database=db)
-PORTALS = Portals(database=db, logger=logger)
+def portal_graph(region: str=None) -> PortalGraphCache:
+    region = region or DEFAULT_REGION
+    if region not in PORTAL_GRAPHS:
+        PORTAL_GRAPHS[region] = PortalGraphCache(region)
+    return PORTAL_GRAPHS[region]
+
+for guild in GUILDS:
+    portal_graph(guild.region)
 
 def utc_now():
     return dt.datetime.now(dt.timezone.utc)
 
+@METRICS.timed(COMMAND_SECONDS, 'map_name_autocomplete')
+async def map_name_autocomplete(ctx: discord.AutocompleteContext) -> list[str]:
+    guild = GUILDS.get(ctx.interaction.guild_id)
+    if guild is None:
+        return []
+    return autocomplete_map_names(ctx.value or '', guild.home_map, guild.region)
+
 def make_dc_time(dt: dt.datetime):
     return f"<t:{int(dt.timestamp())}:R>"
 
-@tasks.loop(seconds=config['dbPollingIntervalSeconds'])
-async def check_mongo_updates():
-    query = {'time_to_ping': {'$lt': utc_now()}}
-    pending_reminders = REMINDERS.find_by(query)
-    
-    for reminder in pending_reminders:
-        msg = [
-            f"{reminder.roleMention} {reminder.objective} in {reminder.location} {make_dc_time(reminder.time_unlocked)} {reminder.time_unlocked.strftime('%H:%M UTC')}",
+def format_ping(reminders: list[Reminder]) -> str:
+    # Reminders due together in the same channel are merged into one message
+    mentions = ' '.join(dict.fromkeys(r.roleMention for r in reminders))
+    msg = []
+    for idx, reminder in enumerate(reminders):
+        msg += [
+            f"{mentions + ' ' if idx == 0 else ''}{reminder.objective} in {reminder.location} {make_dc_time(reminder.time_unlocked)} {reminder.time_unlocked.strftime('%H:%M UTC')}",
             f"- Submitted by {reminder.submitter} at {reminder.time_submitted.strftime('%H:%M UTC (%d/%m/%y)')}"
         ]
-        channel = bot.get_channel(reminder.pingChannelId)
+    return '\n'.join(msg)
+
+async def send_ping(channel_id: int, msg: str):
+    await bot.get_channel(channel_id).send(msg)
+
+DISPATCHER = PingDispatcher(send_ping, config.get('pingWorkers', 8))
+METRICS_SERVER = None
+# on_connect/on_ready fire again on every reconnect, startup work is done once
+COMMANDS_SYNCED = False
+BACKGROUND_TASKS: list[asyncio.Future] = []
+FIRST_INTERACTION_SERVED = False
+
+async def dispatch_reminders(reminders: list[Reminder]):
+    by_channel: dict[int, list[Reminder]] = {}
+    all_claimed = await asyncio.gather(*(REMINDERS.claim(r) for r in reminders))
+    for reminder, claimed in zip(reminders, all_claimed):
+        if not claimed:
+            debug("%s in %s already claimed by another process", reminder.objective, reminder.location)
+            continue
+        info(f"Pinging {reminder.objective} in {reminder.location} | {reminder.submitter} [{reminder.pingChannelId}]")
+        by_channel.setdefault(claimed.pingChannelId, []).append(claimed)
+    for channel_id, channel_reminders in by_channel.items():
+        DISPATCHER.submit(channel_id, format_ping(channel_reminders))
+    DASHBOARDS.notify()
+
+async def run_scheduler():
+    # Sleeps until the earliest time_to_ping, woken early whenever reminders are added/removed
+    while True:
+        await SCHEDULER.wait(utc_now())
         try:
-            info(f"Pinging {reminder.objective} in {reminder.location} | {reminder.submitter} [{reminder.pingChannelId}]")
-            await channel.send('\n'.join(msg))
+            now = utc_now()
+            due = SCHEDULER.pop_due(now)
+            if METRICS.enabled:
+                for reminder in due:
+                    PING_LAG_SECONDS.observe((now - reminder.time_to_ping).total_seconds())
+            await dispatch_reminders(due)
         except Exception as e:
-            error(f"Failed to ping channel {reminder.pingChannelId} | submitted by {reminder.submitter} at {reminder.time_submitted.strftime('%H:%M UTC (%d/%m/%Y)')}")
+            error("Scheduler failed to dispatch due reminders")
             error(e)
-        REMINDERS.delete(reminder)
-        debug(f"Deleted {reminder.objective} in {reminder.location}")
+
+# Mongo is only polled to reconcile with reminders/portals written/removed outside this process
+@tasks.loop(seconds=config.get('dbReconcileIntervalSeconds', 300))
+async def check_mongo_updates():
+    version = SCHEDULER.version
+    SCHEDULER.load(await REMINDERS.find_by({}), since_version=version)
+    versions = {region: graph.version for region, graph in PORTAL_GRAPHS.items()}
+    by_region = {region: [] for region in PORTAL_GRAPHS}
+    for portal in await PORTALS.get_all():
+        by_region.setdefault(portal.region or DEFAULT_REGION, []).append(portal)
+    for region, portals in by_region.items():
+        portal_graph(region).load(portals, since_version=versions.get(region, 0))
+    DASHBOARDS.notify()
+    debug("Reconciled with MongoDB, %d reminders pending, %d live portals", len(SCHEDULER), sum(map(len, PORTAL_GRAPHS.values())))
+    if logger.isEnabledFor(logging.DEBUG):
+        debug("Route cache %s", ROUTE_CACHE.stats())
 
 @bot.slash_command(name="core", description="Set a ping timer for a core")
 @requires_approved
 async def set_core_reminder(
     ctx: discord.ApplicationContext,
     color: Option(str, choices=COLOUR_CHOICES, required=True),
-    location: Option(str, required=True),
+    location: Option(str, required=True, autocomplete=map_name_autocomplete),
     hours: Option(int, required=True, min_value=0, max_value=24),
     minutes: Option(int, required=True, min_value=0, max_value=59),
     seconds: Option(int, default=0, min_value=0, max_value=59),
 ):
-    home_map = ctx.server_data.get('homeMap', None)
-    guess = best_guess(location, home_map)
+    home_map, region = ctx.guild_config.home_map, ctx.guild_config.region
+    guess = best_guess(location, home_map, region)
     if not guess:
         warning(f"Failed to guess location for {ctx.guild} ({ctx.guild_id}): {location}")
         await ctx.respond("Unable to guess exact map name. Please retry command", ephemeral=True)
         return
     location = guess
-    lead_time = int(est_traveling_time_seconds(location, home_map)) + config['reminderLeadTimeSeconds']
+    lead_time = int(est_traveling_time_seconds(location, home_map, region)) + config['reminderLeadTimeSeconds']
     reminder = Reminder(
         objective=f"{color} Core",
         location=location,
         time_unlocked=utc_now() + dt.timedelta(hours=hours, minutes=minutes, seconds=seconds),
         submitter=ctx.author.mention,
         time_submitted=utc_now(),
-        pingChannelId=ctx.server_data['pingChannelId'],
-        roleMention=ctx.server_data['roleMention'],
+        pingChannelId=ctx.guild_config.ping_channel_id,
+        roleMention=ctx.guild_config.role_mention,
         time_to_ping=utc_now() + dt.timedelta(hours=hours, minutes=minutes, seconds=seconds-lead_time),
     )
     await submit_reminder(ctx, reminder)
@@ -86,27 +175,27 @@ async def set_core_reminder(
 async def set_vortex_reminder(
     ctx: discord.ApplicationContext,
     color: Option(str, choices=COLOUR_CHOICES, required=True),
-    location: Option(str, required=True),
+    location: Option(str, required=True, autocomplete=map_name_autocomplete),
     hours: Option(int, required=True, min_value=0, max_value=24),
     minutes: Option(int, required=True, min_value=0, max_value=59),
     seconds: Option(int, default=0, min_value=0, max_value=59),
 ):
-    home_map = ctx.server_data.get('homeMap', None)
-    guess = best_guess(location, home_map)
+    home_map, region = ctx.guild_config.home_map, ctx.guild_config.region
+    guess = best_guess(location, home_map, region)
     if not guess:
         warning(f"Failed to guess location for {ctx.guild} ({ctx.guild_id}): {location}")
         await ctx.respond("Unable to guess exact map name. Please retry command", ephemeral=True)
         return
     location = guess
-    lead_time = int(est_traveling_time_seconds(location, home_map)) + config['reminderLeadTimeSeconds']
+    lead_time = int(est_traveling_time_seconds(location, home_map, region)) + config['reminderLeadTimeSeconds']
     reminder = Reminder(
         objective=f"{color} Vortex",
         location=location,
         time_unlocked=utc_now() + dt.timedelta(hours=hours, minutes=minutes, seconds=seconds),
         submitter=ctx.author.mention,
         time_submitted=utc_now(),
-        pingChannelId=ctx.server_data['pingChannelId'],
-        roleMention=ctx.server_data['roleMention'],
+        pingChannelId=ctx.guild_config.ping_channel_id,
+        roleMention=ctx.guild_config.role_mention,
         time_to_ping=utc_now() + dt.timedelta(hours=hours, minutes=minutes, seconds=seconds-lead_time),
     )
     await submit_reminder(ctx, reminder)
@@ -116,84 +205,118 @@ async def set_vortex_reminder(
 async def set_free_reminder(
     ctx: discord.ApplicationContext,
     reminder_text: Option(str, required=True),
-    location: Option(str, required=True),
+    location: Option(str, required=True, autocomplete=map_name_autocomplete),
     hours: Option(int, required=True, min_value=0, max_value=24),
     minutes: Option(int, required=True, min_value=0, max_value=59),
     seconds: Option(int, default=0, min_value=0, max_value=59),
 ):
-    home_map = ctx.server_data.get('homeMap', None)
-    guess = best_guess(location, home_map)
+    home_map, region = ctx.guild_config.home_map, ctx.guild_config.region
+    guess = best_guess(location, home_map, region)
     lead_time = config['reminderLeadTimeSeconds']
     if guess:
         location = guess
-        lead_time += int(est_traveling_time_seconds(location, home_map))
+        lead_time += int(est_traveling_time_seconds(location, home_map, region))
     reminder = Reminder(
         objective=reminder_text,
         location=location,
         time_unlocked=utc_now() + dt.timedelta(hours=hours, minutes=minutes, seconds=seconds),
         submitter=ctx.author.mention,
         time_submitted=utc_now(),
-        pingChannelId=ctx.server_data['pingChannelId'],
-        roleMention=ctx.server_data['roleMention'],
+        pingChannelId=ctx.guild_config.ping_channel_id,
+        roleMention=ctx.guild_config.role_mention,
         time_to_ping=utc_now() + dt.timedelta(hours=hours, minutes=minutes, seconds=seconds-lead_time),
     )
     await submit_reminder(ctx, reminder)
 
 async def submit_reminder(ctx: discord.ApplicationContext, reminder: Reminder):
-    existing_reminders = list(REMINDERS.find_by({"objective": reminder.objective, "location": reminder.location}))
+    # Replaces the channel's reminder for the same objective and location in one atomic round-trip
+    previous = await REMINDERS.upsert(reminder)
     exist_msg = ""
-    if existing_reminders:
-        info(f'Deleting existing {len(existing_reminders)} reminders for {reminder.objective} in {reminder.location}')
+    if previous:
+        info(f'Replaced existing reminder for {reminder.objective} in {reminder.location}')
         exist_msg = "Reminder already exists, updated reminder!\n"
-        [REMINDERS.delete(r) for r in existing_reminders]
-    REMINDERS.save(reminder)
+        SCHEDULER.remove(previous.id)
+    SCHEDULER.add(reminder)
+    DASHBOARDS.notify()
     info(f'{ctx_info(ctx)} Saved reminder {reminder.objective} in {reminder.location}')
     await ctx.respond(f"{exist_msg}New reminder set: {reminder.objective} at {reminder.location} {make_dc_time(reminder.time_unlocked)} {reminder.time_unlocked.strftime('%H:%M UTC')}", ephemeral=True)
 
-def format_route(route: list[str]):
+def format_route(route: list[str], roads: PortalGraphCache) -> str:
+    # Portals come from the live portal graph the route was found on, rendering does no I/O
     def inline_format(route: list[str]) -> str:
         msg = [f'**{route[0]}**']
         for idx, step in enumerate(route):
             if idx == 0: continue
-            portal = PORTALS.find_portal(route[idx-1], step)
+            portal = roads.find_portal(route[idx-1], step)
             if portal:
                 msg.append(f"--{make_dc_time(portal.time_expire)}-->")
             else:
                 msg.append(f"-->")
             msg.append(f'**{step}**')
         return '   '.join(msg)
-    def earliest_expire_format(route: list[str]) -> str:
-        all_portals = [PORTALS.find_portal(*pair) for pair in zip(route[:-1], route[1:])]
-        next_expire_str = ""
-        if all_portals:
-            next_expire = min(portal.time_expire for portal in all_portals if portal)
-            next_expire_str = f'\nNext portal expires {make_dc_time(next_expire)} {next_expire.strftime("%H:%M UTC (%d/%m/%y)")}'
-        return '   -->   '.join(f"**{step}**" for step in route) + next_expire_str
     return inline_format(route)
 
-@bot.slash_command(name="upcoming", description="List upcoming reminders")
-@requires_approved
-async def upcoming(ctx: discord.ApplicationContext):
-    server_name = ctx.server_data['name']
-    info(f'{ctx.author.name} ({ctx.author.id}) from {server_name} sent /upcoming')
-    pending_reminders = list(REMINDERS.find_by({'pingChannelId': ctx.server_data['pingChannelId']}, sort=[("time_to_ping", 1)]))
+def upcoming_key(guild: GuildConfig) -> tuple:
+    # Everything render_upcoming reads that can change, portal expiries are covered by the render's valid_until
+    roads_version = portal_graph(guild.region).version if guild.notable_maps else None
+    return SCHEDULER.channel_versions.get(guild.ping_channel_id, 0), roads_version, guild
+
+def render_upcoming(guild: GuildConfig) -> tuple[str, dt.datetime]:
+    # Pending reminders come from the scheduler, which holds every reminder not pinged yet
     msg = [
         f"{reminder.objective} in {reminder.location} {make_dc_time(reminder.time_unlocked)} {reminder.time_unlocked.strftime('%H:%M UTC (%d/%m/%Y)')}"
-    for reminder in pending_reminders] or ["No upcoming reminders"]
-
-    notable_routes = []
-    upcoming_config = ctx.server_data.get('upcomingConfig', None)
-    if upcoming_config:
-        for zone_pairs in combinations(set(upcoming_config['notableMaps'] + [ctx.server_data['homeMap']]), 2):
-            route = translated_djikstra(zone_pairs[0], zone_pairs[1], list(PORTALS.get_all()), upcoming_config['maxMapsOut'])
-            if not route: continue
-            notable_routes.append(route)
+    for reminder in SCHEDULER.channel_reminders(guild.ping_channel_id)] or ["No upcoming reminders"]
+
+    notable_routes, valid_until = [], None
+    if guild.notable_maps:
+        roads = portal_graph(guild.region)
+        routes = translated_djikstra_pairs(list(guild.notable_maps), roads, guild.max_maps_out)
+        notable_routes = [route for route in routes.values() if route]
     if notable_routes:
-        msg.append(f"\n**Notable roads from {ctx.server_data['homeMap']}:**")
+        msg.append(f"\n**Notable roads from {guild.home_map}:**")
         for route in notable_routes:
-            msg.append(format_route(route))
+            msg.append(format_route(route, roads))
+        expiries = [portal.time_expire for route in notable_routes for portal in map(roads.find_portal, route[:-1], route[1:]) if portal]
+        valid_until = min(expiries, default=None)
+    return "\n".join(msg), valid_until
+
+async def publish_dashboard(guild: GuildConfig, text: str):
+    # The dashboard is the message pinned for this guild, its saved id finds it again after a restart. Other pinned bot
+    # messages are never touched
+    message = DASHBOARD_MESSAGES.get(guild.guild_id)
+    if message is None:
+        channel = bot.get_channel(guild.ping_channel_id)
+        if channel is None:
+            raise ValueError(f"Ping channel {guild.ping_channel_id} is not visible to the bot")
+        saved = DASHBOARD_IDS.get(str(guild.guild_id))
+        if saved is None or saved[0] != channel.id:
+            message = await channel.send(text)
+            await message.pin()
+            DASHBOARD_MESSAGES[guild.guild_id] = message
+            DASHBOARD_IDS[str(guild.guild_id)] = [channel.id, message.id]
+            save_dashboard_ids(DASHBOARD_IDS)
+            info(f"Pinned a new dashboard for {guild.name} [{guild.guild_id}]")
+            return
+        message = DASHBOARD_MESSAGES[guild.guild_id] = channel.get_partial_message(saved[1])
+    try:
+        await message.edit(content=text)
+    except discord.NotFound:
+        # Deleted by hand, the next refresh pins a new one
+        DASHBOARD_MESSAGES.pop(guild.guild_id, None)
+        DASHBOARD_IDS.pop(str(guild.guild_id), None)
+        save_dashboard_ids(DASHBOARD_IDS)
+        raise
+
+DASHBOARD_MESSAGES: dict[int, discord.Message | discord.PartialMessage] = {}
+DASHBOARD_IDS = load_dashboard_ids()
+DASHBOARDS = UpcomingDashboards(upcoming_key, render_upcoming, publish_dashboard, config.get('dashboardDebounceSeconds', 2))
 
-    await ctx.respond("\n".join(msg))
+@bot.slash_command(name="upcoming", description="List upcoming reminders")
+@requires_approved
+async def upcoming(ctx: discord.ApplicationContext):
+    guild = ctx.guild_config
+    info(f'{ctx.author.name} ({ctx.author.id}) from {guild.name} sent /upcoming')
+    await ctx.respond(DASHBOARDS.get(guild))
 
 @bot.slash_command(name="depo", description="Set a timer for leechers on depo time, sends immediately")
 @requires_approved
@@ -201,28 +324,28 @@ async def depo(
     ctx: discord.ApplicationContext,
     color: Option(str, choices=COLOUR_CHOICES, required=True),
     type: Option(str, choices=("Core", "Vortex"), required=True),
-    location: Option(str, required=True),
+    location: Option(str, required=True, autocomplete=map_name_autocomplete),
     minutes: Option(int, required=True, min_value=0, max_value=59),
 ):
-    location = best_guess(location, ctx.server_data.get('homeMap', None)) or location
-    info(f'{ctx.author.name} ({ctx.author.id}) from {ctx.server_data["name"]} sent /depo {color} {type} {location} {minutes}')
+    location = best_guess(location, ctx.guild_config.home_map, ctx.guild_config.region) or location
+    info(f'{ctx.author.name} ({ctx.author.id}) from {ctx.guild_config.name} sent /depo {color} {type} {location} {minutes}')
     utc_depo_time = utc_now() + dt.timedelta(minutes=minutes)
     msg = [
-        f"{ctx.server_data['roleMention']} Come leech {color} {type} in {location}", 
+        f"{ctx.guild_config.role_mention} Come leech {color} {type} in {location}", 
         f"Depo {make_dc_time(utc_depo_time)} {utc_depo_time.strftime('%H:%M UTC')}  -- {ctx.author.mention}",
     ]
     await ctx.respond("Sending ping...", ephemeral=True)
-    await bot.get_channel(ctx.server_data['pingChannelId']).send("\n".join(msg))
+    await bot.get_channel(ctx.guild_config.ping_channel_id).send("\n".join(msg))
 
 @bot.slash_command(name="delete", description="Delete a reminder")
 async def delete(ctx: discord.ApplicationContext):
     # TODO: Allow delete for submitted portals
     if ctx.author.id == config['juxId']:
-        user_reminders = list(REMINDERS.find_by({}))
-        user_portals = list(PORTALS.find_by({}))
+        user_reminders, user_portals = await asyncio.gather(REMINDERS.find_by({}), PORTALS.find_by({}))
     else:
-        user_reminders = list(REMINDERS.find_by({"submitter": ctx.author.mention}))
-        user_portals = list(PORTALS.find_by({"submitter": ctx.author.mention}))
+        user_reminders, user_portals = await asyncio.gather(
+            REMINDERS.find_by({"submitter": ctx.author.mention}), PORTALS.find_by({"submitter": ctx.author.mention})
+        )
     info(f'{ctx_info(ctx)} Sent /delete, {len(user_reminders)} reminders and {len(user_portals)} portals available')
     if len(user_portals) + len(user_reminders) == 0:
         await ctx.respond("No reminders/portals available to you...", ephemeral=True)
@@ -242,13 +365,15 @@ async def delete(ctx: discord.ApplicationContext):
         obj_type, id_str = interaction.data['values'][0].split('@')
         id = PydanticObjectId(id_str)
         if obj_type == 'portal':
-            portal = PORTALS.find_one_by_id(id)
+            portal = await PORTALS.find_one_by_id(id)
             obj_str = [p for p in portal_options if p.value == interaction.data['values'][0]][0].label
-            delete_result = PORTALS.delete(portal)
+            delete_result = await PORTALS.delete(portal)
+            portal_graph(portal.region).remove(id)
         elif obj_type == 'reminder':
-            reminder = REMINDERS.find_one_by_id(id)
+            reminder = await REMINDERS.find_one_by_id(id)
             obj_str = [r for r in reminder_options if r.value == interaction.data['values'][0]][0].label
-            delete_result = REMINDERS.delete(reminder)
+            delete_result = await REMINDERS.delete(reminder)
+            SCHEDULER.remove(id)
         else:
             error(f"{ctx_info(ctx)} Unknown /delete callback {obj_type}@{id_str}")
             return
@@ -256,6 +381,7 @@ async def delete(ctx: discord.ApplicationContext):
             error(f"{ctx_info(ctx)} Failed to delete {obj_type} {obj_str} ({id_str})")
             await interaction.response.edit_message(content=f"Failed to delete {obj_str}", view=None)
             return
+        DASHBOARDS.notify()
         info(f'{ctx_info(ctx)} deleted {obj_type}: {obj_str}')
         await interaction.response.edit_message(content=f"Deleted {obj_type}: {obj_str}", view=None)
     select.callback = callback
@@ -268,16 +394,16 @@ async def delete(ctx: discord.ApplicationContext):
 async def roads(
     ctx: discord.ApplicationContext,
     portal_type: Option(str, choices=("Blue", "Gold")),
-    from_map: Option(str, required=True),
-    to_map: Option(str, required=True),
+    from_map: Option(str, required=True, autocomplete=map_name_autocomplete),
+    to_map: Option(str, required=True, autocomplete=map_name_autocomplete),
     hours: Option(int, required=True, min_value=0, max_value=24),
     minutes: Option(int, required=True, min_value=0, max_value=59),
     seconds: Option(int, default=0, min_value=0, max_value=59),
 ):
-    home_map = ctx.server_data.get('homeMap', None)
+    home_map, region = ctx.guild_config.home_map, ctx.guild_config.region
     ctx.data = {}
     time_expire = utc_now() + dt.timedelta(hours=hours, minutes=minutes, seconds=seconds)
-    from_guesses, to_guesses = best_guesses(from_map, home_map), best_guesses(to_map, home_map)
+    from_guesses, to_guesses = best_guesses(from_map, home_map, region), best_guesses(to_map, home_map, region)
 
     failed_to_guess = (not from_guesses, from_map), (not to_guesses, to_map)
     if any(i[0] for i in failed_to_guess):
@@ -300,13 +426,17 @@ async def roads(
             f"Submitted {portal_type} Portal from {from_map} to {to_map}",
             f"Expires {make_dc_time(time_expire)} {time_expire.strftime('%H:%M UTC')}  -- {ctx.author.mention}"
         ]
-        PORTALS.save(Portal(
+        portal = Portal(
             from_map=from_map,
             to_map=to_map,
             time_expire=time_expire,
             submitter=ctx.author.mention,
             time_submitted=utc_now(),
-        ))
+            region=region,
+        )
+        await PORTALS.save(portal)
+        portal_graph(region).add(portal)
+        DASHBOARDS.notify()
         if isinstance(interaction, discord.ApplicationContext):
             await interaction.respond('\n'.join(msg), ephemeral=True)
             return
@@ -350,14 +480,22 @@ async def roads(
 
 @bot.slash_command(name="route", description="Find the shortest route from one location to another")
 @requires_approved
-async def route(ctx: discord.ApplicationContext, start: Option(str, required=True), end: Option(str, required=True)):
-    start = best_guess(start, ctx.server_data.get('homeMap', None))
-    end = best_guess(end, ctx.server_data.get('homeMap', None))
+async def route(
+    ctx: discord.ApplicationContext,
+    start: Option(str, required=True, autocomplete=map_name_autocomplete),
+    end: Option(str, required=True, autocomplete=map_name_autocomplete),
+    depart_in_minutes: Option(int, default=0, min_value=0, max_value=24*60),
+):
+    home_map, region = ctx.guild_config.home_map, ctx.guild_config.region
+    start = best_guess(start, home_map, region)
+    end = best_guess(end, home_map, region)
     if not start or not end:
         await ctx.respond("Unable to guess exact map names. Please retry command with full map names", ephemeral=True)
         return
-    route = translated_djikstra(start, end, list(PORTALS.get_all()))
-    await ctx.respond(format_route(route))
+    # Only roads still open when the route gets to them
+    roads = portal_graph(region)
+    route = translated_djikstra(start, end, roads, region=region, depart=utc_now() + dt.timedelta(minutes=depart_in_minutes))
+    await ctx.respond(format_route(route, roads))
 
 @bot.slash_command(name="help", description="Learn more about the commands")
 async def help(ctx: discord.ApplicationContext):
@@ -374,11 +512,133 @@ async def help(ctx: discord.ApplicationContext):
     ]
     await ctx.respond("\n".join(msg), ephemeral=True)
 
+def warm_guilds(guilds: list[GuildConfig]):
+    # Runs off the event loop, a command arriving first loads what it needs itself. Home maps shared with another
+    # guild or unchanged by a config reload are already built, guilds without one are ranked alphabetically on demand
+    start = time.perf_counter()
+    for guild in guilds:
+        if not guild.home_map:
+            continue
+        world = get_world(guild.region)
+        if guild.home_map not in get_autocomplete(world).tables:
+            build_autocomplete(guild.home_map, guild.region)
+        if (world.region, guild.home_map) not in TRAVEL_TIMES:
+            build_travel_times(guild.home_map, guild.region)
+    info(f"World data, autocomplete and travel times warmed for {len(guilds)} servers in {time.perf_counter() - start:.2f}s")
+
+def warm_world_data():
+    warm_guilds(list(GUILDS))
+
+# Edits to approvedServers take effect without a restart, the new servers are warmed before they are swapped in
+@tasks.loop(seconds=config.get('configReloadIntervalSeconds', 5))
+async def reload_guilds():
+    try:
+        changed = await asyncio.get_running_loop().run_in_executor(None, GUILDS.reload_if_changed, warm_guilds)
+    except Exception as e:
+        error(f"Keeping the current servers, failed to reload {CONFIG_FILE_PATH.name}: {e}")
+        return
+    if changed is None:
+        return
+    for guild in changed:
+        portal_graph(guild.region)
+    DASHBOARDS.notify()
+    info(f"Reloaded {CONFIG_FILE_PATH.name}, {len(GUILDS)} approved servers, changed: {', '.join(guild.name for guild in changed) or 'none'}")
+
+async def check_database():
+    try:
+        await asyncio.get_running_loop().run_in_executor(DB_EXECUTOR, prepare_database)
+    except CollectionScan as e:
+        error(f"Shutting down: {e}")
+        await bot.close()
+    except Exception as e:
+        error("Failed to prepare the database")
+        error(e)
+
+@bot.event
+async def on_connect():
+    global COMMANDS_SYNCED
+    if not COMMANDS_SYNCED:
+        await sync_commands_if_changed(bot)
+        COMMANDS_SYNCED = True
+
 @bot.event
 async def on_ready():
-    check_mongo_updates.start()
-    await bot.sync_commands()
+    global METRICS_SERVER
+    if not check_mongo_updates.is_running():
+        check_mongo_updates.start()
+    if not reload_guilds.is_running():
+        reload_guilds.start()
+    if not BACKGROUND_TASKS:
+        BACKGROUND_TASKS.extend([
+            bot.loop.create_task(run_scheduler()),
+            bot.loop.create_task(check_database()),
+            bot.loop.run_in_executor(None, warm_world_data),
+            bot.loop.create_task(DASHBOARDS.run(lambda: [guild for guild in GUILDS if guild.dashboard])),
+        ])
+    if METRICS.enabled and METRICS_SERVER is None:
+        METRICS_SERVER = await serve_metrics()
+    info(f"Bot ready {time.perf_counter() - PROCESS_START:.2f}s after process start")
     print(f"Bot ready!")
 
+# Every command is timed by the bot wide invoke hooks, they run in the command's task around its callback and after_invoke
+# also runs when it raises. Event listeners are scheduled as separate tasks and would miss the work done before the
+# command's first await
+@bot.before_invoke
+async def start_command_timer(ctx: discord.ApplicationContext):
+    ctx.command_started = time.perf_counter()
+
+@bot.after_invoke
+async def observe_command_time(ctx: discord.ApplicationContext):
+    if METRICS.enabled:
+        COMMAND_SECONDS.observe(time.perf_counter() - ctx.command_started, ctx.command.qualified_name)
+
+@bot.listen()
+async def on_application_command_completion(ctx: discord.ApplicationContext):
+    global FIRST_INTERACTION_SERVED
+    if not FIRST_INTERACTION_SERVED:
+        FIRST_INTERACTION_SERVED = True
+        info(f"First interaction (/{ctx.command}) served {time.perf_counter() - PROCESS_START:.2f}s after process start")
+
+STARTUP_BENCHMARK_SCRIPT = '''
+import asyncio, sys
+sys.path.insert(0, '.')
+sys.argv = ['main']
+import main
+from types import SimpleNamespace
+class Ctx:
+    guild_id, guild, command = {guild_id}, 'Startup', 'route'
+    author = SimpleNamespace(name='startup', id=0, mention='@startup')
+    async def respond(self, *args, **kwargs):
+        pass
+import time
+from concurrent.futures import ThreadPoolExecutor
+if {eager}:
+    main.warm_world_data()
+else:
+    warmup = ThreadPoolExecutor(1).submit(main.warm_world_data)
+ready = time.perf_counter() - main.PROCESS_START
+asyncio.run(main.route.callback(Ctx(), start='Scuttlesink Marsh', end='Fort Sterling', depart_in_minutes=0))
+print(ready, time.perf_counter() - main.PROCESS_START)
+'''
+
+def benchmark_first_interaction(runs: int=3):
+    # Process start to first /route served: warm everything first (previous on_ready) vs serve while warming in the background.
+    # Discord is not involved, the command sync a restart now skips is a few API round-trips on top of the eager number
+    from pathlib import Path
+    import subprocess
+    import sys
+    guild_id = next(iter(config['approvedServers']))
+    for name, eager in (('eager', True), ('lazy', False)):
+        timings, readies = [], []
+        for _ in range(runs):
+            start = time.perf_counter()
+            done = subprocess.run([sys.executable, '-c', STARTUP_BENCHMARK_SCRIPT.format(guild_id=guild_id, eager=eager)],
+                                  check=True, cwd=Path(__file__).parent, capture_output=True, text=True)
+            timings.append(time.perf_counter() - start)
+            ready, served = map(float, done.stdout.split()[-2:])
+            # Interpreter start up to main's first line
+            readies.append(timings[-1] - served + ready)
+        print(f'{name:>6}: process start to ready {min(readies):.2f}s, to first /route served best {min(timings):.2f}s, worst {max(timings):.2f}s')
+
 if __name__ == "__main__":
     bot.run(config["botToken"])
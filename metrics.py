@@ -0,0 +1,37 @@
+import asyncio
+
+from config import config
+from logger import info, warning
+from models.prometheus import MetricsRegistry, SIZE_BUCKETS
+
+METRICS = MetricsRegistry(config.get('metricsEnabled', False))
+
+COMMAND_SECONDS = METRICS.histogram('cortex_command_seconds', 'Slash command latency', labels=('command',))
+MONGO_SECONDS = METRICS.histogram('cortex_mongo_seconds', 'Mongo round-trip time per repository method', labels=('repository', 'method'))
+MONGO_ERRORS = METRICS.counter('cortex_mongo_errors_total', 'Mongo calls that raised', labels=('repository', 'method'))
+ROUTE_EXPANDED = METRICS.histogram('cortex_route_expanded_nodes', 'Nodes settled per route search', SIZE_BUCKETS, labels=('algorithm',))
+ROUTE_PUSHES = METRICS.histogram('cortex_route_heap_pushes', 'Heap pushes per route search', SIZE_BUCKETS, labels=('algorithm',))
+GUESS_SECONDS = METRICS.histogram('cortex_guess_seconds', 'Map name guess time per matcher', labels=('matcher',))
+PING_LAG_SECONDS = METRICS.histogram('cortex_ping_lag_seconds', 'Delay between time_to_ping and the ping being dispatched')
+
+async def handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # Just enough HTTP for a Prometheus scrape, any path gets the metrics
+    try:
+        await reader.readuntil(b'\r\n\r\n')
+        body = METRICS.render().encode()
+        writer.write(
+            b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+        warning(f"Bad metrics scrape: {e}")
+    finally:
+        writer.close()
+
+async def serve_metrics(host: str=None, port: int=None) -> asyncio.Server:
+    host = host or config.get('metricsHost', '127.0.0.1')
+    port = config.get('metricsPort', 9464) if port is None else port
+    server = await asyncio.start_server(handle_scrape, host, port)
+    info(f"Serving metrics on http://{host}:{server.sockets[0].getsockname()[1]}/metrics")
+    return server
@@ -0,0 +1,46 @@
+from typing import Callable
+import threading
+
+class AutocompleteIndex:
+    # Every string a map name can be found by (substrings of its words, prefixes of the full name, n-letter keys)
+    # mapped to the names it finds. Per home map the lists are ranked once, so a keystroke is a dict lookup
+    def __init__(self, names: list[str], n_letter_cache: dict[str, list[str]], limit: int=25) -> None:
+        self.names = sorted(set(names))
+        self.limit = limit
+        self.exact = {name.lower(): name for name in self.names}
+        ids = {name: idx for idx, name in enumerate(self.names)}
+        self.first_letters = {key: [ids[name] for name in dict.fromkeys(found)] for key, found in n_letter_cache.items()}
+        self.postings: dict[str, list[int]] = {}
+        for idx, name in enumerate(self.names):
+            lower = name.lower()
+            keys = {lower[:end] for end in range(len(lower) + 1)}
+            for word in lower.replace('-', ' ').split():
+                keys.update(word[i:j] for i in range(len(word)) for j in range(i + 1, len(word) + 1))
+            for key in keys:
+                self.postings.setdefault(key, []).append(idx)
+        self.tables: dict[str, dict[str, tuple[str, ...]]] = {}
+        self.lock = threading.Lock()
+
+    def build(self, home_map: str, distance: Callable[[str], int]=None) -> dict[str, tuple[str, ...]]:
+        # Names ranked by distance from home_map then alphabetically, n-letter matches of a key ahead of substring matches
+        rank = list(range(len(self.names)))
+        if distance is not None:
+            order = sorted(range(len(self.names)), key=lambda idx: (distance(self.names[idx]), idx))
+            for position, idx in enumerate(order):
+                rank[idx] = position
+        table = {}
+        for key in self.postings.keys() | self.first_letters.keys():
+            first = sorted(self.first_letters.get(key, ()), key=rank.__getitem__)
+            rest = sorted(set(self.postings.get(key, ())).difference(first), key=rank.__getitem__)
+            table[key] = tuple(self.names[idx] for idx in (first + rest)[:self.limit])
+        # Built outside the lock, a warm-up thread and a command building the same home map publish equal tables
+        with self.lock:
+            self.tables[home_map] = table
+        return table
+
+    def get(self, query: str, home_map: str=None) -> tuple[str, ...]:
+        # None when the query is not an indexed key, the caller decides how to fall back
+        table = self.tables.get(home_map)
+        if table is None:
+            return None
+        return table.get(query.lstrip().lower())
@@ -0,0 +1,105 @@
+from array import array
+from pathlib import Path
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+# File layout: header, table of contents, then 8 byte aligned sections
+# header: magic, schema version, section count, crc32 of everything after the header, length of everything after the header
+HEADER = struct.Struct('<4sHHII')
+# toc entry: section name, array typecode, offset from file start, byte length
+TOC_ENTRY = struct.Struct('<24s4sQQ')
+MAGIC = b'CTXB'
+
+class StaleBinDump(Exception):
+    pass
+
+def pack_strings(strings: list[str] | list[bytes]) -> tuple[bytes, array]:
+    # String table: utf-8 text + offsets, string i is text[offsets[i]:offsets[i+1]]
+    encoded = [s if isinstance(s, bytes) else s.encode() for s in strings]
+    offsets = array('I', [0])
+    for e in encoded:
+        offsets.append(offsets[-1] + len(e))
+    return b''.join(encoded), offsets
+
+def write_bindump(path: Path, schema_version: int, sections: dict[str, array | bytes]) -> None:
+    toc_size = TOC_ENTRY.size * len(sections)
+    offset = HEADER.size + toc_size
+    toc, body = bytearray(), bytearray()
+    for name, data in sections.items():
+        padding = -offset % 8
+        body += b'\0' * padding
+        offset += padding
+        raw = data.tobytes() if isinstance(data, array) else bytes(data)
+        typecode = data.typecode if isinstance(data, array) else 'B'
+        toc += TOC_ENTRY.pack(name.encode(), typecode.encode(), offset, len(raw))
+        body += raw
+        offset += len(raw)
+    payload = bytes(toc) + bytes(body)
+    # Written beside and swapped in, truncating a file another process has mapped would crash it. The temp file is
+    # unique so two builders never write into the same one, the last complete dump wins
+    with tempfile.NamedTemporaryFile(dir=Path(path).parent, prefix=f'{Path(path).name}.', suffix='.tmp', delete=False) as f:
+        try:
+            f.write(HEADER.pack(MAGIC, schema_version, len(sections), zlib.crc32(payload), len(payload)))
+            f.write(payload)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    # mkstemp creates the file owner only
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+class BinDump:
+    # Memory mapped read only view, sections are zero copy memoryviews cast to their array typecode
+    def __init__(self, path: Path, schema_version: int) -> None:
+        try:
+            with open(path, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError) as e:
+            raise StaleBinDump(f'{path} is missing or empty') from e
+        self.view = memoryview(self.mm)
+        self.sections: dict[str, memoryview] = {}
+        view = self.view
+        try:
+            if len(view) < HEADER.size:
+                raise StaleBinDump(f'{path} is truncated')
+            magic, version, n_sections, checksum, length = HEADER.unpack_from(view)
+            if magic != MAGIC or version != schema_version:
+                raise StaleBinDump(f'{path} has schema {version}, expected {schema_version}')
+            if len(view) != HEADER.size + length or zlib.crc32(view[HEADER.size:]) != checksum:
+                raise StaleBinDump(f'{path} failed its checksum')
+        except StaleBinDump:
+            # Unmapped before raising, a mapped file can not be replaced on Windows while the caller rebuilds it
+            self.close()
+            raise
+        for idx in range(n_sections):
+            name, typecode, offset, size = TOC_ENTRY.unpack_from(view, HEADER.size + idx * TOC_ENTRY.size)
+            self.sections[name.rstrip(b'\0').decode()] = view[offset:offset + size].cast(typecode.rstrip(b'\0').decode())
+
+    def close(self) -> None:
+        # Only once nothing built on the sections is alive, mmap refuses to close while views into it are exported
+        for section in self.sections.values():
+            section.release()
+        self.sections = {}
+        self.view.release()
+        self.mm.close()
+
+    def __enter__(self) -> 'BinDump':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __getitem__(self, name: str) -> memoryview:
+        return self.sections[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.sections
+
+    def strings(self, name: str, decode: bool=True) -> list[str] | list[bytes]:
+        text, offsets = bytes(self.sections[f'{name}.text']), self.sections[f'{name}.offsets']
+        raw = [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return [r.decode() for r in raw] if decode else raw
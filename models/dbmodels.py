@@ -1,8 +1,48 @@
 from pydantic_mongo import AbstractRepository, PydanticObjectId
 from pydantic import BaseModel, field_validator
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import Optional
+from concurrent.futures import Executor
+import asyncio
+import functools
+import time
 import datetime as dt
 
+from metrics import METRICS, MONGO_SECONDS, MONGO_ERRORS
+
+class CollectionScan(Exception):
+    pass
+
+def plan_stages(plan) -> list[str]:
+    # Every stage name in an explain() plan tree, classic (inputStage/inputStages) and slot based engine layouts alike
+    if isinstance(plan, list):
+        return [stage for p in plan for stage in plan_stages(p)]
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan['stage']] if 'stage' in plan else []
+    return stages + [stage for value in plan.values() for stage in plan_stages(value)]
+
+class IndexedRepository:
+    # Indexes the repository's hot queries rely on, and those query shapes as (filter, sort) for check_query_plans
+    indexes: list[IndexModel] = []
+
+    def query_shapes(self) -> list[tuple[dict, list]]:
+        return []
+
+    def ensure_indexes(self) -> list[str]:
+        return self.get_collection().create_indexes(self.indexes) if self.indexes else []
+
+    def check_query_plans(self) -> None:
+        # Needs a real mongod, raises if any hot query shape has to scan the whole collection
+        for query, sort in self.query_shapes():
+            cursor = self.get_collection().find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()['queryPlanner']['winningPlan']
+            if 'COLLSCAN' in plan_stages(plan):
+                raise CollectionScan(f'{self.get_collection().name} query {query} sort {sort} does a collection scan')
+
 class Reminder(BaseModel):
     id: Optional[PydanticObjectId] = None
     objective: str
@@ -24,12 +64,53 @@ class Reminder(BaseModel):
     
     @field_validator("time_to_ping")
     def ping_timezone(cls, v: dt.datetime) -> dt.datetime:
-        return v.replace(tzinfo=dt.timezone.utc)
+        # Mongo keeps milliseconds, truncated here so the in-memory copy still matches the stored one in claim()
+        return v.replace(tzinfo=dt.timezone.utc, microsecond=v.microsecond // 1000 * 1000)
 
-class Reminders(AbstractRepository[Reminder]):
+class Reminders(AbstractRepository[Reminder], IndexedRepository):
     class Meta:
         collection_name = "reminders"
 
+    indexes = [
+        IndexModel([("time_to_ping", ASCENDING)]),
+        IndexModel([("pingChannelId", ASCENDING), ("time_to_ping", ASCENDING)]),
+        IndexModel([("objective", ASCENDING), ("location", ASCENDING), ("pingChannelId", ASCENDING)], unique=True),
+        IndexModel([("submitter", ASCENDING)]),
+    ]
+    # A channel has at most one reminder per objective and location
+    natural_key = ("objective", "location", "pingChannelId")
+
+    def query_shapes(self) -> list[tuple[dict, list]]:
+        now = dt.datetime.now(dt.timezone.utc)
+        return [
+            ({"time_to_ping": {"$lte": now}}, None),
+            ({"pingChannelId": 0}, [("time_to_ping", ASCENDING)]),
+            ({"objective": "", "location": "", "pingChannelId": 0}, None),
+            ({"submitter": ""}, None),
+        ]
+
+    def upsert(self, reminder: Reminder) -> Reminder:
+        # One atomic round-trip on the natural key, returns the reminder it replaced. A replaced document keeps its _id
+        document = self.to_document(reminder)
+        document.pop("_id", None)
+        key = {field: document[field] for field in self.natural_key}
+        new_id = PydanticObjectId()
+        try:
+            previous = self.get_collection().find_one_and_update(
+                key, {"$set": document, "$setOnInsert": {"_id": new_id}}, upsert=True, return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            # Lost an insert race on the unique index, the winner's document is there to be replaced now
+            previous = self.get_collection().find_one_and_update(key, {"$set": document}, return_document=ReturnDocument.BEFORE)
+        reminder.id = previous["_id"] if previous else new_id
+        return self.to_model(previous) if previous else None
+
+    def claim(self, reminder: Reminder) -> Reminder:
+        # Atomic, only one bot process gets the document back. Matching time_to_ping too, a process still holding
+        # a version that has since been replaced under the same _id can not claim the new one
+        doc = self.get_collection().find_one_and_delete({"_id": reminder.id, "time_to_ping": reminder.time_to_ping})
+        return self.to_model(doc) if doc else None
+
 class Portal(BaseModel):
     id: Optional[PydanticObjectId] = None
     from_map: str
@@ -37,6 +118,7 @@ class Portal(BaseModel):
     time_expire: dt.datetime
     submitter: str
     time_submitted: dt.datetime
+    region: Optional[str] = None # None is the default region
 
     @field_validator("time_expire")
     def expire_timezone(cls, v: dt.datetime) -> dt.datetime:
@@ -49,21 +131,29 @@ class Portal(BaseModel):
     def __str__(self):
         return f"{self.from_map} -> {self.to_map} (until {self.time_expire.strftime('%H%M %d/%m/%y')})"
 
-class Portals(AbstractRepository[Portal]):
+class Portals(AbstractRepository[Portal], IndexedRepository):
     def __init__(self, database, logger=None):
         self.logger = logger
         super().__init__(database)
     class Meta:
         collection_name = "portals"
-    
-    def remove_expired(self):
-        q = {"time_expire": {"$lt": dt.datetime.now().replace(tzinfo=dt.timezone.utc)}}
-        for expired_portal in self.find_by(q):
-            self.logger and self.logger.info(f"Removing expired portal: {expired_portal}")
-        return super().get_collection().delete_many({"time_expire": {"$lt": dt.datetime.now().replace(tzinfo=dt.timezone.utc)}})
+
+    # Mongo deletes portals once time_expire passes (the TTL monitor runs every minute), PortalGraphCache drops them on time
+    indexes = [
+        IndexModel([("time_expire", ASCENDING)], expireAfterSeconds=0),
+        IndexModel([("from_map", ASCENDING), ("to_map", ASCENDING)]),
+        IndexModel([("submitter", ASCENDING)]),
+    ]
+
+    def query_shapes(self) -> list[tuple[dict, list]]:
+        now = dt.datetime.now(dt.timezone.utc)
+        return [
+            ({"time_expire": {"$lt": now}}, None),
+            ({"from_map": "", "to_map": ""}, None),
+            ({"submitter": ""}, None),
+        ]
 
     def get_all(self):
-        self.remove_expired()
         return self.find_by({})
     
     def find_portal(self, map1: str, map2: str) -> Portal:
@@ -73,6 +163,59 @@ class Portals(AbstractRepository[Portal]):
         if backward: return backward[0]
         return None
 
+class AsyncRepository:
+    # Runs the blocking pymongo calls of a repository on a thread pool, cursors are drained in the worker thread
+    def __init__(self, repository: AbstractRepository, executor: Executor=None) -> None:
+        self.repository = repository
+        self.executor = executor
+
+    async def run(self, func, *args, **kwargs):
+        call = functools.partial(func, *args, **kwargs)
+        if METRICS.enabled:
+            call = functools.partial(self.timed_call, func.__name__, call)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def timed_call(self, method: str, call):
+        # Runs in the worker thread, so the time is the round-trip and not the wait for a free worker
+        start = time.perf_counter()
+        try:
+            return call()
+        except Exception:
+            MONGO_ERRORS.inc(type(self.repository).__name__, method)
+            raise
+        finally:
+            MONGO_SECONDS.observe(time.perf_counter() - start, type(self.repository).__name__, method)
+
+    async def find_by(self, query: dict, **kwargs) -> list:
+        def find_by():
+            return list(self.repository.find_by(query, **kwargs))
+        return await self.run(find_by)
+
+    async def find_one_by_id(self, id: PydanticObjectId):
+        return await self.run(self.repository.find_one_by_id, id)
+
+    async def save(self, model: BaseModel):
+        return await self.run(self.repository.save, model)
+
+    async def delete(self, model: BaseModel):
+        return await self.run(self.repository.delete, model)
+
+class AsyncReminders(AsyncRepository):
+    async def upsert(self, reminder: Reminder) -> Reminder:
+        return await self.run(self.repository.upsert, reminder)
+
+    async def claim(self, reminder: Reminder) -> Reminder:
+        return await self.run(self.repository.claim, reminder)
+
+class AsyncPortals(AsyncRepository):
+    async def get_all(self) -> list[Portal]:
+        def get_all():
+            return list(self.repository.get_all())
+        return await self.run(get_all)
+
+    async def find_portal(self, map1: str, map2: str) -> Portal:
+        return await self.run(self.repository.find_portal, map1, map2)
+
 if __name__ == '__main__':
     from main import PORTALS
     from utils import MAP_NAME2ID
@@ -0,0 +1,82 @@
+from array import array
+
+def trigrams(word: str) -> set[str]:
+    padded = f'^{word}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def max_typos(word: str) -> int:
+    return 0 if len(word) < 4 else 1 if len(word) < 8 else 2
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    # Levenshtein with transpositions counted as one edit, gives up (limit + 1) once every cell in a row exceeds limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev2, prev = prev, row
+    return prev[-1]
+
+class FuzzyMatcher:
+    # Trigram inverted index over the words of every name. A typo breaks at most 3 trigrams of a word (4 for a
+    # transposition), so only words sharing enough trigrams with the query word are checked with edit_distance
+    def __init__(self, string_list: list[str]) -> None:
+        self.strings = list(dict.fromkeys(string_list))
+        word_owners: dict[str, list[int]] = {}
+        for idx, s in enumerate(self.strings):
+            for word in s.replace('-', ' ').lower().split():
+                word_owners.setdefault(word, []).append(idx)
+        self.words = sorted(word_owners)
+        self.gram_counts = array('B', (len(trigrams(word)) for word in self.words))
+        self.owners = [array('H', dict.fromkeys(word_owners[word])) for word in self.words]
+        postings: dict[str, list[int]] = {}
+        for idx, word in enumerate(self.words):
+            for gram in trigrams(word):
+                postings.setdefault(gram, []).append(idx)
+        self.postings = {gram: array('H', ids) for gram, ids in postings.items()}
+
+    @classmethod
+    def from_arrays(cls, strings: list[str], words: list[str], gram_counts, owners: list, postings: dict) -> 'FuzzyMatcher':
+        # Arrays may be memoryviews over a bin dump
+        matcher = cls.__new__(cls)
+        matcher.strings, matcher.words, matcher.gram_counts, matcher.owners, matcher.postings = strings, words, gram_counts, owners, postings
+        return matcher
+
+    def match_word(self, word: str) -> dict[int, int]:
+        # Word index -> edit distance for every indexed word within max_typos(word)
+        limit = max_typos(word)
+        grams = trigrams(word)
+        shared: dict[int, int] = {}
+        for gram in grams:
+            for idx in self.postings.get(gram, ()):
+                shared[idx] = shared.get(idx, 0) + 1
+        matches = {}
+        for idx, count in shared.items():
+            if count < max(len(grams), self.gram_counts[idx]) - 4 * limit:
+                continue
+            distance = edit_distance(word, self.words[idx], limit)
+            if distance <= limit:
+                matches[idx] = distance
+        return matches
+
+    def search(self, query: str) -> list[tuple[int, int]]:
+        # (string index, total edits) for names matching every query word, fewest edits first
+        best: dict[int, int] = None
+        for word in query.replace('-', ' ').lower().split():
+            found: dict[int, int] = {}
+            for idx, distance in self.match_word(word).items():
+                for owner in self.owners[idx]:
+                    found[owner] = min(found.get(owner, distance), distance)
+            best = found if best is None else {owner: best[owner] + d for owner, d in found.items() if owner in best}
+            if not best:
+                return []
+        return sorted((best or {}).items(), key=lambda item: (item[1], item[0]))
+
+    def get(self, query: str) -> list[str]:
+        return [self.strings[idx] for idx, _ in self.search(query)]
@@ -0,0 +1,100 @@
+from pathlib import Path
+from pydantic import BaseModel, ConfigDict
+from typing import Callable, Optional
+import json
+import os
+
+class GuildConfig(BaseModel):
+    # One approved server's config, compiled once per load instead of looked up and reformatted on every command
+    model_config = ConfigDict(frozen=True)
+
+    guild_id: int
+    name: str
+    region: str
+    ping_channel_id: int
+    role_mention: str
+    home_map: Optional[str] = None
+    home_map_id: Optional[str] = None
+    # Home map first, then the upcomingConfig notable maps in config order, empty when /upcoming shows no roads
+    notable_maps: tuple[str, ...] = ()
+    max_maps_out: Optional[int] = None
+    # Opted in to a pinned /upcoming message in the ping channel, kept up to date
+    dashboard: bool = False
+    alias: str = ''
+
+    @classmethod
+    def compile(cls, guild_id: str, server_data: dict, default_region: str, resolve_map_id: Callable[[str, str], Optional[str]]) -> 'GuildConfig':
+        region = server_data.get('region', default_region)
+        home_map = server_data.get('homeMap', None)
+        home_map_id = None
+        if home_map:
+            home_map_id = resolve_map_id(home_map, region)
+            if home_map_id is None:
+                raise ValueError(f'Server {guild_id} home map {home_map!r} is not a map in {region}')
+        notable_maps, max_maps_out = (), None
+        upcoming_config = server_data.get('upcomingConfig', None)
+        if upcoming_config:
+            unknown = [m for m in upcoming_config['notableMaps'] if resolve_map_id(m, region) is None]
+            if unknown:
+                raise ValueError(f'Server {guild_id} notable maps {unknown} are not maps in {region}')
+            notable_maps = tuple(dict.fromkeys(([home_map] if home_map else []) + upcoming_config['notableMaps']))
+            max_maps_out = upcoming_config['maxMapsOut']
+        return cls(
+            guild_id=int(guild_id), name=server_data['name'], region=region, ping_channel_id=server_data['pingChannelId'],
+            role_mention=server_data['roleMention'], home_map=home_map, home_map_id=home_map_id,
+            notable_maps=notable_maps, max_maps_out=max_maps_out, dashboard=server_data.get('upcomingDashboard', False),
+            alias=f" ({server_data['name']})",
+        )
+
+class GuildRegistry:
+    # approvedServers compiled into GuildConfigs keyed by int guild id. Readers only ever see a whole mapping, a reload
+    # compiles a new one and swaps it in with a single assignment, or keeps the old one if the new config is invalid
+    def __init__(self, path: Path, default_region: str, resolve_map_id: Callable[[str, str], Optional[str]]) -> None:
+        self.path = path
+        self.default_region = default_region
+        self.resolve_map_id = resolve_map_id
+        self.guilds: dict[int, GuildConfig] = {}
+        self.stamp = None
+        self.version = 0
+
+    def get(self, guild_id: int) -> Optional[GuildConfig]:
+        return self.guilds.get(guild_id)
+
+    def __iter__(self):
+        return iter(self.guilds.values())
+
+    def __len__(self) -> int:
+        return len(self.guilds)
+
+    def compile(self, approved_servers: dict) -> dict[int, GuildConfig]:
+        guilds = (GuildConfig.compile(guild_id, data, self.default_region, self.resolve_map_id) for guild_id, data in approved_servers.items())
+        return {guild.guild_id: guild for guild in guilds}
+
+    def file_stamp(self) -> tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self, guilds: dict[int, GuildConfig]) -> list[GuildConfig]:
+        # New or changed guilds, removed guilds simply stop being found
+        return [guild for guild_id, guild in guilds.items() if self.guilds.get(guild_id) != guild]
+
+    def swap(self, guilds: dict[int, GuildConfig]) -> list[GuildConfig]:
+        changed = self.changed(guilds)
+        self.guilds = guilds
+        self.version += 1
+        return changed
+
+    def reload_if_changed(self, prepare: Callable[[list[GuildConfig]], None]=None) -> Optional[list[GuildConfig]]:
+        # None when the file is unchanged, raises on an invalid config and keeps serving the current guilds. prepare
+        # gets the changed guilds before the swap, so their caches are warm by the time a command can see them
+        stamp = self.file_stamp()
+        if stamp == self.stamp:
+            return None
+        self.stamp = stamp
+        with open(self.path, 'r') as f:
+            guilds = self.compile(json.load(f)['approvedServers'])
+        changed = self.changed(guilds)
+        if prepare is not None and changed:
+            prepare(changed)
+        self.swap(guilds)
+        return changed
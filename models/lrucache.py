@@ -0,0 +1,50 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+import threading
+
+class LRUCache:
+    # Shared by the event loop and warm-up threads, a lookup and its move_to_end must not interleave with an eviction
+    def __init__(self, maxsize: int=4096) -> None:
+        self.maxsize = maxsize
+        self.data: OrderedDict[Hashable, Any] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.data
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.data),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,116 @@
+from bisect import bisect_left
+from typing import Callable
+import asyncio
+import functools
+import math
+import threading
+import time
+
+# Prometheus client defaults, seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+SIZE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000)
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str='') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs += [extra] if extra else []
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value: float) -> str:
+    return '+Inf' if value == math.inf else repr(float(value))
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]=()) -> None:
+        self.name, self.help, self.labels = name, help, labels
+        self.values: dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float=1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        return [(self.name, format_labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+class Histogram:
+    # Cumulative buckets like Prometheus, per label values: [count per bucket..., +Inf count], sum
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]=LATENCY_BUCKETS, labels: tuple[str, ...]=()) -> None:
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            if label_values not in self.counts:
+                self.counts[label_values] = [0] * (len(self.buckets) + 1)
+                self.sums[label_values] = 0
+            self.counts[label_values][idx] += 1
+            self.sums[label_values] += value
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        samples = []
+        for key, counts in sorted(self.counts.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                samples.append((f'{self.name}_bucket', format_labels(self.labels, key, f'le="{format_value(bound)}"'), total))
+            samples.append((f'{self.name}_sum', format_labels(self.labels, key), self.sums[key]))
+            samples.append((f'{self.name}_count', format_labels(self.labels, key), total))
+        return samples
+
+class MetricsRegistry:
+    # Disabled, metrics are still declared but timed() hands back the undecorated function and callers skip observe()
+    # behind a check of enabled, so instrumentation costs an attribute lookup at most
+    def __init__(self, enabled: bool=False) -> None:
+        self.enabled = enabled
+        self.metrics: dict[str, Counter | Histogram] = {}
+
+    def _register(self, metric: Counter | Histogram) -> Counter | Histogram:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...]=()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...]=LATENCY_BUCKETS, labels: tuple[str, ...]=()) -> Histogram:
+        return self._register(Histogram(name, help, buckets, labels))
+
+    def timed(self, histogram: Histogram, *label_values) -> Callable:
+        # Decorator observing the wall time of each call, sync or async
+        def decorator(func: Callable) -> Callable:
+            if not self.enabled:
+                return func
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        histogram.observe(time.perf_counter() - start, *label_values)
+                return async_wrapper
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, *label_values)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self.metrics.values():
+            lines += [f'# HELP {metric.name} {metric.help}', f'# TYPE {metric.name} {metric.kind}']
+            lines += [f'{name}{labels} {format_value(value)}' for name, labels, value in metric.samples()]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,301 @@
+from array import array
+from operator import sub
+import heapq
+import math
+
+class PathRef:
+    # Stands in for the path on the heap. Only compared when cost and node tie, it then orders
+    # like the old path lists did by walking predecessors to where the two paths diverge
+    __slots__ = ('node', 'depth', 'preds')
+
+    def __init__(self, node: int, depth: int, preds: list[int]) -> None:
+        self.node, self.depth, self.preds = node, depth, preds
+
+    def __lt__(self, other: 'PathRef') -> bool:
+        a, b, preds = self.node, other.node, self.preds
+        da, db = self.depth, other.depth
+        while da > db:
+            a, da = preds[a], da - 1
+        while db > da:
+            b, db = preds[b], db - 1
+        if a == b:
+            return self.depth < other.depth
+        while preds[a] != preds[b]:
+            a, b = preds[a], preds[b]
+        return a < b
+
+ROOT = PathRef(-1, -1, [])
+
+class RoutingGraph:
+    # Portal nodes (portal_id, map_id) are interned to ints in sorted order so heap ties break exactly like the tuples did
+    # Edges are stored CSR style: neighbours of node i are targets[offsets[i]:offsets[i+1]]
+    # search_stats is (nodes settled, heap pushes) of the last search, pushes counted as pops + what was left on the heap
+    def __init__(self, edges: dict, extra_nodes: list[tuple]=()) -> None:
+        self.nodes = sorted(set(edges) | {n for neighbors in edges.values() for n in neighbors} | set(extra_nodes))
+        self.node_ids = {node: idx for idx, node in enumerate(self.nodes)}
+        self.node_maps = [node[1] for node in self.nodes]
+        self.offsets = array('I', [0])
+        self.targets = array('I')
+        self.weights = array('d')
+        for node in self.nodes:
+            for neighbor, weight in edges.get(node, {}).items():
+                self.targets.append(self.node_ids[neighbor])
+                self.weights.append(weight)
+            self.offsets.append(len(self.targets))
+        self.start_order = array('I', (self.node_ids[node] for node in edges))
+        self.search_stats = (0, 0)
+        self._index_maps()
+
+    @classmethod
+    def from_csr(cls, nodes: list[tuple], offsets, targets, weights, start_order) -> 'RoutingGraph':
+        # Arrays may be memoryviews over a bin dump
+        graph = cls.__new__(cls)
+        graph.nodes = nodes
+        graph.node_ids = {node: idx for idx, node in enumerate(nodes)}
+        graph.node_maps = [node[1] for node in nodes]
+        graph.offsets, graph.targets, graph.weights, graph.start_order = offsets, targets, weights, start_order
+        graph.search_stats = (0, 0)
+        graph._index_maps()
+        return graph
+
+    def _index_maps(self) -> None:
+        # map_id -> start nodes, in the edge dict's order
+        self.start_nodes: dict[str, list[int]] = {}
+        for idx in self.start_order:
+            self.start_nodes.setdefault(self.node_maps[idx], []).append(idx)
+        self.map_nodes: dict[str, list[int]] = {}
+        for idx, map_id in enumerate(self.node_maps):
+            self.map_nodes.setdefault(map_id, []).append(idx)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def make_overlay(self, additional_graph: dict) -> dict[int, list[tuple[int, float]]]:
+        return {
+            self.node_ids[node]: [(self.node_ids[neighbor], weight) for neighbor, weight in neighbors.items()]
+            for node, neighbors in additional_graph.items()
+        }
+
+    def _starting_nodes(self, start: str, overlay: dict) -> list[int]:
+        return self.start_nodes.get(start, []) + [node for node in overlay if self.node_maps[node] == start]
+
+    def _path(self, node: int, parent: int, preds: list[int]) -> list[tuple]:
+        path = [node]
+        while parent >= 0:
+            path.append(parent)
+            parent = preds[parent]
+        return [self.nodes[n] for n in reversed(path)]
+
+    def shortest_paths(self, start: str, ends: set[str], overlay: dict=None, max_distance: int=9999) -> dict[str, list[tuple]]:
+        # Settles nodes in the same order as the path-carrying dijkstra, but heap entries are (cost, node, PathRef)
+        # with one PathRef per settled node, paths are rebuilt from predecessors once a node of an end map is popped
+        overlay = overlay or {}
+        remaining = set(ends)
+        found = {}
+        node_maps, offsets, targets, weights = self.node_maps, self.offsets, self.targets, self.weights
+        preds = [-1] * len(self.nodes)
+        visited = bytearray(len(self.nodes))
+        queue = [(0, node, ROOT) for node in self._starting_nodes(start, overlay)]
+        heapq.heapify(queue)
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        pops = 0
+        while queue and remaining:
+            cost, node, parent = heappop(queue)
+            pops += 1
+            if node_maps[node] in remaining:
+                found[node_maps[node]] = self._path(node, parent.node, preds)
+                remaining.discard(node_maps[node])
+            if visited[node]:
+                continue
+            visited[node] = 1
+            preds[node] = parent.node
+            hop = parent.depth + 1
+            if hop > max_distance:
+                continue
+            ref = PathRef(node, hop, preds)
+            for i in range(offsets[node], offsets[node + 1]):
+                if not visited[targets[i]]:
+                    heappush(queue, (cost + weights[i], targets[i], ref))
+            for neighbor, weight in overlay.get(node, ()):
+                if not visited[neighbor]:
+                    heappush(queue, (cost + weight, neighbor, ref))
+        self.search_stats = (visited.count(1), pops + len(queue))
+        return found
+
+    def shortest_path(self, start: str, end: str, overlay: dict=None, max_distance: int=9999) -> list[tuple]:
+        return self.shortest_paths(start, {end}, overlay, max_distance).get(end)
+
+    def timed_shortest_path(self, start: str, end: str, overlay: dict=None, max_distance: int=9999) -> list[tuple]:
+        # Overlay edges are (neighbor, weight, map_limit), only usable before map_limit map crossings. Labels (cost, crossings)
+        # are settled in cost order and one is kept only if it crossed fewer maps than every label settled at its node before,
+        # so a node holds its few pareto optimal labels and cheaper but slower arrivals cannot hide a still open portal
+        overlay = overlay or {}
+        ends = set(self.map_nodes.get(end, ()))
+        node_maps, offsets, targets, weights = self.node_maps, self.offsets, self.targets, self.weights
+        best_maps = [math.inf] * len(self.nodes)
+        label_nodes, label_parents, label_depths = [], [], []
+        queue = [(0, 0, node, -1) for node in self._starting_nodes(start, overlay)]
+        heapq.heapify(queue)
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        pops = 0
+        while queue:
+            cost, maps, node, parent = heappop(queue)
+            pops += 1
+            if maps >= best_maps[node]:
+                continue
+            best_maps[node] = maps
+            label = len(label_nodes)
+            depth = label_depths[parent] + 1 if parent >= 0 else 0
+            label_nodes.append(node)
+            label_parents.append(parent)
+            label_depths.append(depth)
+            if node in ends:
+                self.search_stats = (len(label_nodes), pops + len(queue))
+                path = []
+                while label >= 0:
+                    path.append(self.nodes[label_nodes[label]])
+                    label = label_parents[label]
+                return path[::-1]
+            if depth > max_distance:
+                continue
+            for i in range(offsets[node], offsets[node + 1]):
+                neighbor = targets[i]
+                crossed = maps + (node_maps[neighbor] != node_maps[node])
+                if crossed < best_maps[neighbor]:
+                    heappush(queue, (cost + weights[i], crossed, neighbor, label))
+            for neighbor, weight, map_limit in overlay.get(node, ()):
+                crossed = maps + (node_maps[neighbor] != node_maps[node])
+                if maps < map_limit and crossed < best_maps[neighbor]:
+                    heappush(queue, (cost + weight, crossed, neighbor, label))
+        self.search_stats = (len(label_nodes), pops)
+        return None
+
+    def distances_from(self, sources: list[int]) -> array:
+        dist = array('d', [math.inf]) * len(self.nodes)
+        queue = [(0.0, source) for source in sources]
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if cost >= dist[node]:
+                continue
+            dist[node] = cost
+            for i in range(offsets[node], offsets[node + 1]):
+                if cost + weights[i] < dist[targets[i]]:
+                    heapq.heappush(queue, (cost + weights[i], targets[i]))
+        return dist
+
+    def astar_path(self, start: str, end: str, landmarks: 'LandmarkTable', overlay: dict=None) -> list[tuple]:
+        # A* over static edges + overlay, guided by landmark lower bounds towards the end map or any overlay endpoint
+        overlay = overlay or {}
+        targets = set(self.map_nodes.get(end, ()))
+        if not targets:
+            return None
+        heuristic = landmarks.heuristic(list(targets), overlay)
+        offsets, targets_, weights = self.offsets, self.targets, self.weights
+        g = array('d', [math.inf]) * len(self.nodes)
+        preds = [-1] * len(self.nodes)
+        visited = bytearray(len(self.nodes))
+        h = {}
+        queue = []
+        for node in self._starting_nodes(start, overlay):
+            g[node] = 0
+            h[node] = heuristic(node)
+            queue.append((h[node], node, ROOT))
+        heapq.heapify(queue)
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        pops = 0
+        while queue:
+            _, node, parent = heappop(queue)
+            pops += 1
+            if node in targets:
+                self.search_stats = (visited.count(1), pops + len(queue))
+                return self._path(node, parent.node, preds)
+            if visited[node]:
+                continue
+            visited[node] = 1
+            preds[node] = parent.node
+            cost = g[node]
+            ref = PathRef(node, parent.depth + 1, preds)
+            neighbors = [(targets_[i], weights[i]) for i in range(offsets[node], offsets[node + 1])] + overlay.get(node, [])
+            for neighbor, weight in neighbors:
+                if visited[neighbor] or cost + weight > g[neighbor]:
+                    continue
+                g[neighbor] = cost + weight
+                if neighbor not in h:
+                    h[neighbor] = heuristic(neighbor)
+                heappush(queue, (cost + weight + h[neighbor], neighbor, ref))
+        self.search_stats = (visited.count(1), pops)
+        return None
+
+class LandmarkTable:
+    # ALT lower bounds on the static graph, edges are symmetric so d(v, a) >= |d(L, a) - d(L, v)| for any landmark L
+    # Landmarks are picked per connected component by farthest point selection
+    def __init__(self, graph: RoutingGraph, n_landmarks: int=8) -> None:
+        self.nodes = list(graph.nodes)
+        self.component = array('i', [-1]) * len(graph)
+        self.landmarks: list[int] = []
+        vectors: list[list[float]] = [[] for _ in range(len(graph))]
+        for root in range(len(graph)):
+            if self.component[root] >= 0:
+                continue
+            dist = graph.distances_from([root])
+            members = [node for node in range(len(graph)) if dist[node] < math.inf]
+            for node in members:
+                self.component[node] = root
+            # First landmark is the farthest node from root, then the farthest from all chosen landmarks
+            closest = dist
+            for idx in range(max(1, round(n_landmarks * len(members) / len(graph)))):
+                landmark = max(members, key=lambda node: closest[node])
+                if idx and closest[landmark] == 0:
+                    break
+                self.landmarks.append(landmark)
+                dist = graph.distances_from([landmark])
+                for node in members:
+                    vectors[node].append(dist[node])
+                closest = array('d', map(min, closest, dist)) if idx else dist
+        self.vectors = [tuple(v) for v in vectors]
+
+    @classmethod
+    def from_arrays(cls, nodes: list[tuple], component, landmarks, vector_offsets, vector_values) -> 'LandmarkTable':
+        # vectors[i] is vector_values[vector_offsets[i]:vector_offsets[i+1]]
+        table = cls.__new__(cls)
+        table.nodes = nodes
+        table.component, table.landmarks = component, list(landmarks)
+        table.vectors = [tuple(vector_values[vector_offsets[i]:vector_offsets[i + 1]]) for i in range(len(nodes))]
+        return table
+
+    def bound(self, a: int, b: int) -> float:
+        if self.component[a] != self.component[b]:
+            return math.inf
+        return max(map(abs, map(sub, self.vectors[a], self.vectors[b])))
+
+    def heuristic(self, targets: list[int], overlay: dict=None):
+        # Any route is static stretches joined by overlay edges, so with D(u) the best bound from overlay endpoint u
+        # to the targets over the small endpoint graph, h(v) = min(bound(v, t), bound(v, u) + D(u)) is admissible and consistent
+        overlay = overlay or {}
+        lower = {u: math.inf for u in overlay} | {t: 0.0 for t in targets}
+        settled = {}
+        while lower:
+            u = min(lower, key=lower.get)
+            settled[u] = lower.pop(u)
+            if settled[u] == math.inf:
+                break
+            for w, weight in overlay.get(u, ()):
+                if w in lower:
+                    lower[w] = min(lower[w], settled[u] + weight)
+            for w in lower:
+                if settled[u] < lower[w]:
+                    lower[w] = min(lower[w], settled[u] + self.bound(w, u))
+        component, vectors = self.component, self.vectors
+        anchors = [(component[a], vectors[a], d) for a, d in settled.items() if d < math.inf]
+        def lower_bound(node: int) -> float:
+            best = math.inf
+            node_component, node_vector = component[node], vectors[node]
+            for anchor_component, anchor_vector, d in anchors:
+                if anchor_component == node_component and d < best:
+                    best = min(best, d + max(map(abs, map(sub, anchor_vector, node_vector))))
+            return best
+        return lower_bound
@@ -1,9 +1,76 @@
-from bisect import bisect_left
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Match kinds, lower ranks first
+FULL_PREFIX, WORD_PREFIX, INNER = 0, 1, 2
 
 class SubstringSearcher:
+    # Lowercase names and their words are packed into one utf-8 buffer, each entry terminated by \0 so a suffix
+    # sorts like the entry's own suffix string. suffix_array holds buffer offsets in sorted order, owners and kinds
+    # hold the (deduplicated) string index and match kind for each offset
+    def __init__(self, string_list: list[str]) -> None:
+        self.strings = list(dict.fromkeys(string_list))
+        entries, buffer = [], bytearray()
+        for idx, s in enumerate(self.strings):
+            entries.append((len(buffer), idx, FULL_PREFIX))
+            buffer += s.lower().encode() + b'\0'
+            for word in s.replace('-', ' ').lower().split():
+                start = len(buffer)
+                encoded = word.encode()
+                # Only offsets at character boundaries
+                entries += [(start + i, idx, WORD_PREFIX if i == 0 else INNER) for i in range(len(encoded)) if encoded[i] & 0xC0 != 0x80]
+                buffer += encoded + b'\0'
+        self.text = bytes(buffer)
+        entries.sort(key=lambda e: (self.text[e[0]:self.text.index(b'\0', e[0])], e[1]))
+        self.suffix_array = array('I', (e[0] for e in entries))
+        # Owner string index with the match kind folded in, kind * len(strings) + owner, so sorting ranks them
+        self.owners = array('I', (e[2] * len(self.strings) + e[1] for e in entries))
+        self._bucket()
+
+    @classmethod
+    def from_arrays(cls, strings: list[str], text: bytes, suffix_array, owners, buckets: dict=None) -> 'SubstringSearcher':
+        # Arrays may be memoryviews over a bin dump
+        searcher = cls.__new__(cls)
+        searcher.strings, searcher.text, searcher.suffix_array, searcher.owners = strings, text, suffix_array, owners
+        if buckets is None:
+            searcher._bucket()
+        else:
+            searcher.buckets = buckets
+        return searcher
+
+    def _bucket(self) -> None:
+        # Suffix array range of every 1 and 2 byte prefix, so short queries skip the bisect and long ones bisect a bucket
+        self.buckets: dict[bytes, tuple[int, int]] = {}
+        for i, offset in enumerate(self.suffix_array):
+            for n in (1, 2):
+                prefix = self.text[offset:offset + n]
+                if len(prefix) == n and b'\0' not in prefix:
+                    self.buckets[prefix] = (self.buckets.get(prefix, (i,))[0], i + 1)
+
+    def _range(self, query: bytes) -> tuple[int, int]:
+        if not query:
+            return 0, len(self.suffix_array)
+        left, right = self.buckets.get(query[:2], (0, 0))
+        if len(query) <= 2 or left == right:
+            return left, right
+        text, n = self.text, len(query)
+        key = lambda offset: text[offset:offset + n]
+        left = bisect_left(self.suffix_array, query, left, right, key=key)
+        return left, bisect_right(self.suffix_array, query, left, right, key=key)
+
+    def search(self, query: str) -> list[int]:
+        # Indices into self.strings, full name prefixes then word prefixes then inner substrings, each in string order
+        left, right = self._range(query.lower().encode())
+        n = len(self.strings)
+        return list(dict.fromkeys([code % n for code in sorted(self.owners[left:right])]))
+
+    def get(self, query: str) -> list[str]:
+        return [self.strings[idx] for idx in self.search(query)]
+
+class TupleSubstringSearcher:
+    # Previous layout, one (suffix, index) tuple per suffix. Kept for benchmark_substring_searcher
     def __init__(self, string_list: list[str]) -> None:
         self.strings = list(string_list)
-        # Build a suffix array (sorted list of all suffixes)
         self.suffixes = []
         for idx, s in enumerate(string_list):
             self.suffixes.append((s.lower(), idx))
@@ -11,15 +78,52 @@ class SubstringSearcher:
                 for i in range(len(word)):
                     self.suffixes.append((word[i:], idx))
         self.suffixes.sort()
-    
+
     def get(self, query: str) -> list[str]:
         query = query.lower()
-        # Binary search to find the first matching suffix
         left = bisect_left(self.suffixes, (query, 0))
         results = set()
-        # Collect all strings that have this prefix in their suffix
         for i in range(left, len(self.suffixes)):
             if not self.suffixes[i][0].startswith(query):
                 break
             results.add(self.strings[self.suffixes[i][1]])
-        return list(results)
\ No newline at end of file
+        return list(results)
+
+def benchmark_substring_searcher():
+    # Pickle size, load time, build time and per query latency/allocations over every prefix of every map name
+    import pickle
+    import time
+    import tracemalloc
+    from utils.bindata import ZONES
+    names = ZONES.map_names
+    queries = sorted({name.lower()[:i] for name in names for i in range(1, len(name) + 1)})
+    all_results = []
+    for cls in (TupleSubstringSearcher, SubstringSearcher):
+        start = time.perf_counter()
+        searcher = cls(names)
+        build_seconds = time.perf_counter() - start
+        dumped = pickle.dumps(searcher)
+        start = time.perf_counter()
+        for _ in range(20):
+            pickle.loads(dumped)
+        load_seconds = (time.perf_counter() - start) / 20
+        start = time.perf_counter()
+        results = [searcher.get(q) for q in queries]
+        query_seconds = time.perf_counter() - start
+        peaks = []
+        tracemalloc.start()
+        for q in queries:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            searcher.get(q)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        peak = sum(peaks) / len(peaks)
+        print(f'{cls.__name__:>22}: pickle {len(dumped)/1024:.0f}KB, load {load_seconds*1000:.2f}ms, build {build_seconds*1000:.0f}ms, '
+              f'{len(queries)} queries avg {query_seconds/len(queries)*1e6:.1f}us, avg query peak alloc {peak:.0f}B')
+        all_results.append(results)
+    return all_results
+
+if __name__ == "__main__":
+    old, new = benchmark_substring_searcher()
+    assert all(set(a) == set(b) for a, b in zip(old, new))
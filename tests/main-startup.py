@@ -0,0 +1,60 @@
+import asyncio
+import copy
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import main
+from utils import commandsync
+
+class FakeBot:
+    application_id = 1234
+
+    def __init__(self) -> None:
+        # Copies, the ids a sync sets must not leak onto the real bot's commands
+        self.pending_application_commands = [copy.copy(cmd) for cmd in main.bot.pending_application_commands]
+        self._application_commands = {}
+        self.syncs = 0
+
+    async def sync_commands(self):
+        self.syncs += 1
+        for idx, cmd in enumerate(self.pending_application_commands):
+            cmd.id = str(1000 * self.syncs + idx)
+            self._application_commands[cmd.id] = cmd
+
+def test_sync_commands_if_changed():
+    # The real sync state path and commands are left untouched
+    sync_path = commandsync.COMMAND_SYNC_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            commandsync.COMMAND_SYNC_PATH = Path(tmp) / 'command-sync.json'
+            bot = FakeBot()
+            assert asyncio.run(commandsync.sync_commands_if_changed(bot)) and bot.syncs == 1
+            ids = {cmd.name: cmd.id for cmd in bot.pending_application_commands}
+            # A restart with the same commands skips the API but still routes interactions by id
+            restarted = FakeBot()
+            assert not asyncio.run(commandsync.sync_commands_if_changed(restarted)) and restarted.syncs == 0
+            assert {cmd.name: cmd_id for cmd_id, cmd in restarted._application_commands.items()} == ids
+            restarted.application_id = 5678
+            assert asyncio.run(commandsync.sync_commands_if_changed(restarted)) and restarted.syncs == 1
+    finally:
+        commandsync.COMMAND_SYNC_PATH = sync_path
+    assert all(cmd.id is None for cmd in main.bot.pending_application_commands)
+
+def test_command_timing():
+    # Every command is timed by the bot's invoke hooks, not only the ones behind requires_approved
+    enabled, main.METRICS.enabled = main.METRICS.enabled, True
+    try:
+        for cmd in main.bot.pending_application_commands:
+            ctx = SimpleNamespace(bot=main.bot, command=cmd)
+            observed = sum(main.COMMAND_SECONDS.counts.get((cmd.qualified_name,), ()))
+            asyncio.run(cmd.call_before_hooks(ctx))
+            asyncio.run(cmd.call_after_hooks(ctx))
+            assert sum(main.COMMAND_SECONDS.counts[(cmd.qualified_name,)]) == observed + 1, cmd.qualified_name
+    finally:
+        main.METRICS.enabled = enabled
+
+if __name__ == "__main__":
+    test_sync_commands_if_changed()
+    test_command_timing()
+    print("OK")
@@ -0,0 +1,268 @@
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import statistics
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import mongomock
+from pydantic_mongo import PydanticObjectId
+
+import main
+from models.dbmodels import Reminder, Reminders, Portal, Portals, AsyncReminders, AsyncPortals, CollectionScan, plan_stages
+
+FIXTURE_SERVERS = json.loads((Path(__file__).parent / 'fixtures' / 'approved_servers.json').read_text())
+
+@contextlib.contextmanager
+def fixture_guilds():
+    # Commands see the fixture servers instead of config.json's approvedServers, put back afterwards
+    guilds = main.GUILDS.guilds
+    main.GUILDS.swap(main.GUILDS.compile(FIXTURE_SERVERS))
+    try:
+        yield next(iter(FIXTURE_SERVERS.items()))
+    finally:
+        main.GUILDS.swap(guilds)
+
+@contextlib.contextmanager
+def restored(*names):
+    # main's repositories, scheduler and portal graphs a test replaces are put back afterwards
+    saved = {name: getattr(main, name) for name in names}
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+
+class SlowRepository:
+    # Adds a fixed network round-trip to every repository call. mongomock is not thread safe, each call runs whole
+    # under a lock like a single operation on a real server
+    def __init__(self, repository, latency_seconds: float) -> None:
+        self.repository = repository
+        self.latency_seconds = latency_seconds
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.repository, name)
+        if not callable(attr):
+            return attr
+        def slow(*args, **kwargs):
+            time.sleep(self.latency_seconds)
+            with self.lock:
+                result = attr(*args, **kwargs)
+                return list(result) if isinstance(result, types.GeneratorType) else result
+        return slow
+
+class CountingRepository:
+    # Counts every repository call, i.e. every Mongo round-trip
+    def __init__(self, repository) -> None:
+        self.repository = repository
+        self.calls: list[str] = []
+
+    def __getattr__(self, name):
+        attr = getattr(self.repository, name)
+        if not callable(attr):
+            return attr
+        def counted(*args, **kwargs):
+            self.calls.append(name)
+            return attr(*args, **kwargs)
+        return counted
+
+class BlockingMixin:
+    # Previous behaviour: pymongo called directly on the event loop
+    async def run(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+class BlockingReminders(BlockingMixin, AsyncReminders): pass
+class BlockingPortals(BlockingMixin, AsyncPortals): pass
+
+class FakeCtx:
+    def __init__(self, guild_id: str) -> None:
+        self.guild_id = int(guild_id)
+        self.guild = 'Load Test'
+        self.command = 'upcoming'
+        self.author = SimpleNamespace(name='loadtest', id=0, mention='@loadtest')
+        self.responded = None
+        self.message = None
+
+    async def respond(self, *args, **kwargs):
+        self.responded = time.perf_counter()
+        self.message = args[0] if args else None
+
+def make_repositories(latency_seconds: float, ping_channel_id: int):
+    db = mongomock.MongoClient().cortex
+    reminders, portals = Reminders(database=db), Portals(database=db)
+    now = dt.datetime.now(dt.timezone.utc)
+    for i in range(10):
+        reminders.save(Reminder(
+            objective=f'Load Test {i}', location='Fort Sterling', time_unlocked=now, submitter='@loadtest',
+            time_submitted=now, pingChannelId=ping_channel_id, roleMention='@here', time_to_ping=now + dt.timedelta(hours=1),
+        ))
+    return SlowRepository(reminders, latency_seconds), SlowRepository(portals, latency_seconds)
+
+def p99(latencies: list[float]) -> float:
+    return statistics.quantiles(latencies, n=100)[98]
+
+async def submit_all(guild_id: str, ping_channel_id: int, n_invocations: int) -> tuple[float, list[FakeCtx]]:
+    ctxs = [FakeCtx(guild_id) for _ in range(n_invocations)]
+    start = time.perf_counter()
+    await asyncio.gather(*(main.submit_reminder(ctx, make_reminder(f'Load {i}', ping_channel_id)) for i, ctx in enumerate(ctxs)))
+    return start, ctxs
+
+def test_submit_load(n_invocations: int=50, latency_seconds: float=0.02):
+    # Concurrent submissions on the executor all get their reply and all land in Mongo
+    with fixture_guilds() as (guild_id, server_data), restored('REMINDERS', 'PORTALS', 'SCHEDULER'):
+        main.SCHEDULER = main.ReminderScheduler()
+        reminders, portals = make_repositories(latency_seconds, server_data['pingChannelId'])
+        executor = ThreadPoolExecutor(max_workers=8)
+        main.REMINDERS, main.PORTALS = AsyncReminders(reminders, executor), AsyncPortals(portals, executor)
+        _, ctxs = asyncio.run(submit_all(guild_id, server_data['pingChannelId'], n_invocations))
+        assert all(ctx.responded is not None and ctx.message.startswith('New reminder set') for ctx in ctxs)
+        assert reminders.get_collection().count_documents({}) == 10 + n_invocations
+
+def benchmark_submit_load(n_invocations: int=50, latency_seconds: float=0.02):
+    # /upcoming is served from a cached render now, reminder submissions still wait on Mongo
+    with fixture_guilds() as (guild_id, server_data), restored('REMINDERS', 'PORTALS', 'SCHEDULER'):
+        main.SCHEDULER = main.ReminderScheduler()
+        reminders, portals = make_repositories(latency_seconds, server_data['pingChannelId'])
+        executor = ThreadPoolExecutor(max_workers=8)
+        modes = {
+            'blocking': (BlockingReminders(reminders), BlockingPortals(portals)),
+            'async': (AsyncReminders(reminders, executor), AsyncPortals(portals, executor)),
+        }
+        for name, (main.REMINDERS, main.PORTALS) in modes.items():
+            start, ctxs = asyncio.run(submit_all(guild_id, server_data['pingChannelId'], n_invocations))
+            latencies = [ctx.responded - start for ctx in ctxs]
+            print(f'{name:>8}: {n_invocations} concurrent reminder submissions, p50 {statistics.median(latencies)*1000:.1f}ms, p99 {p99(latencies)*1000:.1f}ms')
+
+def test_format_route_queries():
+    # /upcoming renders reminders from the scheduler and notable routes over player roads from the live portal graph,
+    # then serves that render until one of them changes. Neither asks Mongo
+    with fixture_guilds() as (guild_id, server_data), restored('REMINDERS', 'PORTALS', 'SCHEDULER', 'PORTAL_GRAPHS'):
+        reminders, portals = make_repositories(0, server_data['pingChannelId'])
+        now = dt.datetime.now(dt.timezone.utc)
+        roads = [(server_data['homeMap'], 'Qiient-Al-Nusom'), ('Qiient-Al-Nusom', 'Whitebank Descent')]
+        for from_map, to_map in roads:
+            portals.save(Portal(
+                id=PydanticObjectId(), from_map=from_map, to_map=to_map, time_expire=now + dt.timedelta(hours=1),
+                submitter='@loadtest', time_submitted=now,
+            ))
+        reminders, portals = CountingRepository(reminders), CountingRepository(portals)
+        main.REMINDERS, main.PORTALS = AsyncReminders(reminders), AsyncPortals(portals)
+        main.PORTAL_GRAPHS = {}
+        main.portal_graph(main.GUILDS.get(int(guild_id)).region).load(portals.get_all())
+        main.SCHEDULER = main.ReminderScheduler()
+        main.SCHEDULER.load(reminders.find_by({}))
+        reminders.calls.clear()
+        portals.calls.clear()
+        ctx = FakeCtx(guild_id)
+        asyncio.run(main.upcoming.callback(ctx))
+        assert reminders.calls == [], reminders.calls
+        assert portals.calls == [], portals.calls
+        # Both player roads show their expiry, whichever direction the route is rendered in
+        assert ctx.message.count('--<t:') == len(roads), ctx.message
+        assert ctx.message.count('Load Test') == 10, ctx.message
+        misses = main.DASHBOARDS.misses
+        asyncio.run(main.upcoming.callback(FakeCtx(guild_id)))
+        assert main.DASHBOARDS.misses == misses, 'unchanged reminders and roads should be served from the cached render'
+
+def test_indexes():
+    db = mongomock.MongoClient().cortex
+    reminders, portals = Reminders(database=db), Portals(database=db)
+    for repository in (reminders, portals):
+        repository.ensure_indexes()
+        keys = [list(dict(index['key'])) for index in repository.get_collection().index_information().values()]
+        # Every hot query shape is covered by an index starting with its filter fields
+        for query, sort in repository.query_shapes():
+            fields = list(query) + [field for field, _ in sort or []]
+            assert any(key[:len(fields)] == fields for key in keys), (repository.get_collection().name, fields, keys)
+    assert portals.get_collection().index_information()['time_expire_1']['expireAfterSeconds'] == 0
+
+def test_plan_stages():
+    collscan = {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN', 'filter': {}}}
+    ixscan = {'queryPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'submitter_1'}}, 'slotBasedPlan': {}}
+    assert plan_stages(collscan) == ['SORT', 'COLLSCAN']
+    assert plan_stages(ixscan) == ['FETCH', 'IXSCAN']
+    reminders = Reminders(database=mongomock.MongoClient().cortex)
+    class Explained:
+        def __init__(self, plan): self.plan = plan
+        def sort(self, sort): return self
+        def explain(self): return {'queryPlanner': {'winningPlan': self.plan}}
+    for plan, fails in ((ixscan, False), (collscan, True)):
+        reminders.get_collection = lambda: SimpleNamespace(name='reminders', find=lambda query: Explained(plan))
+        try:
+            reminders.check_query_plans()
+            assert not fails
+        except CollectionScan:
+            assert fails
+
+def make_reminder(objective: str, ping_channel_id: int, minutes: int=60) -> Reminder:
+    now = dt.datetime.now(dt.timezone.utc)
+    return Reminder(
+        objective=objective, location='Fort Sterling', time_unlocked=now + dt.timedelta(minutes=minutes), submitter='@loadtest',
+        time_submitted=now, pingChannelId=ping_channel_id, roleMention='@here', time_to_ping=now + dt.timedelta(minutes=minutes - 1),
+    )
+
+def test_submit_reminder_round_trips():
+    with fixture_guilds() as (guild_id, server_data), restored('REMINDERS', 'SCHEDULER'):
+        reminders = CountingRepository(Reminders(database=mongomock.MongoClient().cortex))
+        reminders.ensure_indexes()
+        main.REMINDERS, main.SCHEDULER = AsyncReminders(reminders), main.ReminderScheduler()
+        for minutes in (60, 90):
+            reminders.calls.clear()
+            ctx = FakeCtx(guild_id)
+            asyncio.run(main.submit_reminder(ctx, make_reminder('Gold Core', server_data['pingChannelId'], minutes)))
+            assert reminders.calls == ['upsert'], reminders.calls
+        assert ctx.message.startswith('Reminder already exists') and len(main.SCHEDULER) == 1
+        # The natural key includes the channel, another guild's reminder for the same core is its own
+        asyncio.run(main.submit_reminder(FakeCtx(guild_id), make_reminder('Gold Core', server_data['pingChannelId'] + 1)))
+        assert reminders.get_collection().count_documents({}) == 2 and len(main.SCHEDULER) == 2
+
+def test_concurrent_upsert(n_threads: int=16, rounds: int=20, latency_seconds: float=0.005):
+    # Everyone submits the same core at once. Previous find/delete/save left duplicates, the upsert leaves exactly
+    # one document, created by exactly one submission
+    def find_delete_save(repository, reminder: Reminder) -> None:
+        for existing in list(repository.find_by({"objective": reminder.objective, "location": reminder.location})):
+            repository.delete(existing)
+        repository.save(reminder)
+    modes = {
+        'find/delete/save': (SlowRepository(Reminders(database=mongomock.MongoClient().cortex), latency_seconds), find_delete_save),
+        'upsert': (SlowRepository(Reminders(database=mongomock.MongoClient().cortex), latency_seconds), lambda repository, reminder: repository.upsert(reminder)),
+    }
+    modes['upsert'][0].ensure_indexes()
+    for name, (reminders, submit_with) in modes.items():
+        duplicated = 0
+        for round in range(rounds):
+            barrier = threading.Barrier(n_threads)
+            objective = f'Race {round}'
+            def submit(minutes: int) -> Reminder:
+                reminder = make_reminder(objective, 0, minutes)
+                barrier.wait()
+                return submit_with(reminders, reminder), reminder
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                results = list(executor.map(submit, range(60, 60 + n_threads)))
+            docs = list(reminders.find_by({'objective': objective}))
+            duplicated += len(docs) > 1
+            if name != 'upsert':
+                continue
+            assert len(docs) == 1, f'{len(docs)} reminders for {objective}'
+            assert sum(previous is None for previous, _ in results) == 1
+            assert len({reminder.id for _, reminder in results}) == 1 and docs[0].id == results[0][1].id
+            # The survivor is one of the submissions and claimable with the copy its submitter scheduled
+            winner = next(reminder for _, reminder in results if reminder.time_to_ping == docs[0].time_to_ping)
+            assert reminders.claim(winner) is not None and reminders.claim(winner) is None
+        print(f'{name:>16}: {n_threads} concurrent submissions x {rounds} rounds, {duplicated} rounds left duplicates')
+
+if __name__ == "__main__":
+    test_submit_load()
+    test_format_route_queries()
+    test_indexes()
+    test_plan_stages()
+    test_submit_reminder_round_trips()
+    test_concurrent_upsert()
+    benchmark_submit_load()
+    print("OK")
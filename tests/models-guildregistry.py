@@ -0,0 +1,110 @@
+import copy
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from models.guildregistry import GuildConfig, GuildRegistry
+
+MAP_IDS = {'Fort Sterling': '3004', 'Lymhurst': '1002', 'Scuttlesink Marsh': '2104', 'Whitebank Descent': '3005'}
+SERVERS = {
+    '123': {
+        'name': 'Test', 'homeMap': 'Scuttlesink Marsh', 'pingChannelId': 456, 'roleMention': '@here',
+        'upcomingConfig': {'notableMaps': ['Fort Sterling', 'Scuttlesink Marsh', 'Lymhurst'], 'maxMapsOut': 8},
+    },
+    '789': {'name': 'No Home', 'pingChannelId': 1011, 'roleMention': '@core', 'region': 'east'},
+}
+
+def resolve_map_id(name: str, region: str) -> str:
+    return MAP_IDS.get(name)
+
+def write_config(path: Path, approved_servers: dict) -> None:
+    path.write_text(json.dumps({'approvedServers': approved_servers}))
+    # Same size rewrites within the filesystem's mtime resolution would look unchanged
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def test_compile():
+    guild = GuildConfig.compile('123', SERVERS['123'], 'west', resolve_map_id)
+    assert guild.guild_id == 123 and guild.region == 'west' and guild.home_map_id == '2104'
+    assert guild.notable_maps == ('Scuttlesink Marsh', 'Fort Sterling', 'Lymhurst') and guild.max_maps_out == 8
+    assert guild.alias == ' (Test)'
+    no_home = GuildConfig.compile('789', SERVERS['789'], 'west', resolve_map_id)
+    assert no_home.region == 'east' and no_home.home_map is None and no_home.notable_maps == ()
+    for broken in ({'homeMap': 'Fort Sterlin'}, {'upcomingConfig': {'notableMaps': ['Lymhurts'], 'maxMapsOut': 8}}):
+        try:
+            GuildConfig.compile('123', SERVERS['123'] | broken, 'west', resolve_map_id)
+            assert False, broken
+        except ValueError:
+            pass
+
+def test_reload():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'config.json'
+        write_config(path, SERVERS)
+        registry = GuildRegistry(path, 'west', resolve_map_id)
+        assert {guild.guild_id for guild in registry.reload_if_changed()} == {123, 789}
+        assert registry.reload_if_changed() is None, 'unchanged file should not be compiled again'
+        guilds = registry.guilds
+
+        servers = copy.deepcopy(SERVERS)
+        servers['123']['homeMap'] = 'Fort Sterling'
+        del servers['789']
+        write_config(path, servers)
+        prepared = []
+        def prepare(changed: list[GuildConfig]) -> None:
+            # Warmed before the swap, commands still see the previous home map
+            assert registry.get(123).home_map == 'Scuttlesink Marsh'
+            prepared.extend(changed)
+        changed = registry.reload_if_changed(prepare)
+        assert [guild.home_map for guild in changed] == [guild.home_map for guild in prepared] == ['Fort Sterling']
+        assert registry.get(123).home_map_id == '3004' and registry.get(789) is None
+        assert guilds[789].name == 'No Home', 'readers holding the previous mapping keep a consistent view'
+
+        # Invalid edits keep serving the current servers
+        servers['123']['homeMap'] = 'Fort Sterlin'
+        write_config(path, servers)
+        try:
+            registry.reload_if_changed()
+            assert False
+        except ValueError:
+            pass
+        path.write_text('{"approvedServers": {')
+        try:
+            registry.reload_if_changed()
+            assert False
+        except json.JSONDecodeError:
+            pass
+        assert registry.get(123).home_map == 'Fort Sterling'
+
+def benchmark_guild_lookup(n_lookups: int=200_000):
+    # Per command: previous str(guild_id) lookup in the raw config plus alias formatting vs the compiled registry
+    approved_servers = {str(1000 + i): SERVERS['123'] | {'name': f'Server {i}'} for i in range(50)}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'config.json'
+        write_config(path, approved_servers)
+        registry = GuildRegistry(path, 'west', resolve_map_id)
+        registry.reload_if_changed()
+    guild_ids = [1000 + i % 60 for i in range(n_lookups)]
+    start = time.perf_counter()
+    for guild_id in guild_ids:
+        server_data = approved_servers.get(str(guild_id), None)
+        alias = f" ({approved_servers[str(guild_id)]['name']})" if approved_servers.get(str(guild_id), None) is not None else ''
+        if server_data is not None:
+            server_data.get('homeMap', None), server_data.get('region', 'west')
+    config_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for guild_id in guild_ids:
+        guild = registry.get(guild_id)
+        alias = guild.alias if guild is not None else ''
+        if guild is not None:
+            guild.home_map, guild.region
+    registry_seconds = time.perf_counter() - start
+    print(f'Guild lookup: config dict {config_seconds/n_lookups*1e9:.0f}ns, registry {registry_seconds/n_lookups*1e9:.0f}ns per command')
+
+if __name__ == "__main__":
+    test_compile()
+    test_reload()
+    benchmark_guild_lookup()
+    print("OK")
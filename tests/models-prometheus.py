@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import metrics
+from models.prometheus import MetricsRegistry, SIZE_BUCKETS
+
+def test_render():
+    registry = MetricsRegistry(enabled=True)
+    latency = registry.histogram('test_seconds', 'Test latency', buckets=(0.1, 1.0), labels=('command',))
+    errors = registry.counter('test_errors_total', 'Test errors', labels=('method',))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, 'core')
+    errors.inc('find_by')
+    errors.inc('find_by', amount=2)
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP test_seconds Test latency', '# TYPE test_seconds histogram']
+    assert 'test_seconds_bucket{command="core",le="0.1"} 1.0' in lines
+    assert 'test_seconds_bucket{command="core",le="1.0"} 2.0' in lines
+    assert 'test_seconds_bucket{command="core",le="+Inf"} 3.0' in lines
+    assert 'test_seconds_count{command="core"} 3.0' in lines and 'test_seconds_sum{command="core"} 5.55' in lines
+    assert 'test_errors_total{method="find_by"} 3.0' in lines
+    # Same name returns the existing metric
+    assert registry.histogram('test_seconds', 'Test latency') is latency
+
+def test_timed():
+    enabled, disabled = MetricsRegistry(enabled=True), MetricsRegistry(enabled=False)
+    def guess(s: str) -> str:
+        return s.title()
+    async def command() -> str:
+        await asyncio.sleep(0.01)
+        return 'done'
+    assert disabled.timed(disabled.histogram('off_seconds', ''))(guess) is guess
+    sync_seconds, async_seconds = enabled.histogram('sync_seconds', ''), enabled.histogram('async_seconds', '', labels=('command',))
+    assert enabled.timed(sync_seconds)(guess)('fort') == 'Fort'
+    assert asyncio.run(enabled.timed(async_seconds, 'core')(command)()) == 'done'
+    assert sum(sync_seconds.counts[()]) == 1 and async_seconds.sums[('core',)] >= 0.01
+
+def test_scrape():
+    metrics.ROUTE_EXPANDED.observe(120, 'astar')
+    async def scrape() -> bytes:
+        server = await metrics.serve_metrics('127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+    response = asyncio.run(scrape()).decode()
+    assert response.startswith('HTTP/1.1 200 OK') and 'version=0.0.4' in response
+    assert 'cortex_route_expanded_nodes_bucket{algorithm="astar",le="300.0"} 1.0' in response
+
+def benchmark_disabled_overhead(n_calls: int=200000):
+    # A disabled registry hands back the function itself, an enabled one adds two clock reads and a locked observe
+    def guess(s: str) -> str:
+        return s
+    for enabled in (False, True):
+        registry = MetricsRegistry(enabled)
+        func = registry.timed(registry.histogram('bench_seconds', '', SIZE_BUCKETS))(guess)
+        start = time.perf_counter()
+        for _ in range(n_calls):
+            func('fort')
+        print(f'enabled={enabled}: {(time.perf_counter() - start)/n_calls*1e9:.0f}ns per call')
+
+if __name__ == "__main__":
+    test_render()
+    test_timed()
+    test_scrape()
+    benchmark_disabled_overhead()
+    print("OK")
@@ -0,0 +1,117 @@
+from array import array
+import shutil
+import tempfile
+from pathlib import Path
+
+from models.bindump import BinDump, StaleBinDump, write_bindump
+from models.fuzzymatcher import FuzzyMatcher
+from models.routinggraph import RoutingGraph
+from utils.bindata import build_bin_dumps, n_letter_cache, parse_world_xml, WorldData, WORLD_PATH, WORLD_SCHEMA_VERSION
+
+FIXTURE_PATH = Path(__file__).parent / 'fixtures' / 'world_mini.xml'
+
+def test_parse_world_xml():
+    zones, edges = parse_world_xml(FIXTURE_PATH)
+    assert zones.map_names == ['Fort Sterling', 'Whitebank Descent', 'Fort Sterling Portal', 'Undercroft', 'Arena1', 'Qiient-Al-Nusom']
+    assert zones.get_portal('Qiient-Al-Nusom') == ('ROADS', '6000')
+    # Portals are free and bidirectional, crossing a map costs distance, 4x in dungeons
+    assert edges[('3004-a', '3004')][('3005-a', '3005')] == edges[('3005-a', '3005')][('3004-a', '3004')] == 0
+    assert edges[('3004-a', '3004')][('3004-b', '3004')] == 50
+    assert edges[('4100-a', '4100')][('4100-c', '4100')] == 40
+    # Exits without a target and maps with digits in their name are not routable
+    assert ('4100-b', '4100') not in edges and ('5001-a', '5001') not in edges
+    # Additional portal between the city and its portal town
+    assert edges[('3004-a', '3004')][('4001-a', '4001')] == 0
+
+def test_build_bin_dumps():
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path, out_dir = Path(tmp) / 'world.xml', Path(tmp) / 'bin-dumps'
+        shutil.copy(FIXTURE_PATH, xml_path)
+        assert build_bin_dumps(xml_path, out_dir)
+        assert not build_bin_dumps(xml_path, out_dir), 'unchanged xml should be skipped'
+        assert [p.name for p in out_dir.iterdir()] == [WORLD_PATH.name]
+        zones, edges = parse_world_xml(xml_path)
+        world = BinDump(out_dir / WORLD_PATH.name, WORLD_SCHEMA_VERSION)
+        graph = RoutingGraph.from_csr(
+            list(zip(world.strings('graph.portals'), world.strings('graph.maps'))),
+            world['graph.offsets'], world['graph.targets'], world['graph.weights'], world['graph.start_order'],
+        )
+        assert set(RoutingGraph(edges).nodes) < set(graph.nodes)
+        assert graph.shortest_path('3004', '4100') == [('3004-a', '3004'), ('3005-a', '3005'), ('3005-b', '3005'), ('4100-a', '4100')]
+        assert world.strings('zones.names') == zones.map_names
+        del world, graph
+        # Everything else is rebuilt from world.bin as well
+        data = WorldData('test', out_dir, xml_path)
+        assert data.portals_edge == edges
+        assert data.n_letter_cache == n_letter_cache(zones.map_names)
+        matcher = FuzzyMatcher(zones.map_names)
+        assert data.fuzzy_matcher.get('fort sterlin') == matcher.get('fort sterlin') == ['Fort Sterling', 'Fort Sterling Portal']
+        assert {gram: list(ids) for gram, ids in data.fuzzy_matcher.postings.items()} == {gram: list(ids) for gram, ids in matcher.postings.items()}
+        del data
+        xml_path.write_text(xml_path.read_text().replace('Undercroft', 'Undercroft Depths'))
+        assert build_bin_dumps(xml_path, out_dir), 'changed xml should be rebuilt'
+
+def test_bindump_close():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'test.bin'
+        write_bindump(path, 1, {'values': array('I', [1, 2, 3])})
+        with BinDump(path, 1) as dump:
+            assert list(dump['values']) == [1, 2, 3]
+        assert dump.mm.closed
+        try:
+            BinDump(path, 2)
+            assert False, 'schema mismatch should raise'
+        except StaleBinDump as e:
+            # Unmapped before raising even though the traceback still references it
+            assert e.__traceback__.tb_next.tb_frame.f_locals['self'].mm.closed
+
+def test_concurrent_write_bindump(n_threads: int=8):
+    # Builders racing on the same dump each swap in a complete file, the survivor always validates
+    from concurrent.futures import ThreadPoolExecutor
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'world.bin'
+        def write(n: int) -> None:
+            write_bindump(path, 1, {'values': array('I', range(n * 100_000))})
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(write, range(1, n_threads + 1)))
+        with BinDump(path, 1) as dump:
+            assert len(dump['values']) % 100_000 == 0
+        assert [p.name for p in Path(tmp).iterdir()] == ['world.bin']
+        assert path.stat().st_mode & 0o777 == 0o644
+
+def test_world_data_loads_once(n_threads: int=8):
+    # Threads racing on an unloaded attribute share one load, nested loaders don't deadlock
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    calls = []
+    def counted(name: str):
+        def load(world: WorldData):
+            calls.append(name)
+            time.sleep(0.05)
+            return WorldData.loaders[name](world)
+        return load
+    class CountedWorldData(WorldData):
+        loaders = {name: counted(name) for name in WorldData.loaders}
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path, out_dir = Path(tmp) / 'world.xml', Path(tmp) / 'bin-dumps'
+        shutil.copy(FIXTURE_PATH, xml_path)
+        build_bin_dumps(xml_path, out_dir)
+        data = CountedWorldData('test', out_dir, xml_path)
+        barrier = threading.Barrier(n_threads)
+        def load(_) -> tuple:
+            barrier.wait()
+            return data.landmarks, data.zones
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            results = list(executor.map(load, range(n_threads)))
+        assert all(r[0] is results[0][0] and r[1] is results[0][1] for r in results)
+        assert sorted(calls) == sorted(['landmarks', 'bindump', 'routing_graph', 'zones']), calls
+        del data, results
+
+if __name__ == "__main__":
+    test_parse_world_xml()
+    test_build_bin_dumps()
+    test_bindump_close()
+    test_concurrent_write_bindump()
+    test_world_data_loads_once()
+    print("OK")
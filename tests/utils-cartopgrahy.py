@@ -1,11 +1,18 @@
+import datetime as dt
+
+from pydantic_mongo import PydanticObjectId
+
+from config import config
 from models.dbmodels import Portal
-from utils.cartography import translated_djikstra, best_guesses
+from models.lrucache import LRUCache
+from utils.bindata import get_world
+from utils.cartography import translated_djikstra, translated_djikstra_many, best_guesses, get_autocomplete, get_timed_overlay, translate_path, AUTOCOMPLETES, ROUTE_CACHE
+from utils.portalgraph import PortalGraphCache, utc_now
 
 def test_djikstra():
     print(best_guesses("tp"))
     # print(translated_djikstra("Scuttlesink Marsh", "Fort Sterling"))
     # test_queries()
-    import datetime as dt
     def construct_portal(m1: str, m2: str) -> Portal:
         return Portal(
             from_map=m1, to_map=m2,
@@ -17,5 +24,87 @@ def test_djikstra():
     ]
     print(translated_djikstra("Scuttlesink Marsh", "Fort Sterling", roads=[construct_portal(*c) for c in connections]))
 
+def test_route_cache_per_algorithm():
+    # Equally long routes can come out of A* and Dijkstra in a different order, neither serves the other's cached route
+    start, end = 'Scuttlesink Marsh', 'Fort Sterling'
+    ROUTE_CACHE.clear()
+    many = translated_djikstra_many(start, [end])[end]
+    (key, _), = ROUTE_CACHE.data.items()
+    ROUTE_CACHE.put(key, ('Dijkstra only',))
+    assert translated_djikstra(start, end) == many
+    assert translated_djikstra_many(start, [end])[end] == ['Dijkstra only']
+    assert len(ROUTE_CACHE) == 2
+
+def test_timed_route_reuses_cache():
+    # Departing while every road on the cached route is still open on arrival serves the cached route
+    start, end = 'Scuttlesink Marsh', 'Fort Sterling'
+    depart = utc_now()
+    def road(m1: str, m2: str, minutes: float) -> Portal:
+        return Portal(id=PydanticObjectId(), from_map=m1, to_map=m2, time_expire=depart + dt.timedelta(minutes=minutes), submitter="test", time_submitted=depart)
+    roads = PortalGraphCache()
+    roads.load([road('Scuttlesink Marsh', 'Qiient-Al-Nusom', 60), road('Qiient-Al-Nusom', 'Whitebank Descent', 60)])
+    ROUTE_CACHE.clear()
+    untimed = translated_djikstra(start, end, roads)
+    hits = ROUTE_CACHE.hits
+    roads.world.routing_graph.search_stats = None
+    assert translated_djikstra(start, end, roads, depart=depart) == untimed and ROUTE_CACHE.hits == hits + 1
+    assert roads.world.routing_graph.search_stats is None, 'no search should have run'
+    # The second road closes before the route crosses it, the timed search routes around it
+    roads.load([road('Scuttlesink Marsh', 'Qiient-Al-Nusom', 60), road('Qiient-Al-Nusom', 'Whitebank Descent', config['secondsPerMap'] / 60)])
+    untimed = translated_djikstra(start, end, roads)
+    world = roads.world
+    timed = translate_path(world.routing_graph.timed_shortest_path(
+        world.zones.get_map_id(start), world.zones.get_map_id(end), get_timed_overlay(roads, depart, world)
+    ), world)
+    assert untimed[:3] == ['Scuttlesink Marsh', 'Qiient-Al-Nusom', 'Whitebank Descent'] and timed != untimed
+    assert translated_djikstra(start, end, roads, depart=depart) == timed
+
+def test_concurrent_caches(n_threads: int=8):
+    # Warm-up threads racing each other (and the event loop) share one autocomplete index and never break an LRU cache
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    AUTOCOMPLETES.clear()
+    barrier = threading.Barrier(n_threads)
+    def autocomplete(_):
+        barrier.wait()
+        return get_autocomplete(get_world())
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        indexes = list(executor.map(autocomplete, range(n_threads)))
+    assert all(index is AUTOCOMPLETES[get_world().region] for index in indexes)
+    cache = LRUCache(8)
+    def churn(n: int) -> None:
+        for i in range(20_000):
+            cache.put((n, i % 16), i)
+            cache.get((n - 1, i % 16))
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(churn, range(n_threads)))
+    assert len(cache) == 8 and cache.hits + cache.misses == n_threads * 20_000
+
+def test_load_since_version():
+    # A reconcile's snapshot is read while commands keep adding and deleting portals
+    now = utc_now()
+    def road(m1: str, m2: str) -> Portal:
+        return Portal(id=PydanticObjectId(), from_map=m1, to_map=m2, time_expire=now + dt.timedelta(hours=1), submitter="test", time_submitted=now)
+    deleted, kept = road('Scuttlesink Marsh', 'Qiient-Al-Nusom'), road('Qiient-Al-Nusom', 'Whitebank Descent')
+    roads = PortalGraphCache()
+    roads.load([deleted, kept])
+    version = roads.version
+    added = road('Whitebank Descent', 'Fort Sterling')
+    roads.add(added)
+    roads.remove(deleted.id)
+    roads.load([deleted, kept], since_version=version)
+    assert set(roads.portals) == {str(kept.id), str(added.id)}, 'removed since the snapshot must not come back'
+    assert roads.find_portal('Scuttlesink Marsh', 'Qiient-Al-Nusom', now) is None
+    # Deleted then submitted again after the snapshot, the new one wins
+    version = roads.version
+    roads.remove(kept.id)
+    roads.add(kept)
+    roads.load([], since_version=version)
+    assert set(roads.portals) == {str(kept.id)}
+
 if __name__ == "__main__":
     test_djikstra()
+    test_route_cache_per_algorithm()
+    test_timed_route_reuses_cache()
+    test_concurrent_caches()
+    test_load_since_version()
@@ -0,0 +1,251 @@
+import asyncio
+import datetime as dt
+import json
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import discord
+from pydantic_mongo import PydanticObjectId
+
+import main
+from models.dbmodels import Reminder, Portal
+from utils import dashboard
+from utils.dashboard import UpcomingDashboards, utc_now
+from utils.scheduler import ReminderScheduler
+
+FIXTURE_SERVERS = json.loads((Path(__file__).parent / 'fixtures' / 'approved_servers.json').read_text())
+GUILD = SimpleNamespace(guild_id=123, name='Test')
+
+class State:
+    # Stands in for the scheduler and portal graph a render is built from
+    def __init__(self, clock=utc_now) -> None:
+        self.clock = clock
+        self.version = 0
+        self.valid_until = None
+        self.renders = 0
+        self.text = None
+        self.edits: list[str] = []
+
+    def key(self, guild) -> tuple:
+        return (self.version,)
+
+    def render(self, guild) -> tuple[str, dt.datetime]:
+        self.renders += 1
+        expired = self.valid_until is not None and self.clock() >= self.valid_until
+        return self.text or f'v{self.version}{" expired" if expired else ""}', self.valid_until
+
+    async def publish(self, guild, text: str) -> None:
+        self.edits.append(text)
+
+class FakeClock:
+    # Time only moves when the test advances it, sleepers due by then are woken
+    def __init__(self) -> None:
+        self.time = utc_now()
+        self.sleepers: list[tuple[dt.datetime, asyncio.Future]] = []
+
+    def now(self) -> dt.datetime:
+        return self.time
+
+    async def sleep(self, seconds: float) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self.sleepers.append((self.time + dt.timedelta(seconds=seconds), future))
+        await future
+
+    async def advance(self, seconds: float=0) -> None:
+        # Whatever is ready runs at the current time first
+        await settle()
+        self.time += dt.timedelta(seconds=seconds)
+        due = [future for wake_at, future in self.sleepers if wake_at <= self.time]
+        self.sleepers = [(wake_at, future) for wake_at, future in self.sleepers if wake_at > self.time]
+        for future in due:
+            if not future.done():
+                future.set_result(None)
+        await settle()
+
+async def settle() -> None:
+    # Lets every task that can run do so, no wall clock involved
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+def make_reminder(channel_id: int, minutes: int) -> Reminder:
+    now = utc_now()
+    return Reminder(
+        id=PydanticObjectId(), objective='Gold Core', location='Fort Sterling', time_unlocked=now + dt.timedelta(minutes=minutes),
+        submitter='@test', time_submitted=now, pingChannelId=channel_id, roleMention='@here',
+        time_to_ping=now + dt.timedelta(minutes=minutes - 1),
+    )
+
+def test_get():
+    state = State()
+    dashboards = UpcomingDashboards(state.key, state.render, state.publish)
+    assert dashboards.get(GUILD) == dashboards.get(GUILD) == 'v0' and state.renders == 1
+    state.version += 1
+    assert dashboards.get(GUILD) == 'v1' and state.renders == 2
+    # A portal on the rendered routes expiring invalidates the render without any version changing
+    state.valid_until = utc_now() + dt.timedelta(minutes=1)
+    state.version += 1
+    dashboards.get(GUILD)
+    assert dashboards.get(GUILD, now=state.valid_until) == 'v2' and state.renders == 4
+
+def test_run():
+    clock = FakeClock()
+    state = State(clock.now)
+    dashboards = UpcomingDashboards(state.key, state.render, state.publish, debounce_seconds=2, clock=clock.now, sleep=clock.sleep)
+    async def scenario():
+        task = asyncio.create_task(dashboards.run(lambda: [GUILD]))
+        await settle()
+        assert state.edits == ['v0']
+        # A burst of changes within the debounce is one edit
+        for _ in range(10):
+            state.version += 1
+            dashboards.notify()
+            await clock.advance(0.1)
+        assert state.edits == ['v0'], state.edits
+        await clock.advance(2)
+        assert state.edits == ['v0', 'v10'], state.edits
+        # Re-rendered to the same text, nothing is sent
+        state.version += 1
+        state.renders, state.text = 0, 'v10'
+        dashboards.notify()
+        await clock.advance(2)
+        assert state.renders == 1 and state.edits == ['v0', 'v10'], state.edits
+        # Woken by the render's deadline alone
+        state.text = None
+        state.version += 1
+        state.valid_until = clock.now() + dt.timedelta(seconds=10)
+        dashboards.notify()
+        await clock.advance(2)
+        assert state.edits[-1] == 'v12', state.edits
+        await clock.advance(7)
+        assert state.edits[-1] == 'v12', 'nothing changes before the deadline'
+        await clock.advance(1)
+        assert state.edits[-1] == 'v12', 'woken at the deadline, still debouncing'
+        await clock.advance(2)
+        assert state.edits[-1] == 'v12 expired', state.edits
+        task.cancel()
+    asyncio.run(scenario())
+
+def test_channel_versions():
+    scheduler = ReminderScheduler()
+    reminders = [make_reminder(1, 60), make_reminder(2, 60)]
+    scheduler.load(reminders)
+    versions = dict(scheduler.channel_versions)
+    scheduler.load(reminders)
+    assert scheduler.channel_versions == versions, 'reloading the same reminders changes no channel'
+    scheduler.add(make_reminder(1, 90))
+    scheduler.remove(reminders[0].id)
+    assert scheduler.channel_versions[1] == versions[1] + 2 and scheduler.channel_versions[2] == versions[2]
+    assert [r.time_to_ping for r in scheduler.channel_reminders(1)] == [min(r.time_to_ping for r in scheduler.reminders.values() if r.pingChannelId == 1)]
+    scheduler.pop_due(utc_now() + dt.timedelta(hours=2))
+    assert scheduler.channel_versions[2] == versions[2] + 1 and not scheduler.channel_reminders(2)
+
+class FakeMessage:
+    def __init__(self, channel: 'FakeChannel', message_id: int) -> None:
+        self.channel, self.id = channel, message_id
+
+    async def pin(self) -> None:
+        self.channel.pinned.append(self.id)
+
+    async def edit(self, content: str) -> None:
+        if self.id not in self.channel.messages:
+            raise discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+        self.channel.messages[self.id] = content
+
+class FakeChannel:
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id
+        self.messages: dict[int, str] = {}
+        self.pinned: list[int] = []
+        self.sent = 0
+
+    async def send(self, content: str) -> FakeMessage:
+        self.sent += 1
+        message = FakeMessage(self, self.sent)
+        self.messages[message.id] = content
+        return message
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self, message_id)
+
+def test_publish_dashboard():
+    # The pinned message is found again by its saved id after a restart, never by adopting another pinned bot message
+    guild = SimpleNamespace(guild_id=123, name='Test', ping_channel_id=456)
+    channel = FakeChannel(456)
+    channels = {456: channel}
+    state_path, get_channel = dashboard.DASHBOARD_STATE_PATH, main.bot.get_channel
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            dashboard.DASHBOARD_STATE_PATH = Path(tmp) / 'dashboards.json'
+            main.bot.get_channel = channels.get
+            main.DASHBOARD_MESSAGES.clear()
+            main.DASHBOARD_IDS.clear()
+            asyncio.run(channel.send('Another pinned bot message'))
+            asyncio.run(main.publish_dashboard(guild, 'v0'))
+            assert channel.messages == {1: 'Another pinned bot message', 2: 'v0'} and channel.pinned == [2]
+            # Restarted
+            main.DASHBOARD_MESSAGES.clear()
+            main.DASHBOARD_IDS.update(dashboard.load_dashboard_ids())
+            asyncio.run(main.publish_dashboard(guild, 'v1'))
+            assert channel.messages == {1: 'Another pinned bot message', 2: 'v1'} and channel.pinned == [2]
+            # Deleted by hand, the next refresh pins a new one
+            del channel.messages[2]
+            try:
+                asyncio.run(main.publish_dashboard(guild, 'v2'))
+                assert False
+            except discord.NotFound:
+                pass
+            asyncio.run(main.publish_dashboard(guild, 'v2'))
+            assert channel.messages[3] == 'v2' and dashboard.load_dashboard_ids() == {'123': [456, 3]}
+            # A channel the bot cannot see is a clear error
+            main.DASHBOARD_MESSAGES.clear()
+            channels.clear()
+            try:
+                asyncio.run(main.publish_dashboard(guild, 'v3'))
+                assert False
+            except ValueError as e:
+                assert '456' in str(e)
+        finally:
+            dashboard.DASHBOARD_STATE_PATH = state_path
+            main.bot.get_channel = get_channel
+            main.DASHBOARD_MESSAGES.clear()
+            main.DASHBOARD_IDS.clear()
+            main.DASHBOARD_IDS.update(dashboard.load_dashboard_ids())
+
+def benchmark_upcoming(n_invocations: int=200, n_reminders: int=20):
+    # /upcoming rendered on every invocation (previous, minus the Mongo query) vs served from the cached render
+    guild, = main.GUILDS.compile(FIXTURE_SERVERS).values()
+    # Runs on its own scheduler and portal graphs, main's are put back afterwards
+    scheduler, portal_graphs = main.SCHEDULER, main.PORTAL_GRAPHS
+    main.PORTAL_GRAPHS = {}
+    try:
+        main.SCHEDULER = ReminderScheduler()
+        main.SCHEDULER.load([make_reminder(guild.ping_channel_id, 60 + i) for i in range(n_reminders)])
+        now = utc_now()
+        roads = [(guild.home_map, 'Qiient-Al-Nusom'), ('Qiient-Al-Nusom', 'Whitebank Descent')]
+        main.portal_graph(guild.region).load([Portal(
+            id=PydanticObjectId(), from_map=from_map, to_map=to_map, time_expire=now + dt.timedelta(hours=1),
+            submitter='@test', time_submitted=now,
+        ) for from_map, to_map in roads])
+        main.render_upcoming(guild)
+        start = time.perf_counter()
+        for _ in range(n_invocations):
+            main.render_upcoming(guild)
+        render_seconds = (time.perf_counter() - start) / n_invocations
+        start = time.perf_counter()
+        for _ in range(n_invocations):
+            main.DASHBOARDS.get(guild)
+        cached_seconds = (time.perf_counter() - start) / n_invocations
+        print(f'/upcoming with {n_reminders} reminders and {len(guild.notable_maps)} notable maps: '
+              f'render {render_seconds*1000:.2f}ms, cached {cached_seconds*1e6:.1f}us per invocation')
+    finally:
+        main.SCHEDULER, main.PORTAL_GRAPHS = scheduler, portal_graphs
+
+if __name__ == "__main__":
+    test_get()
+    test_run()
+    test_channel_versions()
+    test_publish_dashboard()
+    benchmark_upcoming()
+    print("OK")
@@ -0,0 +1,43 @@
+import datetime as dt
+
+from pydantic_mongo import PydanticObjectId
+
+from models.dbmodels import Reminder
+from utils.scheduler import ReminderScheduler, utc_now
+
+def make_reminder(minutes: int) -> Reminder:
+    now = utc_now()
+    return Reminder(
+        id=PydanticObjectId(), objective='Gold Core', location='Fort Sterling', time_unlocked=now + dt.timedelta(minutes=minutes),
+        submitter='@test', time_submitted=now, pingChannelId=1, roleMention='@here',
+        time_to_ping=now + dt.timedelta(minutes=minutes - 1),
+    )
+
+def test_load_since_version():
+    # A reconcile's snapshot is read while commands keep adding and deleting reminders
+    scheduler = ReminderScheduler()
+    deleted, kept, due = make_reminder(60), make_reminder(60), make_reminder(1)
+    scheduler.load([deleted, kept, due])
+    version = scheduler.version
+    snapshot = [deleted, kept, due]
+    added = make_reminder(90)
+    scheduler.add(added)
+    scheduler.remove(deleted.id)
+    assert scheduler.pop_due(utc_now() + dt.timedelta(minutes=5)) == [due]
+    scheduler.load(snapshot, since_version=version)
+    assert set(scheduler.reminders) == {str(kept.id), str(added.id)}, 'removed since the snapshot must not come back'
+    assert scheduler.next_deadline() == kept.time_to_ping
+    # Deleted then submitted again after the snapshot, the new one wins
+    version = scheduler.version
+    scheduler.remove(kept.id)
+    scheduler.add(kept)
+    scheduler.load([], since_version=version)
+    assert set(scheduler.reminders) == {str(kept.id)}
+    # Without a version the snapshot is taken as is
+    scheduler.remove(kept.id)
+    scheduler.load(snapshot)
+    assert set(scheduler.reminders) == {str(r.id) for r in snapshot}
+
+if __name__ == "__main__":
+    test_load_since_version()
+    print("OK")
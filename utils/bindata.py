@@ -1,21 +1,30 @@
 from pathlib import Path
-from xml.dom import minidom
-import pickle
+from array import array
 from itertools import permutations
 from typing import Callable
+import xml.etree.ElementTree as ET
+import argparse
+import hashlib
+import pickle
+import threading
 
+from config import config
+from logger import info, warning
+from models.bindump import BinDump, StaleBinDump, pack_strings, write_bindump
 from models.substringsearcher import SubstringSearcher
+from models.fuzzymatcher import FuzzyMatcher
 from models.zones import Zones
+from models.routinggraph import RoutingGraph, LandmarkTable
 
-AO_BIN_DUMP_ROOT_PATH = Path('D:/Coding Projects/ao-bin-dumps/')
+WORLD_XML_PATH = Path(config.get('worldXmlPath', 'D:/Coding Projects/ao-bin-dumps/cluster/world_asia.xml'))
+# The default region's dumps live in bin-dumps/, any other region's in bin-dumps/<region>/
+DEFAULT_REGION = config.get('defaultRegion', 'asia')
+WORLD_XML_PATHS = {DEFAULT_REGION: WORLD_XML_PATH} | {region: Path(path) for region, path in config.get('worldXmlPaths', {}).items()}
 
 BIN_DUMP_DIR = Path(__file__).parent.parent / 'bin-dumps'
-ZONE_PATH = BIN_DUMP_DIR / 'zones.pickle'
-
-PORTALS_EDGE_PATH = BIN_DUMP_DIR / 'portals_edge.pickle'
-
-N_LETTER_CACHE_PATH = BIN_DUMP_DIR / 'n_letter_cache.pickle'
-SS_SEARCH_CACHE_PATH = BIN_DUMP_DIR / 'ss_search_cache.pickle'
+# Bump when the world dump's sections change, older dumps are rebuilt on load
+WORLD_PATH = BIN_DUMP_DIR / 'world.bin'
+WORLD_SCHEMA_VERSION = 3
 
 ADDITIONAL_PORTALS = [
     ["Fort Sterling", "Fort Sterling Portal", 0],
@@ -31,76 +40,92 @@ def contains_digits(s: str) -> bool:
 def pythagoras(pos1: list[float], pos2: list[float]) -> float:
     return ((pos1[0] - pos2[0])**2 + (pos1[1] - pos2[1])**2)**0.5
 
-def extract_pos_floats(item: minidom.Element) -> tuple[float]:
-    return tuple(map(float, item.getAttribute('pos').split(' ')))
+def extract_pos_floats(pos: str) -> tuple[float]:
+    return tuple(map(float, pos.split(' ')))
 
-def load_pickle(path: Path, make_func: Callable=None) -> dict:
-    try:
-        with open(path, 'rb') as f:
-            return pickle.load(f)
-    except FileNotFoundError:
-        if make_func is not None:
-            make_func()
-        with open(path, 'rb') as f:
-            return pickle.load(f)
+def load_pickle(path: Path) -> dict:
+    with open(path, 'rb') as f:
+        return pickle.load(f)
 
 
 # Make bin dumps
-def make_zones_pickle() -> None:
-    with open(AO_BIN_DUMP_ROOT_PATH / 'cluster' / 'world_asia.xml', encoding='utf-8') as f:
-        doc = minidom.parseString(f.read())
-    all_clusters_dom = doc.getElementsByTagName('clusters').item(0).getElementsByTagName('cluster')
-    zones = Zones(list(
-        [c.getAttribute('displayname'), c.getAttribute('id'), [p.getAttribute('id') for p in c.getElementsByTagName('exit')]]
-    for c in all_clusters_dom))
-    with open(ZONE_PATH, 'wb') as f:
-        pickle.dump(zones, f)
-
-ZONES: Zones = load_pickle(ZONE_PATH, make_zones_pickle)
-
-
-def make_portals_edge_pickle() -> None:
-    with open(AO_BIN_DUMP_ROOT_PATH / 'cluster' / 'world_asia.xml', encoding='utf-8') as f:
-        doc = minidom.parseString(f.read())
-    all_clusters = doc.getElementsByTagName('clusters').item(0).getElementsByTagName('cluster')
-    graph = {}
-    for cluster in all_clusters:
-        map_id, map_name = cluster.getAttribute('id'), cluster.getAttribute('displayname')
-        if any(char.isdigit() for char in map_name):
+def add_cluster_edges(graph: dict, map_id: str, is_dungeon: bool, exits: list[tuple[str, str, str]]) -> None:
+    linked = [(exit_id, tuple(target_id.split('@')), pos) for exit_id, target_id, pos in exits if '@' in target_id]
+    for exit_id, target, _ in linked:
+        # Each portal goes to another map instantly, bidirectional
+        node = (exit_id, map_id)
+        graph.setdefault(node, {})[target] = 0
+        graph.setdefault(target, {})[node] = 0
+    # Crossing the map has weight
+    multiplier = 4 if is_dungeon else 1
+    positions = [((exit_id, map_id), extract_pos_floats(pos)) for exit_id, _, pos in linked]
+    for (node1, pos1), (node2, pos2) in permutations(positions, 2):
+        distance = pythagoras(pos1, pos2) * multiplier
+        graph.setdefault(node1, {})[node2] = distance
+        graph.setdefault(node2, {})[node1] = distance
+
+def parse_world_xml(xml_path: Path) -> tuple[Zones, dict]:
+    # One streaming pass, each cluster is cleared as soon as its zone and edges are taken
+    locations, graph = [], {}
+    for _, elem in ET.iterparse(xml_path, events=('end',)):
+        if elem.tag != 'cluster':
+            continue
+        map_id, map_name = elem.get('id', ''), elem.get('displayname', '')
+        exits = [(e.get('id', ''), e.get('targetid', ''), e.get('pos', '')) for e in elem.iter('exit')]
+        locations.append([map_name, map_id, [exit_id for exit_id, _, _ in exits]])
+        if not contains_digits(map_name):
+            add_cluster_edges(graph, map_id, 'DUNGEON' in elem.get('type', ''), exits)
+        elem.clear()
+    zones = Zones(locations)
+    for map1, map2, weight in ADDITIONAL_PORTALS:
+        if map1 not in zones.name_map or map2 not in zones.name_map:
+            warning(f'Skipping additional portal {map1} <-> {map2}, not in {xml_path.name}')
+            continue
+        portal1, portal2 = zones.get_portal(map1), zones.get_portal(map2)
+        graph[portal1][portal2] = weight
+        graph[portal2][portal1] = weight
+    return zones, graph
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def world_source_hash(world_path: Path) -> str:
+    try:
+        with BinDump(world_path, WORLD_SCHEMA_VERSION) as dump:
+            return bytes(dump['source.sha256']).decode()
+    except (StaleBinDump, KeyError):
+        return None
+
+def build_bin_dumps(xml_path: Path=WORLD_XML_PATH, out_dir: Path=BIN_DUMP_DIR, force: bool=False) -> bool:
+    # world.bin from a single pass over the world xml, skipped when the xml is unchanged since it was built
+    world_path = out_dir / WORLD_PATH.name
+    source_hash = file_sha256(xml_path)
+    if not force and world_source_hash(world_path) == source_hash:
+        info(f'Bin dumps in {out_dir} are up to date with {xml_path}')
+        return False
+    zones, edges = parse_world_xml(xml_path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    write_world_bindump(world_path, zones, edges, source_hash)
+    info(f'Built bin dumps in {out_dir} from {xml_path} ({source_hash[:12]})')
+    return True
+
+
+def make_routing_graph(zones: Zones, edges: dict) -> RoutingGraph:
+    # Every node a player submitted road can resolve to is interned up front
+    road_nodes = []
+    for map_name in zones.name_map:
+        try:
+            road_nodes.append(zones.get_portal(map_name))
+        except IndexError:
             continue
-        exits = [c for c in cluster.getElementsByTagName('exit') if '@' in c.getAttribute('targetid')]
-        for exit in exits:
-            map1, map2 = (exit.getAttribute('id'), map_id), tuple(exit.getAttribute('targetid').split('@'))
-            if map1 not in graph: graph[map1] = {}
-            if map2 not in graph: graph[map2] = {}
-            graph[map1][map2] = 0
-            graph[map2][map1] = 0
-            # Each portal goes to another map instantly, bidirectional
-        for exit_pair in permutations(exits,2):
-            multiplier = 1
-            if "DUNGEON" in cluster.getAttribute('type'):
-                multiplier += 3
-            map1, map2 = (exit_pair[0].getAttribute('id'), map_id), (exit_pair[1].getAttribute('id'), map_id)
-            map1_pos, map2_pos = extract_pos_floats(exit_pair[0]), extract_pos_floats(exit_pair[1])
-            distance = pythagoras(map1_pos, map2_pos)
-            if map1 not in graph: graph[map1] = {}
-            if map2 not in graph: graph[map2] = {}
-            graph[map1][map2] = distance * multiplier
-            graph[map2][map1] = distance * multiplier
-            # Crossing the map has weight
-    for edge in ADDITIONAL_PORTALS:
-        portal1, portal2 = ZONES.get_portal(edge[0]), ZONES.get_portal(edge[1])
-        graph[portal1][portal2] = edge[2]
-        graph[portal2][portal1] = edge[2]
-    with open(PORTALS_EDGE_PATH, 'wb') as f:
-        pickle.dump(graph, f)
-
-PORTALS_EDGE: dict = load_pickle(PORTALS_EDGE_PATH, make_portals_edge_pickle)
-
-
-def make_n_letter_cache() -> None:
-    max_n = 3
-    locations = ZONES.map_names
+    return RoutingGraph(edges, road_nodes)
+
+
+def n_letter_cache(locations: list[str], max_n: int=3) -> dict[str, list[str]]:
     cache_map = {}
     for loc in locations:
         split_loc = loc.replace('-', ' ').lower().split()
@@ -109,26 +134,230 @@ def make_n_letter_cache() -> None:
             if key not in cache_map:
                 cache_map[key] = []
             cache_map[key].append(loc)
-    with open(N_LETTER_CACHE_PATH, 'wb') as f:
-        pickle.dump(cache_map, f)
+    return cache_map
 
-N_LETTER_CACHE: dict = load_pickle(N_LETTER_CACHE_PATH, make_n_letter_cache)
 
+def write_world_bindump(world_path: Path, zones: Zones, edges: dict, source_hash: str) -> None:
+    # zones, routing graph, landmarks, substring/typo indexes and n-letter keys as flat arrays, no pickles
+    graph = make_routing_graph(zones, edges)
+    landmarks = LandmarkTable(graph)
+    searcher = SubstringSearcher(zones.map_names)
+    matcher = FuzzyMatcher(zones.map_names)
+    sections = {}
+    def add_strings(name: str, strings: list) -> None:
+        sections[f'{name}.text'], sections[f'{name}.offsets'] = pack_strings(strings)
+    def add_lists(name: str, lists: list, typecode: str) -> None:
+        # List i is values[offsets[i]:offsets[i+1]]
+        sections[f'{name}.offsets'], sections[f'{name}.values'] = array('I', [0]), array(typecode)
+        for values in lists:
+            sections[f'{name}.values'].extend(values)
+            sections[f'{name}.offsets'].append(len(sections[f'{name}.values']))
+    add_strings('zones.names', [loc[0] for loc in zones.locations])
+    add_strings('zones.ids', [loc[1] for loc in zones.locations])
+    add_strings('zones.portals', [p for loc in zones.locations for p in loc[2]])
+    sections['zones.portal_offsets'] = array('I', [0])
+    for loc in zones.locations:
+        sections['zones.portal_offsets'].append(sections['zones.portal_offsets'][-1] + len(loc[2]))
+    add_strings('graph.portals', [node[0] for node in graph.nodes])
+    add_strings('graph.maps', [node[1] for node in graph.nodes])
+    sections |= {'graph.offsets': graph.offsets, 'graph.targets': graph.targets, 'graph.weights': graph.weights, 'graph.start_order': graph.start_order}
+    sections['landmarks.component'] = landmarks.component
+    sections['landmarks.landmarks'] = array('I', landmarks.landmarks)
+    sections['landmarks.vector_offsets'] = array('I', [0])
+    for vector in landmarks.vectors:
+        sections['landmarks.vector_offsets'].append(sections['landmarks.vector_offsets'][-1] + len(vector))
+    sections['landmarks.vector_values'] = array('d', (d for vector in landmarks.vectors for d in vector))
+    add_strings('ss.strings', searcher.strings)
+    sections |= {'ss.text': searcher.text, 'ss.suffix_array': searcher.suffix_array, 'ss.owners': searcher.owners}
+    add_strings('ss.bucket_keys', list(searcher.buckets))
+    sections['ss.bucket_ranges'] = array('I', (i for left_right in searcher.buckets.values() for i in left_right))
+    letters = n_letter_cache(zones.map_names)
+    add_strings('nl.keys', list(letters))
+    add_lists('nl.names', [[zones.name_map[name] for name in names] for names in letters.values()], 'H')
+    add_strings('fz.strings', matcher.strings)
+    add_strings('fz.words', matcher.words)
+    sections['fz.gram_counts'] = matcher.gram_counts
+    add_lists('fz.owners', matcher.owners, 'H')
+    add_strings('fz.grams', list(matcher.postings))
+    add_lists('fz.postings', matcher.postings.values(), 'H')
+    sections['source.sha256'] = source_hash.encode()
+    write_bindump(world_path, WORLD_SCHEMA_VERSION, sections)
 
-def make_ss_search() -> None:
-    searcher = SubstringSearcher(ZONES.map_names)
-    with open(SS_SEARCH_CACHE_PATH, 'wb') as f:
-        pickle.dump(searcher, f)
+def load_world_bindump(world: 'WorldData') -> BinDump:
+    # Rebuilt from the world xml outside the except block, the traceback would otherwise keep the failed dump alive
+    # while it is replaced
+    try:
+        return BinDump(world.path(WORLD_PATH), WORLD_SCHEMA_VERSION)
+    except StaleBinDump as e:
+        reason = str(e)
+    warning(f'Rebuilding {world.region} {WORLD_PATH.name}: {reason}')
+    build_bin_dumps(world.xml_path, world.dump_dir, force=True)
+    return BinDump(world.path(WORLD_PATH), WORLD_SCHEMA_VERSION)
 
-SS_SEARCHER: SubstringSearcher = load_pickle(SS_SEARCH_CACHE_PATH, make_ss_search)
+def split_lists(dump: BinDump, name: str) -> list[memoryview]:
+    offsets, values = dump[f'{name}.offsets'], dump[f'{name}.values']
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
 
+def load_zones(world: 'WorldData') -> Zones:
+    dump = world.bindump
+    names, ids, portals, portal_offsets = dump.strings('zones.names'), dump.strings('zones.ids'), dump.strings('zones.portals'), dump['zones.portal_offsets']
+    return Zones([[name, id, portals[portal_offsets[i]:portal_offsets[i + 1]]] for i, (name, id) in enumerate(zip(names, ids))])
 
+def load_routing_graph(world: 'WorldData') -> RoutingGraph:
+    dump = world.bindump
+    nodes = list(zip(dump.strings('graph.portals'), dump.strings('graph.maps')))
+    return RoutingGraph.from_csr(nodes, dump['graph.offsets'], dump['graph.targets'], dump['graph.weights'], dump['graph.start_order'])
 
-if __name__ == "__main__":
-    pass
-    # make_zones_pickle()
-    # make_portals_edge_pickle()
-    # make_n_letter_cache()
-    # make_ss_search()
+def load_landmarks(world: 'WorldData') -> LandmarkTable:
+    dump = world.bindump
+    return LandmarkTable.from_arrays(
+        world.routing_graph.nodes, dump['landmarks.component'], dump['landmarks.landmarks'],
+        dump['landmarks.vector_offsets'], dump['landmarks.vector_values'],
+    )
 
+def load_portals_edge(world: 'WorldData') -> dict:
+    # The static edge dict, rebuilt from the CSR graph in its original key order. Only the reference searches use it
+    graph = world.routing_graph
+    nodes, offsets, targets, weights = graph.nodes, graph.offsets, graph.targets, graph.weights
+    return {nodes[u]: {nodes[targets[i]]: weights[i] for i in range(offsets[u], offsets[u + 1])} for u in graph.start_order}
 
+def load_n_letter_cache(world: 'WorldData') -> dict[str, list[str]]:
+    dump, names = world.bindump, world.zones.map_names
+    return {key: [names[idx] for idx in ids] for key, ids in zip(dump.strings('nl.keys'), split_lists(dump, 'nl.names'))}
+
+def load_fuzzy_matcher(world: 'WorldData') -> FuzzyMatcher:
+    dump = world.bindump
+    postings = dict(zip(dump.strings('fz.grams'), split_lists(dump, 'fz.postings')))
+    return FuzzyMatcher.from_arrays(dump.strings('fz.strings'), dump.strings('fz.words'), dump['fz.gram_counts'], split_lists(dump, 'fz.owners'), postings)
+
+def load_ss_searcher(world: 'WorldData') -> SubstringSearcher:
+    dump = world.bindump
+    ranges = dump['ss.bucket_ranges']
+    buckets = {key: (ranges[2 * i], ranges[2 * i + 1]) for i, key in enumerate(dump.strings('ss.bucket_keys', decode=False))}
+    return SubstringSearcher.from_arrays(dump.strings('ss.strings'), bytes(dump['ss.text']), dump['ss.suffix_array'], dump['ss.owners'], buckets)
+
+class WorldData:
+    # One region's bin dumps, each loaded on first access and then shared read only by every guild in the region
+    loaders: dict[str, Callable] = {
+        'bindump': load_world_bindump,
+        'zones': load_zones,
+        'portals_edge': load_portals_edge,
+        'routing_graph': load_routing_graph,
+        'landmarks': load_landmarks,
+        'n_letter_cache': load_n_letter_cache,
+        'ss_searcher': load_ss_searcher,
+        'fuzzy_matcher': load_fuzzy_matcher,
+    }
+    bindump: BinDump
+    zones: Zones
+    portals_edge: dict
+    routing_graph: RoutingGraph
+    landmarks: LandmarkTable
+    n_letter_cache: dict
+    ss_searcher: SubstringSearcher
+    fuzzy_matcher: FuzzyMatcher
+
+    def __init__(self, region: str, dump_dir: Path, xml_path: Path) -> None:
+        self.region = region
+        self.dump_dir = dump_dir
+        self.xml_path = xml_path
+        # Reentrant, loaders read the attributes they are built from
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name: str):
+        # Only reached for attributes not loaded yet. Loaded once even when warm-up threads and commands race on it
+        if name not in self.loaders:
+            raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+        with self.lock:
+            if name in vars(self):
+                return vars(self)[name]
+            value = self.loaders[name](self)
+            setattr(self, name, value)
+        return value
+
+    def __repr__(self) -> str:
+        return f'WorldData({self.region!r}, loaded={[name for name in self.loaders if name in vars(self)]})'
+
+    def path(self, default_path: Path) -> Path:
+        return self.dump_dir / default_path.name
+
+    def build(self) -> None:
+        build_bin_dumps(self.xml_path, self.dump_dir)
+
+WORLDS: dict[str, WorldData] = {}
+
+def get_world(region: str=None) -> WorldData:
+    region = region or DEFAULT_REGION
+    if region not in WORLDS:
+        dump_dir = BIN_DUMP_DIR if region == DEFAULT_REGION else BIN_DUMP_DIR / region
+        WORLDS[region] = WorldData(region, dump_dir, WORLD_XML_PATHS.get(region, WORLD_XML_PATH.with_name(f'world_{region}.xml')))
+    return WORLDS[region]
+
+# The default region's data as module attributes, `from utils.bindata import ZONES` loads it on first access
+DEFAULT_WORLD_ATTRIBUTES = {
+    'WORLD': 'bindump',
+    'ZONES': 'zones',
+    'PORTALS_EDGE': 'portals_edge',
+    'ROUTING_GRAPH': 'routing_graph',
+    'LANDMARKS': 'landmarks',
+    'N_LETTER_CACHE': 'n_letter_cache',
+    'SS_SEARCHER': 'ss_searcher',
+    'FUZZY_MATCHER': 'fuzzy_matcher',
+}
+WORLD: BinDump
+ZONES: Zones
+PORTALS_EDGE: dict
+ROUTING_GRAPH: RoutingGraph
+LANDMARKS: LandmarkTable
+N_LETTER_CACHE: dict
+SS_SEARCHER: SubstringSearcher
+FUZZY_MATCHER: FuzzyMatcher
+
+def __getattr__(name: str):
+    if name not in DEFAULT_WORLD_ATTRIBUTES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(get_world(), DEFAULT_WORLD_ATTRIBUTES[name])
+
+
+def benchmark_startup(runs: int=5):
+    # Fresh interpreter per run, time and Python heap (tracemalloc, mmap pages are file backed and not counted)
+    # until everything the bot routes/guesses with is loaded.
+    # pickle is the previous import: zones/portals_edge pickles, building the routing graph, landmark/suffix index pickles
+    import subprocess
+    import sys
+    import tempfile
+    world = get_world()
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {name: Path(tmp) / f'{name}.pickle' for name in ('zones', 'portals_edge', 'landmarks', 'ss_search_cache')}
+        graph = make_routing_graph(world.zones, world.portals_edge)
+        for name, obj in (('zones', world.zones), ('portals_edge', world.portals_edge), ('landmarks', LandmarkTable(graph)), ('ss_search_cache', SubstringSearcher(world.zones.map_names))):
+            paths[name].write_bytes(pickle.dumps(obj))
+        path = lambda name: f'b.Path({str(paths[name])!r})'
+        snippets = {
+            'pickle': (
+                f"z=b.load_pickle({path('zones')});g=b.make_routing_graph(z,b.load_pickle({path('portals_edge')}));"
+                f"l=b.load_pickle({path('landmarks')});s=b.load_pickle({path('ss_search_cache')})"
+            ),
+            'bindump': "b.ZONES;b.ROUTING_GRAPH;b.LANDMARKS;b.SS_SEARCHER",
+        }
+        for name, snippet in snippets.items():
+            timed = f"import time;import utils.bindata as b;t0=time.perf_counter();{snippet};print(time.perf_counter()-t0)"
+            traced = f"import tracemalloc;import utils.bindata as b;tracemalloc.start();{snippet};print(tracemalloc.get_traced_memory()[0]//1024)"
+            run = lambda code: [subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout for _ in range(runs)]
+            seconds = sorted(map(float, run(timed)))[runs // 2]
+            heap = sorted(map(int, run(traced)))[runs // 2]
+            print(f'{name:>8}: median {seconds*1000:.1f}ms, heap +{heap}KB')
+
+
+if __name__ == "__main__":
+    # python -m utils.bindata [world.xml] [--region REGION] [--out DIR] [--force]
+    parser = argparse.ArgumentParser(description='Build bin-dumps from the world xml')
+    parser.add_argument('xml', nargs='?', type=Path, help="Defaults to the region's configured world xml")
+    parser.add_argument('--region', default=DEFAULT_REGION)
+    parser.add_argument('--out', type=Path, help="Defaults to the region's bin-dumps directory")
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the xml is unchanged')
+    args = parser.parse_args()
+    world = get_world(args.region)
+    out_dir = args.out or world.dump_dir
+    built = build_bin_dumps(args.xml or world.xml_path, out_dir, args.force)
+    print(f"{'Built' if built else 'Up to date'}: {out_dir}")
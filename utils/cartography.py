@@ -1,10 +1,35 @@
 from config import config
 from logger import debug, info, warning, error
+from metrics import METRICS, ROUTE_EXPANDED, ROUTE_PUSHES, GUESS_SECONDS
+from array import array
+import datetime as dt
 import heapq
+import math
+import threading
 
-from utils.bindata import ZONES, PORTALS_EDGE, N_LETTER_CACHE, SS_SEARCHER
+from utils.bindata import get_world, WorldData
 from models.dbmodels import Portal
+from utils.portalgraph import PortalGraphCache, make_expiry_overlay
+from models.lrucache import LRUCache
+from models.autocomplete import AutocompleteIndex
 
+# Past this many player road endpoints the landmark heuristic costs more than it saves
+ASTAR_MAX_OVERLAY_NODES = 32
+
+# (region, algorithm, map1, map2, roads_version, max_distance) -> route. A* and the Dijkstra searches can break ties
+# between equally long routes differently, each only serves the routes it found itself
+ROUTE_CACHE = LRUCache(config.get('routeCacheSize', 4096))
+# (region, home_map) -> {map_id: route length} over the static graph
+PROXIMITY_CACHE = LRUCache(config.get('proximityCacheSize', 64))
+# region -> map name autocomplete
+AUTOCOMPLETES: dict[str, AutocompleteIndex] = {}
+# (region, home_map) -> seconds from home_map to every map, indexed like world.zones.locations
+TRAVEL_TIMES: dict[tuple[str, str], array] = {}
+# Warm-up threads and the event loop both fill AUTOCOMPLETES and TRAVEL_TIMES. Entries are built outside the lock and
+# published under it, neither waits on the other's build and every thread ends up with the same autocomplete index
+CACHE_LOCK = threading.Lock()
+
+# Reference implementations carrying full paths on the heap, see WorldData.routing_graph for the one in use
 def dijkstra(graph: dict, start: str, end: str, additional_graph: dict = None, max_distance: int=9999):
     if additional_graph is None:
         additional_graph = {}
@@ -27,60 +52,275 @@ def dijkstra(graph: dict, start: str, end: str, additional_graph: dict = None, m
             heapq.heappush(queue, (cost + weight, neighbor, path + [node]))
     return None  # No path exists
 
-# @functools.lru_cache
-def translated_djikstra(map1: str, map2: str, roads: list[Portal]=None, max_distance: int=9999) -> list[str]:
-    if roads is None:
-        roads = []
+def dijkstra_many(graph: dict, start: str, ends: set[str], additional_graph: dict = None, max_distance: int=9999) -> dict:
+    # Reference one-to-many version of dijkstra, same search kept going until every end map is settled
+    if additional_graph is None:
+        additional_graph = {}
+    remaining = set(ends)
+    found = {}
+    starting_nodes = [key for key in graph if key[1] == start] + [key for key in additional_graph if key[1] == start]
+    queue = [(0, node, []) for node in starting_nodes]  # (total_cost, current_node, path)
+    visited = set()
+
+    while queue and remaining:
+        cost, node, path = heapq.heappop(queue)
+        if node[1] in remaining:
+            found[node[1]] = path + [node]
+            remaining.discard(node[1])
+        if node in visited:
+            continue
+        visited.add(node)
+        if len(path) > max_distance:
+            continue
+        for neighbor, weight in graph.get(node, {}).items():
+            heapq.heappush(queue, (cost + weight, neighbor, path + [node]))
+        for neighbor, weight in additional_graph.get(node, {}).items():
+            heapq.heappush(queue, (cost + weight, neighbor, path + [node]))
+    return found
+
+def make_additional_graph(roads: list[Portal], world: WorldData=None) -> dict:
+    world = world or get_world()
     additional_graph = {}
     for road in roads:
-        portal1, portal2 = ZONES.get_portal(road.from_map), ZONES.get_portal(road.to_map)
+        portal1, portal2 = world.zones.get_portal(road.from_map), world.zones.get_portal(road.to_map)
         if portal1 not in additional_graph: additional_graph[portal1] = {}
         if portal2 not in additional_graph: additional_graph[portal2] = {}
         additional_graph[portal1][portal2] = 0
         additional_graph[portal2][portal1] = 0
-    path = dijkstra(PORTALS_EDGE, ZONES.get_map_id(map1), ZONES.get_map_id(map2), additional_graph, max_distance)
+    return additional_graph
+
+def roads_version(roads: list[Portal] | PortalGraphCache=None):
+    # Only the static graph and the live PortalGraphCache are cacheable, ad hoc road lists return None
+    if isinstance(roads, PortalGraphCache):
+        roads.expire()
+        return (id(roads), roads.version)
+    return None if roads else 0
+
+def resolve_world(roads: list[Portal] | PortalGraphCache=None, region: str=None) -> WorldData:
+    # A PortalGraphCache already belongs to a region
+    if isinstance(roads, PortalGraphCache):
+        return roads.world
+    return get_world(region)
+
+def get_overlay(roads: list[Portal] | PortalGraphCache=None, world: WorldData=None) -> dict:
+    if isinstance(roads, PortalGraphCache):
+        return roads.get_overlay()
+    world = world or get_world()
+    return world.routing_graph.make_overlay(make_additional_graph(roads or [], world))
+
+def get_timed_overlay(roads: list[Portal] | PortalGraphCache, depart: dt.datetime, world: WorldData) -> dict:
+    # Arriving at a map takes secondsPerMap per map crossed, a portal is usable while arrival at its map is before time_expire
+    if isinstance(roads, PortalGraphCache):
+        expiry_overlay = roads.get_expiry_overlay()
+    else:
+        expiry_overlay = make_expiry_overlay(world, roads or [])
+    seconds_per_map = config['secondsPerMap']
+    return {
+        node: [(neighbor, weight, math.ceil((time_expire - depart).total_seconds() / seconds_per_map)) for neighbor, weight, time_expire in edges]
+        for node, edges in expiry_overlay.items()
+    }
+
+def observe_search(world: WorldData, algorithm: str) -> None:
+    if METRICS.enabled:
+        expanded, pushes = world.routing_graph.search_stats
+        ROUTE_EXPANDED.observe(expanded, algorithm)
+        ROUTE_PUSHES.observe(pushes, algorithm)
+
+def route_open_on_arrival(route: list[str], roads: list[Portal] | PortalGraphCache, depart: dt.datetime) -> bool:
+    # Same rule as get_timed_overlay, the hop out of route[i] is taken after i map crossings. A hop any road links must
+    # still have one open then, even if the static graph links the pair too
+    roads = roads.get_roads() if isinstance(roads, PortalGraphCache) else roads or []
+    latest: dict[frozenset, dt.datetime] = {}
+    for road in roads:
+        pair = frozenset((road.from_map, road.to_map))
+        latest[pair] = max(latest.get(pair, road.time_expire), road.time_expire)
+    seconds_per_map = config['secondsPerMap']
+    for idx, hop in enumerate(zip(route, route[1:])):
+        time_expire = latest.get(frozenset(hop))
+        if time_expire is not None and idx >= math.ceil((time_expire - depart).total_seconds() / seconds_per_map):
+            return False
+    return True
+
+def translated_djikstra(map1: str, map2: str, roads: list[Portal] | PortalGraphCache=None, max_distance: int=9999, region: str=None, depart: dt.datetime=None) -> list[str]:
+    # With depart, player roads that expire before the route reaches them are skipped. The cached untimed route is the
+    # cheapest one, so it is kept whenever its roads are all open on arrival, only otherwise the uncached timed search runs
+    world = resolve_world(roads, region)
+    if depart is not None:
+        route = translated_djikstra(map1, map2, roads, max_distance, region)
+        if not route or route_open_on_arrival(route, roads, depart):
+            return route
+        path = world.routing_graph.timed_shortest_path(
+            world.zones.get_map_id(map1), world.zones.get_map_id(map2), get_timed_overlay(roads, depart, world), max_distance
+        )
+        observe_search(world, 'timed')
+        return translate_path(path, world)
+    version = roads_version(roads)
+    overlay = get_overlay(roads, world)
+    graph, zones = world.routing_graph, world.zones
+    algorithm = 'astar' if max_distance >= len(graph) and len(overlay) <= ASTAR_MAX_OVERLAY_NODES else 'dijkstra'
+    key = (world.region, algorithm, map1, map2, version, max_distance)
+    if version is not None and (route := ROUTE_CACHE.get(key)) is not None:
+        return list(route)
+    if algorithm == 'astar':
+        path = graph.astar_path(zones.get_map_id(map1), zones.get_map_id(map2), world.landmarks, overlay)
+    else:
+        path = graph.shortest_path(zones.get_map_id(map1), zones.get_map_id(map2), overlay, max_distance)
+    observe_search(world, algorithm)
+    route = translate_path(path, world)
+    if version is not None:
+        ROUTE_CACHE.put(key, tuple(route))
+    return route
+
+def translate_path(path: list[tuple], world: WorldData=None) -> list[str]:
     if not path:
         return []
+    zones = (world or get_world()).zones
     road = []
     for step in path:
-        map_name = ZONES.get_map_name(step[1])
+        map_name = zones.get_map_name(step[1])
         if road and road[-1] == map_name:
             continue
         road.append(map_name)
     return road
 
+def translated_djikstra_many(map1: str, targets: list[str], roads: list[Portal] | PortalGraphCache=None, max_distance: int=9999, region: str=None) -> dict[str, list[str]]:
+    # One search from map1 for all targets not already cached, unreachable targets map to []
+    world = resolve_world(roads, region)
+    zones = world.zones
+    version = roads_version(roads)
+    routes = {}
+    if version is not None:
+        for target in targets:
+            if (route := ROUTE_CACHE.get((world.region, 'dijkstra_many', map1, target, version, max_distance))) is not None:
+                routes[target] = list(route)
+    target_ids = {zones.get_map_id(t): t for t in targets if t not in routes}
+    if not target_ids:
+        return {target: routes[target] for target in targets}
+    paths = world.routing_graph.shortest_paths(zones.get_map_id(map1), set(target_ids), get_overlay(roads, world), max_distance)
+    observe_search(world, 'dijkstra_many')
+    for target in targets:
+        if target in routes:
+            continue
+        routes[target] = translate_path(paths.get(zones.get_map_id(target)), world)
+        if version is not None:
+            ROUTE_CACHE.put((world.region, 'dijkstra_many', map1, target, version, max_distance), tuple(routes[target]))
+    return {target: routes[target] for target in targets}
+
+def translated_djikstra_pairs(maps: list[str], roads: list[Portal] | PortalGraphCache=None, max_distance: int=9999, region: str=None) -> dict[tuple[str, str], list[str]]:
+    # Routes for combinations(maps, 2) in the same order, one search per source map
+    routes = {}
+    for idx, map1 in enumerate(maps[:-1]):
+        for map2, route in translated_djikstra_many(map1, maps[idx+1:], roads, max_distance, region).items():
+            routes[(map1, map2)] = route
+    return routes
+
 # AI Behaviour
-def first_n_letters(s: str) -> list[str]:
-    return N_LETTER_CACHE.get(s, [])
+def get_autocomplete(world: WorldData) -> AutocompleteIndex:
+    # Discord does not allow >25 autocomplete choices
+    autocomplete = AUTOCOMPLETES.get(world.region)
+    if autocomplete is None:
+        autocomplete = AutocompleteIndex(world.zones.map_names, world.n_letter_cache, limit=25)
+        with CACHE_LOCK:
+            autocomplete = AUTOCOMPLETES.setdefault(world.region, autocomplete)
+    return autocomplete
+
+@METRICS.timed(GUESS_SECONDS, 'first_n_letters')
+def first_n_letters(s: str, region: str=None) -> list[str]:
+    return get_world(region).n_letter_cache.get(s, [])
+
+def route_lengths_from(home_map: str, region: str=None) -> dict[str, int]:
+    # map_id -> len(translated_djikstra(home_map, map)) for every reachable map, from one search
+    world = get_world(region)
+    lengths = PROXIMITY_CACHE.get((world.region, home_map))
+    if lengths is None:
+        graph = world.routing_graph
+        paths = graph.shortest_paths(world.zones.get_map_id(home_map), set(graph.map_nodes))
+        lengths = {map_id: len(translate_path(path, world)) for map_id, path in paths.items()}
+        PROXIMITY_CACHE.put((world.region, home_map), lengths)
+    return lengths
 
-def substring_and_proximity(s: str, home_map: str=None) -> list[str]:
-    ss_results = SS_SEARCHER.get(s)
+@METRICS.timed(GUESS_SECONDS, 'substring')
+def substring_and_proximity(s: str, home_map: str=None, region: str=None) -> list[str]:
+    world = get_world(region)
+    ss_results = world.ss_searcher.get(s)
     if not home_map: return ss_results
-    return sorted(ss_results, key=lambda x: len(translated_djikstra(home_map, x)) or 999)
+    lengths = route_lengths_from(home_map, region)
+    return sorted(ss_results, key=lambda x: lengths.get(world.zones.get_map_id(x)) or 999)
 
-def best_guesses(s: str, home_map: str=None) -> list[str]:
+@METRICS.timed(GUESS_SECONDS, 'typos')
+def typos_and_proximity(s: str, home_map: str=None, region: str=None) -> list[str]:
+    world = get_world(region)
+    matcher = world.fuzzy_matcher
+    matches = matcher.search(s)
+    if home_map:
+        lengths = route_lengths_from(home_map, region)
+        matches.sort(key=lambda m: (m[1], lengths.get(world.zones.get_map_id(matcher.strings[m[0]])) or 999))
+    return [matcher.strings[idx] for idx, _ in matches]
+
+@METRICS.timed(GUESS_SECONDS, 'best_guesses')
+def best_guesses(s: str, home_map: str=None, region: str=None) -> list[str]:
     s = s.lower()
-    fnl_results = first_n_letters(s)
+    autocomplete = get_autocomplete(get_world(region))
+    if s in autocomplete.exact: return [autocomplete.exact[s]] # Picked from autocomplete
+    fnl_results = first_n_letters(s, region)
     
     if len(fnl_results) == 1: return fnl_results # Only return if there are exact matches
-    sap_results = substring_and_proximity(s, home_map)
-    return sap_results + [m for m in fnl_results if m not in sap_results]
+    sap_results = substring_and_proximity(s, home_map, region)
+    results = sap_results + [m for m in fnl_results if m not in sap_results]
+    return results or typos_and_proximity(s, home_map, region) # Fewest typos first, then closest
 
-def best_guess(s: str, home_map: str=None) -> str:
+def best_guess(s: str, home_map: str=None, region: str=None) -> str:
     try:
-        guesses = best_guesses(s, home_map)[0]
-        debug(f'Guessed {guesses} from {s}')
+        guesses = best_guesses(s, home_map, region)[0]
+        debug('Guessed %s from %s', guesses, s)
         return guesses
     except IndexError:
-        debug(f'Could not guess {s}')
+        debug('Could not guess %s', s)
         return None
 
-def est_traveling_time_seconds(m: str, home_map: str=None) -> int:
+def build_autocomplete(home_map: str=None, region: str=None) -> None:
+    world = get_world(region)
+    autocomplete = get_autocomplete(world)
+    if not home_map:
+        autocomplete.build(home_map)
+        return
+    lengths = route_lengths_from(home_map, region)
+    autocomplete.build(home_map, lambda name: lengths.get(world.zones.get_map_id(name)) or 999)
+
+def autocomplete_map_names(s: str, home_map: str=None, region: str=None) -> list[str]:
+    autocomplete = get_autocomplete(get_world(region))
+    if home_map not in autocomplete.tables:
+        build_autocomplete(home_map, region)
+    choices = autocomplete.get(s, home_map)
+    if choices is None:
+        return best_guesses(s, home_map, region)[:autocomplete.limit]
+    return list(choices)
+
+def build_travel_times(home_map: str, region: str=None) -> array:
+    # Same value est_traveling_time_seconds would route for, unreachable maps included, static graph only
+    world = get_world(region)
+    lengths = route_lengths_from(home_map, region)
+    seconds_per_map = config['secondsPerMap']
+    table = array('i', ((lengths.get(map_id, 0) - 1) * seconds_per_map for _, map_id, _ in world.zones.locations))
+    with CACHE_LOCK:
+        TRAVEL_TIMES[(world.region, home_map)] = table
+    return table
+
+def est_traveling_time_seconds(m: str, home_map: str=None, region: str=None) -> int:
     if not home_map: return 0
-    return (len(translated_djikstra(home_map, m)) - 1) * config['secondsPerMap']
+    world = get_world(region)
+    idx = world.zones.name_map.get(m)
+    if idx is None:
+        return (len(translated_djikstra(home_map, m, region=region)) - 1) * config['secondsPerMap']
+    table = TRAVEL_TIMES.get((world.region, home_map))
+    if table is None:
+        table = build_travel_times(home_map, region)
+    return table[idx]
 
 
 def test_queries():
+    # Per candidate routing (old proximity sort) vs one search per home map, cold and warm
+    from utils.bindata import SS_SEARCHER
     queries = [
         ("marsh", 'Scuttlesink Marsh', 'Scuttlesink Marsh'),
         ("steep", 'Scuttlesink Marsh', 'Shaleheath Steep'),
@@ -90,13 +330,233 @@ def test_queries():
         ('qan', None, 'Qiient-Al-Nusom'),
         ('qialte', None, 'Qiient-Al-Tersas'),
         ('qat', None, 'Quaent-Al-Tersis'),
+        # Typos
+        ('whitbank descnet', 'Fort Sterling', 'Whitebank Descent'),
+        ('scutlesink marhs', None, 'Scuttlesink Marsh'),
+        ('qiient-al-nusmo', 'Lymhurst', 'Qiient-Al-Nusom'),
+        # Broad queries, dozens to hundreds of candidates
+        ('a', 'Scuttlesink Marsh', None),
+        ('e', 'Fort Sterling', None),
+        ('hills', 'Lymhurst', None),
+        ('the', 'Martlock', None),
+        ('wood', 'Bridgewatch', None),
     ]
     import time
-    iterations = 2
-    start = time.time()
-    for _ in range(iterations):
-        for q, home_map, _ in queries:
-            best_guess(q, home_map)
-
-    time_taken_seconds = (time.time() - start)
-    print(f'Took {time_taken_seconds:.6}s, avg {(time_taken_seconds / len(queries) / iterations):.6}s')
+    for q, home_map, expected in queries:
+        ss_results = SS_SEARCHER.get(q)
+        ROUTE_CACHE.clear()
+        start = time.perf_counter()
+        old = sorted(ss_results, key=lambda x: len(translated_djikstra(home_map, x)) or 999) if home_map else ss_results
+        old_seconds = time.perf_counter() - start
+        PROXIMITY_CACHE.clear()
+        start = time.perf_counter()
+        new = substring_and_proximity(q, home_map) if home_map else SS_SEARCHER.get(q)
+        cold_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        guess = best_guess(q, home_map)
+        warm_seconds = time.perf_counter() - start
+        assert [len(translated_djikstra(home_map, x)) for x in old] == [len(translated_djikstra(home_map, x)) for x in new] if home_map else True
+        print(f'{q!r:>12} from {home_map}: {len(ss_results):>4} candidates, per candidate {old_seconds*1000:8.2f}ms, '
+              f'batched cold {cold_seconds*1000:6.2f}ms, best_guess warm {warm_seconds*1000:.3f}ms -> {guess}'
+              + (f' (expected {expected})' if expected and guess != expected else ''))
+
+def benchmark_autocomplete(home_map: str='Scuttlesink Marsh'):
+    # Every keystroke of a few map names, ranked search (best_guesses) vs the prefix index
+    import statistics
+    import time
+    words = ['Scuttlesink Marsh', 'Fort Sterling', 'Qiient-Al-Nusom', 'hills', 'wood', 'qan', 'thet']
+    keystrokes = [w[:i] for w in words for i in range(len(w) + 1)]
+    start = time.perf_counter()
+    build_autocomplete(home_map)
+    print(f'Built autocomplete for {home_map} in {(time.perf_counter() - start)*1000:.1f}ms, {len(get_autocomplete(get_world()).tables[home_map])} keys')
+    for name, func in (('best_guesses', lambda s: best_guesses(s, home_map)[:25]), ('index', lambda s: autocomplete_map_names(s, home_map))):
+        latencies = []
+        for s in keystrokes:
+            start = time.perf_counter()
+            func(s)
+            latencies.append(time.perf_counter() - start)
+        print(f'{name:>12}: {len(keystrokes)} keystrokes, p50 {statistics.median(latencies)*1000:.3f}ms, max {max(latencies)*1000:.3f}ms')
+
+def benchmark_reminder_lead_time(home_maps: list[str]=('Scuttlesink Marsh', 'Fort Sterling'), n_reminders: int=2000):
+    # Reminder creation (/core: best_guess, lead time, Reminder) with lead time routed per reminder vs the travel time table
+    from models.dbmodels import Reminder
+    import datetime as dt
+    import random
+    import statistics
+    import time
+    world = get_world()
+    rng = random.Random(0)
+    names = world.zones.map_names
+    def routed(m: str, home_map: str) -> int:
+        return (len(translated_djikstra(home_map, m)) - 1) * config['secondsPerMap']
+    for home_map in home_maps:
+        start = time.perf_counter()
+        build_travel_times(home_map)
+        build_seconds = time.perf_counter() - start
+        assert all(routed(m, home_map) == est_traveling_time_seconds(m, home_map) for m in names)
+        locations = [rng.choice(names) for _ in range(n_reminders)]
+        for name, lead_time in (('routed', routed), ('table', est_traveling_time_seconds)):
+            ROUTE_CACHE.clear()
+            latencies = []
+            for location in locations:
+                start = time.perf_counter()
+                guess = best_guess(location, home_map)
+                seconds = lead_time(guess, home_map) + config['reminderLeadTimeSeconds']
+                now = dt.datetime.now(dt.timezone.utc)
+                Reminder(
+                    objective='Gold Core', location=guess, time_unlocked=now + dt.timedelta(hours=1), submitter='', time_submitted=now,
+                    pingChannelId=0, roleMention='', time_to_ping=now + dt.timedelta(hours=1, seconds=-seconds),
+                )
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f'{home_map} {name:>6}: {n_reminders} reminders, p50 {statistics.median(latencies)*1e6:.0f}us, '
+                  f'p99 {latencies[int(len(latencies)*0.99)]*1e6:.0f}us, max {latencies[-1]*1e6:.0f}us')
+        print(f'{home_map} table built in {build_seconds*1000:.1f}ms for {len(names)} maps')
+
+def benchmark_notable_routes(ks: list[int]=(2, 5, 10, 15, 20), max_distance: int=9999):
+    # Pairwise translated_djikstra (old /upcoming) vs one search per source map
+    from utils.bindata import PORTALS_EDGE, ZONES
+    import itertools
+    import random
+    import time
+    routable = sorted({ZONES.get_map_name(node[1]) for node in PORTALS_EDGE} - {None})
+    rng = random.Random(0)
+    for k in ks:
+        maps = rng.sample(routable, k)
+        start = time.perf_counter()
+        pairwise = {pair: translated_djikstra(*pair, max_distance=max_distance) for pair in itertools.combinations(maps, 2)}
+        pairwise_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        batched = translated_djikstra_pairs(maps, max_distance=max_distance)
+        batched_seconds = time.perf_counter() - start
+        assert pairwise == batched
+        print(f'K={k:>2}: pairwise {pairwise_seconds*1000:.1f}ms ({len(pairwise)} searches), '
+              f'batched {batched_seconds*1000:.1f}ms ({k-1} searches), {pairwise_seconds/batched_seconds:.1f}x')
+
+def benchmark_routing_engine(max_distances: list[int]=(9999, 8), sample_pairs: int=2000):
+    # Every map pair in ZONES: reference vs CSR engine one-to-all per source map, routes must be identical
+    # then single pair latency on a sample of pairs
+    from utils.bindata import PORTALS_EDGE, ROUTING_GRAPH
+    import random
+    import time
+    map_ids = sorted({node[1] for node in PORTALS_EDGE})
+    for max_distance in max_distances:
+        reference_seconds = engine_seconds = 0
+        n_routes = 0
+        for map_id in map_ids:
+            start = time.perf_counter()
+            reference = dijkstra_many(PORTALS_EDGE, map_id, set(map_ids), max_distance=max_distance)
+            reference_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            engine = ROUTING_GRAPH.shortest_paths(map_id, set(map_ids), max_distance=max_distance)
+            engine_seconds += time.perf_counter() - start
+            assert reference.keys() == engine.keys()
+            assert all(translate_path(reference[m]) == translate_path(engine[m]) for m in reference)
+            n_routes += len(reference)
+        print(f'max_distance={max_distance}: {len(map_ids)**2} pairs, {n_routes} routes identical, '
+              f'one-to-all reference {reference_seconds:.2f}s, engine {engine_seconds:.2f}s')
+
+    pairs = random.Random(0).choices([(a, b) for a in map_ids for b in map_ids], k=sample_pairs)
+    start = time.perf_counter()
+    [dijkstra(PORTALS_EDGE, a, b) for a, b in pairs]
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    [ROUTING_GRAPH.shortest_path(a, b) for a, b in pairs]
+    engine_seconds = time.perf_counter() - start
+    print(f'{sample_pairs} single pair queries: reference avg {reference_seconds/sample_pairs*1000:.2f}ms, '
+          f'engine avg {engine_seconds/sample_pairs*1000:.2f}ms')
+
+def benchmark_timed_routing(n_roads: list[int]=(5, 20, 50), n_pairs: int=100):
+    # Label pruned search vs dijkstra over every (node, maps crossed) state on random roads with random expiries,
+    # route costs must match, then latency against the untimed search
+    from utils.bindata import PORTALS_EDGE, ZONES, ROUTING_GRAPH
+    import random
+    import time
+    rng = random.Random(0)
+    now = dt.datetime.now(dt.timezone.utc)
+    map_ids = sorted({node[1] for node in PORTALS_EDGE})
+    road_maps = [name for name in ZONES.name_map if ZONES.get_map_id(name)]
+    graph = ROUTING_GRAPH
+    def path_cost(path: list[tuple], overlay: dict) -> float:
+        # None if the path takes a road after it expired
+        ids = [graph.node_ids[node] for node in path]
+        cost = maps = 0
+        for a, b in zip(ids, ids[1:]):
+            static = [graph.weights[i] for i in range(graph.offsets[a], graph.offsets[a + 1]) if graph.targets[i] == b]
+            roads = [weight for neighbor, weight, map_limit in overlay.get(a, ()) if neighbor == b and maps < map_limit]
+            if not static + roads:
+                return None
+            cost += min(static + roads)
+            maps += graph.node_maps[a] != graph.node_maps[b]
+        return cost
+    def expanded_cost(start: str, end: str, overlay: dict) -> float:
+        # Past the largest map_limit every state of a node behaves the same, so maps crossed is capped there
+        cap = max((map_limit for edges in overlay.values() for _, _, map_limit in edges), default=0)
+        queue = [(0, 0, node) for node in graph._starting_nodes(start, overlay)]
+        settled = set()
+        while queue:
+            cost, maps, node = heapq.heappop(queue)
+            if graph.node_maps[node] == end:
+                return cost
+            if (node, maps) in settled:
+                continue
+            settled.add((node, maps))
+            edges = [(graph.targets[i], graph.weights[i], math.inf) for i in range(graph.offsets[node], graph.offsets[node + 1])]
+            for neighbor, weight, map_limit in edges + overlay.get(node, []):
+                if maps < map_limit:
+                    heapq.heappush(queue, (cost + weight, min(cap, maps + (graph.node_maps[neighbor] != graph.node_maps[node])), neighbor))
+        return None
+    for n in n_roads:
+        roads = []
+        while len(roads) < n:
+            road = Portal(from_map=rng.choice(road_maps), to_map=rng.choice(road_maps), submitter='', time_submitted=now,
+                          time_expire=now + dt.timedelta(seconds=rng.randrange(0, 20) * config['secondsPerMap']))
+            try:
+                make_additional_graph([road])
+            except (KeyError, IndexError):
+                continue
+            roads.append(road)
+        overlay = graph.make_overlay(make_additional_graph(roads))
+        timed_overlay = get_timed_overlay(roads, now, get_world())
+        pairs = [tuple(rng.sample(map_ids, 2)) for _ in range(n_pairs)]
+        start = time.perf_counter()
+        [graph.shortest_path(a, b, overlay) for a, b in pairs]
+        untimed_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        timed = [graph.timed_shortest_path(a, b, timed_overlay) for a, b in pairs]
+        timed_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = [expanded_cost(a, b, timed_overlay) for a, b in pairs]
+        expanded_seconds = time.perf_counter() - start
+        assert all(math.isclose(path_cost(path, timed_overlay), cost) if path else cost is None for path, cost in zip(timed, expected))
+        print(f'{n:>2} roads: untimed avg {untimed_seconds/n_pairs*1000:.2f}ms, timed avg {timed_seconds/n_pairs*1000:.2f}ms, '
+              f'time expanded avg {expanded_seconds/n_pairs*1000:.2f}ms, {n_pairs} route costs identical')
+
+def benchmark_astar(n_roads: list[int]=(0, 5, 10, 20, 50), n_pairs: int=500):
+    # Dijkstra vs landmark A* on random pairs with random player road overlays
+    from utils.bindata import PORTALS_EDGE, ZONES, ROUTING_GRAPH, LANDMARKS
+    import random
+    import time
+    rng = random.Random(0)
+    map_ids = sorted({node[1] for node in PORTALS_EDGE})
+    road_maps = [name for name in ZONES.name_map if ZONES.get_map_id(name)]
+    for n in n_roads:
+        roads = []
+        while len(roads) < n:
+            road = Portal(from_map=rng.choice(road_maps), to_map=rng.choice(road_maps), time_expire=0, submitter='', time_submitted=0)
+            try:
+                make_additional_graph([road])
+            except (KeyError, IndexError):
+                continue
+            roads.append(road)
+        overlay = ROUTING_GRAPH.make_overlay(make_additional_graph(roads))
+        pairs = [tuple(rng.sample(map_ids, 2)) for _ in range(n_pairs)]
+        start = time.perf_counter()
+        dijkstra_routes = [translate_path(ROUTING_GRAPH.shortest_path(a, b, overlay)) for a, b in pairs]
+        dijkstra_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        astar_routes = [translate_path(ROUTING_GRAPH.astar_path(a, b, LANDMARKS, overlay)) for a, b in pairs]
+        astar_seconds = time.perf_counter() - start
+        same = sum(d == a for d, a in zip(dijkstra_routes, astar_routes))
+        print(f'{n:>2} roads ({len(overlay)} overlay nodes): dijkstra avg {dijkstra_seconds/n_pairs*1000:.2f}ms, '
+              f'A* avg {astar_seconds/n_pairs*1000:.2f}ms, {same}/{n_pairs} identical routes')
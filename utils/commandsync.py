@@ -0,0 +1,46 @@
+from pathlib import Path
+import hashlib
+import json
+
+import discord
+
+from config import config
+from logger import info, warning
+
+# Hash of the last synced command schema and the ids Discord gave the commands, deleting it forces a sync
+COMMAND_SYNC_PATH = Path(config.get('commandSyncPath', Path(__file__).parent.parent / '.command-sync.json'))
+
+def command_schema_hash(application_id: int, commands: list[discord.ApplicationCommand]) -> str:
+    schema = {'application_id': application_id, 'commands': sorted((cmd.to_dict() for cmd in commands), key=lambda c: c['name'])}
+    return hashlib.sha256(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+
+def load_sync_state() -> dict:
+    try:
+        with open(COMMAND_SYNC_PATH, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        warning(f"No usable command sync state at {COMMAND_SYNC_PATH}: {e}")
+        return {}
+
+def save_sync_state(state: dict) -> None:
+    tmp_path = Path(f'{COMMAND_SYNC_PATH}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    tmp_path.replace(COMMAND_SYNC_PATH)
+
+async def sync_commands_if_changed(bot: discord.Bot) -> bool:
+    # Unchanged schema: Discord already has these commands, only the ids are needed to route interactions to them
+    commands = bot.pending_application_commands
+    digest = command_schema_hash(bot.application_id, commands)
+    state = load_sync_state()
+    ids = state.get('ids', {})
+    if state.get('hash') == digest and set(ids) == {cmd.name for cmd in commands}:
+        for cmd in commands:
+            cmd.id = ids[cmd.name]
+            bot._application_commands[cmd.id] = cmd
+        info(f"Command schema unchanged ({digest[:12]}), skipped sync")
+        return False
+    await bot.sync_commands()
+    save_sync_state({'hash': digest, 'ids': {cmd.name: cmd.id for cmd in commands}})
+    info(f"Synced {len(commands)} commands, schema {digest[:12]}")
+    return True
@@ -1,24 +1,33 @@
-from config import config
+from config import CONFIG_FILE_PATH
 from discord import ApplicationContext
 import functools
 from logger import info, warning
+from models.guildregistry import GuildRegistry
+from utils.bindata import DEFAULT_REGION, get_world
+
+def resolve_map_id(name: str, region: str) -> str:
+    zones = get_world(region).zones
+    return zones.get_map_id(name) if name in zones.name_map else None
+
+# Compiled from config.json's approvedServers, main reloads it when the file changes
+GUILDS = GuildRegistry(CONFIG_FILE_PATH, DEFAULT_REGION, resolve_map_id)
+GUILDS.reload_if_changed()
 
 def ctx_info(ctx: ApplicationContext) -> str:
-    alias = ''
-    if config['approvedServers'].get(str(ctx.guild_id), None) is not None:
-        alias = f' ({config['approvedServers'][str(ctx.guild_id)]['name']})'
+    guild = GUILDS.get(ctx.guild_id)
+    alias = guild.alias if guild is not None else ''
     return f'{ctx.author.name} [{ctx.author.id}] - {ctx.guild}{alias} [{ctx.guild_id}]'
 
 def requires_approved(func):
     @functools.wraps(func)
     async def wrapper(ctx: ApplicationContext, *args, **kwargs):
-        server_data = config['approvedServers'].get(str(ctx.guild_id), None)
+        guild = GUILDS.get(ctx.guild_id)
         cmd = f'/{ctx.command} ' + ' '.join(str(v) for v in kwargs.values())
-        if server_data is None:
+        if guild is None:
             warning(f"{ctx_info(ctx)} Unapproved server sent {cmd}")
             await ctx.respond("This server is not approved to use this command.")
             return
         info(f"{ctx_info(ctx)} Approved server sent {cmd}")
-        ctx.server_data = server_data
+        ctx.guild_config = guild
         return await func(ctx, *args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
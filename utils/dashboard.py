@@ -0,0 +1,112 @@
+from pathlib import Path
+import asyncio
+import datetime as dt
+import json
+from typing import Awaitable, Callable, Iterable
+
+from config import config
+from logger import debug, error, warning
+from models.guildregistry import GuildConfig
+
+# guild_id -> [channel_id, message_id] of each pinned dashboard, so a restart edits the same message instead of
+# adopting whatever the bot has pinned in the channel
+DASHBOARD_STATE_PATH = Path(config.get('dashboardStatePath', Path(__file__).parent.parent / '.dashboards.json'))
+
+def utc_now():
+    return dt.datetime.now(dt.timezone.utc)
+
+def load_dashboard_ids() -> dict[str, list[int]]:
+    try:
+        with open(DASHBOARD_STATE_PATH, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        warning(f"Unreadable dashboard state at {DASHBOARD_STATE_PATH}, new dashboards will be pinned: {e}")
+        return {}
+
+def save_dashboard_ids(ids: dict[str, list[int]]) -> None:
+    tmp_path = Path(f'{DASHBOARD_STATE_PATH}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(ids, f)
+    tmp_path.replace(DASHBOARD_STATE_PATH)
+
+class UpcomingDashboards:
+    # Each guild's /upcoming render is cached, keyed on the versions of what it is built from and valid until the
+    # first portal on its routes expires. Guilds that opted in get one pinned message edited in place, a burst of
+    # changes is coalesced into one edit and unchanged renders are never sent
+    def __init__(
+        self, key: Callable[[GuildConfig], tuple], render: Callable[[GuildConfig], tuple[str, dt.datetime]],
+        publish: Callable[[GuildConfig, str], Awaitable], debounce_seconds: float=2,
+        clock: Callable[[], dt.datetime]=utc_now, sleep: Callable[[float], Awaitable]=asyncio.sleep,
+    ) -> None:
+        self.key = key
+        self.render = render
+        self.publish = publish
+        self.debounce_seconds = debounce_seconds
+        # Every wait goes through clock and sleep, tests drive the loop with a fake pair
+        self.clock = clock
+        self.sleep = sleep
+        # guild_id -> (key, text, valid_until)
+        self.renders: dict[int, tuple[tuple, str, dt.datetime]] = {}
+        self.published: dict[int, str] = {}
+        self.wakeup = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild: GuildConfig, now: dt.datetime=None) -> str:
+        now = now or self.clock()
+        key = self.key(guild)
+        cached = self.renders.get(guild.guild_id)
+        if cached is not None and cached[0] == key and (cached[2] is None or now < cached[2]):
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        text, valid_until = self.render(guild)
+        self.renders[guild.guild_id] = (key, text, valid_until)
+        return text
+
+    def notify(self) -> None:
+        # Reminders or portals changed somewhere, dashboards whose key moved are edited after the debounce
+        self.wakeup.set()
+
+    def next_deadline(self, guilds: Iterable[GuildConfig]) -> dt.datetime:
+        deadlines = [self.renders[guild.guild_id][2] for guild in guilds if guild.guild_id in self.renders]
+        return min((d for d in deadlines if d is not None), default=None)
+
+    async def refresh(self, guilds: Iterable[GuildConfig]) -> int:
+        edits = 0
+        for guild in guilds:
+            text = self.get(guild)
+            if self.published.get(guild.guild_id) == text:
+                continue
+            try:
+                await self.publish(guild, text)
+            except Exception as e:
+                error(f"Failed to update the dashboard of {guild.name} [{guild.guild_id}]")
+                error(e)
+                continue
+            self.published[guild.guild_id] = text
+            edits += 1
+        return edits
+
+    async def wait(self, timeout: float=None) -> None:
+        # Until notify() or timeout seconds, whichever comes first. None waits for notify() alone
+        waiters = [asyncio.ensure_future(self.wakeup.wait())]
+        if timeout is not None:
+            waiters.append(asyncio.ensure_future(self.sleep(timeout)))
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def run(self, guilds: Callable[[], Iterable[GuildConfig]]) -> None:
+        while True:
+            self.wakeup.clear()
+            dashboards = list(guilds())
+            edits = await self.refresh(dashboards)
+            debug("Refreshed %d dashboards, %d edited", len(dashboards), edits)
+            deadline = self.next_deadline(dashboards)
+            await self.wait(None if deadline is None else max(0, (deadline - self.clock()).total_seconds()))
+            await self.sleep(self.debounce_seconds)
@@ -0,0 +1,40 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
+
+from logger import debug, error
+
+class PingDispatcher:
+    # One FIFO per channel so a slow/rate limited channel only delays its own pings,
+    # total in-flight sends across all channels are bounded by max_workers
+    def __init__(self, send: Callable[[int, str], Awaitable], max_workers: int=8) -> None:
+        self.send = send
+        self.semaphore = asyncio.Semaphore(max_workers)
+        self.queues: dict[int, deque[str]] = {}
+        self.workers: dict[int, asyncio.Task] = {}
+
+    def submit(self, channel_id: int, msg: str) -> None:
+        self.queues.setdefault(channel_id, deque()).append(msg)
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+
+    async def _drain(self, channel_id: int) -> None:
+        queue = self.queues[channel_id]
+        try:
+            while queue:
+                msg = queue.popleft()
+                async with self.semaphore:
+                    try:
+                        await self.send(channel_id, msg)
+                    except Exception as e:
+                        error(f"Failed to send ping to channel {channel_id}")
+                        error(e)
+        finally:
+            del self.workers[channel_id]
+            if not queue:
+                del self.queues[channel_id]
+            debug("Ping queue for channel %s drained", channel_id)
+
+    async def join(self) -> None:
+        while self.workers:
+            await asyncio.gather(*self.workers.values())
@@ -0,0 +1,149 @@
+import datetime as dt
+import heapq
+from typing import Iterable
+
+from utils.bindata import get_world, WorldData
+from models.dbmodels import Portal
+
+def utc_now():
+    return dt.datetime.now(dt.timezone.utc)
+
+def make_expiry_overlay(world: WorldData, portals: Iterable[Portal]) -> dict[int, list[tuple[int, int, dt.datetime]]]:
+    # Overlay edges carrying the latest time_expire of the portals linking the pair
+    node_ids = world.routing_graph.node_ids
+    latest: dict[tuple[int, int], dt.datetime] = {}
+    for portal in portals:
+        node1, node2 = node_ids[world.zones.get_portal(portal.from_map)], node_ids[world.zones.get_portal(portal.to_map)]
+        for edge in ((node1, node2), (node2, node1)):
+            latest[edge] = max(latest.get(edge, portal.time_expire), portal.time_expire)
+    overlay = {}
+    for (node1, node2), time_expire in latest.items():
+        overlay.setdefault(node1, []).append((node2, 0, time_expire))
+    return overlay
+
+class PortalGraphCache:
+    # Player submitted roads kept as a ready-made additional_graph for dijkstra
+    # graph: {portal_node: {portal_node: 0}}, several portals may link the same pair of maps
+    def __init__(self, region: str=None) -> None:
+        self.world = get_world(region)
+        self.portals: dict[str, Portal] = {}
+        self.graph: dict[tuple, dict[tuple, int]] = {}
+        self.edge_counts: dict[frozenset, int] = {}
+        # (from_map, to_map) -> portals submitted that way, in submission order
+        self.pairs: dict[tuple[str, str], dict[str, Portal]] = {}
+        self.expiry: list[tuple[dt.datetime, str]] = []
+        # Version each portal was last added/removed at, a reconcile only trusts its snapshot for older changes
+        self.added: dict[str, int] = {}
+        self.removed: dict[str, int] = {}
+        self.version = 0
+        self.overlay: dict = {}
+        self.overlay_version = 0
+        self.expiry_overlay: dict = {}
+        self.expiry_overlay_version = 0
+
+    def __len__(self) -> int:
+        return len(self.portals)
+
+    def _link(self, portal: Portal) -> None:
+        node1, node2 = self.world.zones.get_portal(portal.from_map), self.world.zones.get_portal(portal.to_map)
+        edge = frozenset((node1, node2))
+        self.pairs.setdefault((portal.from_map, portal.to_map), {})[str(portal.id)] = portal
+        self.edge_counts[edge] = self.edge_counts.get(edge, 0) + 1
+        self.graph.setdefault(node1, {})[node2] = 0
+        self.graph.setdefault(node2, {})[node1] = 0
+
+    def _unlink(self, portal: Portal) -> None:
+        node1, node2 = self.world.zones.get_portal(portal.from_map), self.world.zones.get_portal(portal.to_map)
+        edge = frozenset((node1, node2))
+        pair = self.pairs[(portal.from_map, portal.to_map)]
+        del pair[str(portal.id)]
+        if not pair:
+            del self.pairs[(portal.from_map, portal.to_map)]
+        self.edge_counts[edge] -= 1
+        if self.edge_counts[edge]:
+            return
+        del self.edge_counts[edge]
+        for a, b in ((node1, node2), (node2, node1)):
+            self.graph[a].pop(b, None)
+            if not self.graph[a]:
+                del self.graph[a]
+
+    def load(self, portals: Iterable[Portal], since_version: int=None) -> None:
+        # Portals added after since_version were not part of the snapshot and are kept,
+        # ones removed after it may still be in the snapshot and are dropped
+        kept, removed = [], set()
+        if since_version is not None:
+            kept = [p for pid, p in self.portals.items() if self.added.get(pid, -1) > since_version]
+            removed = {pid for pid, version in self.removed.items() if version > since_version}
+        self.portals, self.graph, self.edge_counts, self.pairs, self.added, self.removed = {}, {}, {}, {}, {}, {}
+        for portal in list(portals) + kept:
+            if str(portal.id) in self.portals or str(portal.id) in removed:
+                continue
+            self.portals[str(portal.id)] = portal
+            self._link(portal)
+        self.added = {str(p.id): self.version for p in kept}
+        self.expiry = [(p.time_expire, pid) for pid, p in self.portals.items()]
+        heapq.heapify(self.expiry)
+        self.version += 1
+
+    def add(self, portal: Portal) -> None:
+        pid = str(portal.id)
+        if pid in self.portals:
+            self.remove(pid)
+        self.version += 1
+        self.portals[pid] = portal
+        self.added[pid] = self.version
+        self.removed.pop(pid, None)
+        self._link(portal)
+        heapq.heappush(self.expiry, (portal.time_expire, pid))
+
+    def remove(self, portal_id) -> Portal:
+        pid = str(portal_id)
+        portal = self.portals.pop(pid, None)
+        self.added.pop(pid, None)
+        self.version += 1
+        self.removed[pid] = self.version
+        if portal is not None:
+            self._unlink(portal)
+        return portal
+
+    def expire(self, now: dt.datetime=None) -> list[Portal]:
+        now = now or utc_now()
+        expired = []
+        while self.expiry and self.expiry[0][0] < now:
+            time_expire, pid = heapq.heappop(self.expiry)
+            portal = self.portals.get(pid)
+            if portal is not None and portal.time_expire == time_expire:
+                expired.append(self.remove(pid))
+        return expired
+
+    def find_portal(self, map1: str, map2: str, now: dt.datetime=None) -> Portal:
+        # Same pick as Portals.find_portal, the first one submitted map1 -> map2, else map2 -> map1
+        self.expire(now)
+        for pair in ((map1, map2), (map2, map1)):
+            if pair in self.pairs:
+                return next(iter(self.pairs[pair].values()))
+        return None
+
+    def get_graph(self, now: dt.datetime=None) -> dict:
+        self.expire(now)
+        return self.graph
+
+    def get_roads(self, now: dt.datetime=None) -> list[Portal]:
+        self.expire(now)
+        return list(self.portals.values())
+
+    def get_overlay(self, now: dt.datetime=None) -> dict:
+        # The graph interned for the region's routing graph, rebuilt only when the portal set changed
+        self.expire(now)
+        if self.overlay_version != self.version:
+            self.overlay = self.world.routing_graph.make_overlay(self.graph)
+            self.overlay_version = self.version
+        return self.overlay
+
+    def get_expiry_overlay(self, now: dt.datetime=None) -> dict:
+        self.expire(now)
+        if self.expiry_overlay_version != self.version:
+            self.expiry_overlay = make_expiry_overlay(self.world, self.portals.values())
+            self.expiry_overlay_version = self.version
+        return self.expiry_overlay
@@ -0,0 +1,161 @@
+import asyncio
+import datetime as dt
+import heapq
+from typing import Iterable
+
+from models.dbmodels import Reminder
+
+def utc_now():
+    return dt.datetime.now(dt.timezone.utc)
+
+class ReminderScheduler:
+    # Heap entries are (time_to_ping, reminder_id), stale entries are skipped lazily
+    def __init__(self) -> None:
+        self.heap: list[tuple[dt.datetime, str]] = []
+        self.reminders: dict[str, Reminder] = {}
+        # Version each reminder was last added/removed at, a reconcile only trusts its snapshot for older changes
+        self.added: dict[str, int] = {}
+        self.removed: dict[str, int] = {}
+        self.version = 0
+        # Bumped whenever a channel's pending reminders change, what the channel's /upcoming render is keyed on
+        self.channel_versions: dict[int, int] = {}
+        self.wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.reminders)
+
+    def _touch(self, reminder: Reminder) -> None:
+        self.channel_versions[reminder.pingChannelId] = self.channel_versions.get(reminder.pingChannelId, 0) + 1
+
+    def channel_reminders(self, channel_id: int) -> list[Reminder]:
+        return sorted((r for r in self.reminders.values() if r.pingChannelId == channel_id), key=lambda r: r.time_to_ping)
+
+    def load(self, reminders: Iterable[Reminder], since_version: int=None) -> None:
+        # Reminders added after since_version were not part of the snapshot and are kept,
+        # ones removed after it may still be in the snapshot and are dropped
+        kept, removed = {}, set()
+        if since_version is not None:
+            kept = {rid: r for rid, r in self.reminders.items() if self.added.get(rid, -1) > since_version}
+            removed = {rid for rid, version in self.removed.items() if version > since_version}
+        reminders = {str(r.id): r for r in reminders if str(r.id) not in removed} | kept
+        for rid in reminders.keys() | self.reminders.keys():
+            if reminders.get(rid) != self.reminders.get(rid):
+                self._touch(reminders.get(rid) or self.reminders[rid])
+        self.reminders = reminders
+        self.added = {rid: self.added[rid] for rid in kept}
+        self.removed = {}
+        self.heap = [(r.time_to_ping, rid) for rid, r in self.reminders.items()]
+        heapq.heapify(self.heap)
+        self.wakeup.set()
+
+    def add(self, reminder: Reminder) -> None:
+        rid = str(reminder.id)
+        self.version += 1
+        previous = self.reminders.get(rid)
+        if previous is not None:
+            self._touch(previous)
+        self.reminders[rid] = reminder
+        self.added[rid] = self.version
+        self.removed.pop(rid, None)
+        self._touch(reminder)
+        heapq.heappush(self.heap, (reminder.time_to_ping, rid))
+        self.wakeup.set()
+
+    def remove(self, reminder_id) -> None:
+        rid = str(reminder_id)
+        self.version += 1
+        self.added.pop(rid, None)
+        self.removed[rid] = self.version
+        reminder = self.reminders.pop(rid, None)
+        if reminder is not None:
+            self._touch(reminder)
+            self.wakeup.set()
+
+    def _is_live(self, entry: tuple[dt.datetime, str]) -> bool:
+        reminder = self.reminders.get(entry[1])
+        return reminder is not None and reminder.time_to_ping == entry[0]
+
+    def next_deadline(self) -> dt.datetime:
+        while self.heap and not self._is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: dt.datetime) -> list[Reminder]:
+        due = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, rid = heapq.heappop(self.heap)
+            self.version += 1
+            self.added.pop(rid, None)
+            self.removed[rid] = self.version
+            due.append(self.reminders.pop(rid))
+            self._touch(due[-1])
+        return due
+
+    async def wait(self, now: dt.datetime, max_wait_seconds: float=None) -> None:
+        # Sleeps until the next deadline, or until the heap changes
+        self.wakeup.clear()
+        deadline = self.next_deadline()
+        timeout = max_wait_seconds
+        if deadline is not None:
+            timeout = max(0, (deadline - now).total_seconds())
+            if max_wait_seconds is not None:
+                timeout = min(timeout, max_wait_seconds)
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def benchmark_scheduler(n_reminders: int=40, window_seconds: float=3, poll_interval_seconds: float=1):
+    # Old polling loop vs heap scheduler against a counting in-memory repository
+    import random
+    import statistics
+
+    class CountingRepo:
+        def __init__(self, reminders: list[Reminder]) -> None:
+            self.reminders = {str(r.id): r for r in reminders}
+            self.round_trips = 0
+
+        def find_by(self, query: dict) -> list[Reminder]:
+            self.round_trips += 1
+            if 'time_to_ping' in query:
+                return [r for r in self.reminders.values() if r.time_to_ping < query['time_to_ping']['$lt']]
+            return list(self.reminders.values())
+
+        def delete(self, reminder: Reminder) -> None:
+            self.round_trips += 1
+            self.reminders.pop(str(reminder.id), None)
+
+    def make_reminders(start: dt.datetime) -> list[Reminder]:
+        rng = random.Random(0)
+        return [Reminder(
+            id=f'{i:024x}', objective='Benchmark', location='Nowhere', time_unlocked=start, submitter='benchmark',
+            time_submitted=start, pingChannelId=0, roleMention='',
+            time_to_ping=start + dt.timedelta(seconds=rng.uniform(0, window_seconds)),
+        ) for i in range(n_reminders)]
+
+    async def polling_loop(repo: CountingRepo, lateness: list[float]):
+        while repo.reminders:
+            now = utc_now()
+            for reminder in repo.find_by({'time_to_ping': {'$lt': now}}):
+                lateness.append((utc_now() - reminder.time_to_ping).total_seconds())
+                repo.delete(reminder)
+            await asyncio.sleep(poll_interval_seconds)
+
+    async def scheduled_loop(repo: CountingRepo, lateness: list[float]):
+        scheduler = ReminderScheduler()
+        scheduler.load(repo.find_by({}))
+        while len(scheduler):
+            await scheduler.wait(utc_now())
+            for reminder in scheduler.pop_due(utc_now()):
+                lateness.append((utc_now() - reminder.time_to_ping).total_seconds())
+                repo.delete(reminder)
+
+    for name, loop in (('polling', polling_loop), ('scheduler', scheduled_loop)):
+        repo, lateness = CountingRepo(make_reminders(utc_now())), []
+        asyncio.run(loop(repo, lateness))
+        print(f'{name:>10}: lateness avg {statistics.mean(lateness)*1000:.2f}ms, '
+              f'max {max(lateness)*1000:.2f}ms, {repo.round_trips} DB round-trips for {n_reminders} reminders')
+
+if __name__ == "__main__":
+    benchmark_scheduler()